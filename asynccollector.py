@@ -0,0 +1,47 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from jsoncodec import decodeResponse
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".asynccollector")
+
+
+# The AsyncCollector runs requests against a single target from an asyncio event loop, with at most maxInFlight of
+# them outstanding at any time. The HTTP calls themselves go through the pooled, digest authenticated session of the
+# target on a thread pool of the same size, so they share its keep-alive connections and nonce. Responses are parsed
+# on the worker thread, the event loop only sees the resulting json.
+class AsyncCollector(object):
+    def __init__(self, session, maxInFlight=8):
+        self._session = session
+        self._maxInFlight = maxInFlight
+        self._executor = ThreadPoolExecutor(max_workers=maxInFlight)
+        self._semaphore = None
+
+    @property
+    def maxInFlight(self):
+        return self._maxInFlight
+
+    def _getJson(self, url):
+        response = self._session.get(url)
+        sampleTime = datetime.utcnow()
+
+        return decodeResponse(response), sampleTime
+
+    async def fetchJson(self, url):
+        # Created on first use, so that it belongs to the loop that is running the collection
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._maxInFlight)
+
+        async with self._semaphore:
+            logger.debug("Requesting {0}".format(url))
+            return await asyncio.get_event_loop().run_in_executor(self._executor, self._getJson, url)
+
+    async def runInExecutor(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, function, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
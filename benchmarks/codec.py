@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from jsoncodec import getAvailableCodecs
+from wildfly.monitor import BeanMonitor
+from payloads import makeSubsystemJson, loadSubsystemJson
+
+# Measures the json handling of a cycle on a large recursive read-resource response of the ejb3 subsystem: parsing the
+# response, as requests did it from the pretty printed response, and as each of the installed codecs does it from the
+# compact response, and serialising the bulk body of the documents of the cycle, as text then encoded, and as bytes by
+# each codec. Run it as "python benchmarks/codec.py [--methods N] [--payload dmr.json]".
+
+
+def timeIt(function, minSeconds):
+    # The best of five rounds, each running the function for at least minSeconds
+    best = None
+
+    for repeat in range(5):
+        rounds = 0
+        startTime = time.perf_counter()
+
+        while rounds == 0 or (time.perf_counter() - startTime) < minSeconds:
+            function()
+            rounds += 1
+
+        elapsed = (time.perf_counter() - startTime) / rounds
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def makeResponse(content):
+    response = requests.models.Response()
+    response._content = content
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+
+    return response
+
+
+def buildDocuments(beans):
+    sampleTime = datetime(2020, 1, 1)
+    documents = list()
+
+    for beanName, beanJson in beans.items():
+        beanMonitor = BeanMonitor(beanName)
+        beanMonitor.updateStats(beanJson, sampleTime)
+        beanMonitor.updateStats(beanJson, sampleTime + timedelta(seconds=5))
+
+        fields = {"bean-name": beanName, "sample-time": beanMonitor.formattedSampleTime,
+                  "wildfly-host-url": "http://localhost:9990", "monitor-name": "wildfly-monitor"}
+        documents.append(beanMonitor.buildDocument("bean-", fields))
+
+        for methodMonitor in beanMonitor.methods.values():
+            methodStats = methodMonitor.buildDocument("method-", fields)
+            methodStats["method-name"] = methodMonitor.name
+            documents.append(methodStats)
+
+    return documents
+
+
+def printResult(name, seconds, baseline):
+    print("  {0:<36} {1:>10.3f} ms {2:>8.2f}x".format(name, seconds * 1000, baseline / seconds))
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmarks the json codecs of the wildfly reporter")
+    parser.add_argument("--methods", type=int, default=20000, help="methods in the generated response")
+    parser.add_argument("--payload", default="", help="a recorded ejb3 subsystem read-resource response to use")
+    parser.add_argument("--min-time", type=float, default=0.5, help="minimum seconds pr. round")
+    args = parser.parse_args()
+
+    if args.payload:
+        beans = loadSubsystemJson(args.payload, args.methods)
+    else:
+        beans = makeSubsystemJson(args.methods, 1)
+
+    responseJson = {"outcome": "success", "result": {"stateless-session-bean": beans}}
+    # "json.pretty" has wildfly indent its responses
+    prettyContent = json.dumps(responseJson, indent=4).encode("utf-8")
+    compactContent = json.dumps(responseJson, separators=(",", ":")).encode("utf-8")
+
+    documents = buildDocuments(beans)
+    action = {"index": {"_index": "etel", "_type": "bean-stats"}}
+
+    codecs = getAvailableCodecs()
+
+    print("{0} beans, {1} methods, {2} documents".format(len(beans), len(documents) - len(beans), len(documents)))
+    print("Response: {0} bytes pretty printed, {1} bytes compact".format(len(prettyContent), len(compactContent)))
+
+    print("\nParsing the response")
+    prettyResponse = makeResponse(prettyContent)
+    compactResponse = makeResponse(compactContent)
+    baseline = timeIt(lambda: prettyResponse.json(), args.min_time)
+    printResult("requests .json(), pretty", baseline, baseline)
+    printResult("requests .json(), compact", timeIt(lambda: compactResponse.json(), args.min_time), baseline)
+
+    for codec in codecs:
+        printResult(codec.name + " from bytes, compact",
+                    timeIt(lambda: codec.loads(compactResponse.content), args.min_time), baseline)
+
+    print("\nSerialising the bulk body")
+
+    def textBody():
+        lines = list()
+        for document in documents:
+            lines.append(json.dumps(action))
+            lines.append(json.dumps(document))
+
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    baseline = timeIt(textBody, args.min_time)
+    printResult("json.dumps to text, encoded", baseline, baseline)
+
+    for codec in codecs:
+        def bytesBody():
+            lines = list()
+            for document in documents:
+                lines.append(codec.dumpb(action))
+                lines.append(codec.dumpb(document))
+
+            return b"\n".join(lines) + b"\n"
+
+        printResult(codec.name + " to bytes", timeIt(bytesBody, args.min_time), baseline)
+
+
+if __name__ == "__main__":
+    run()
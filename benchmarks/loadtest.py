@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from simulator import SimulatedWildfly, SimulatedElasticsearch
+
+# Runs wildfly-monitor.py against simulated wildfly targets and a simulated elasticsearch, all on this host, and
+# reports the throughput, the delivery latency and the resources used by the reporter. With more than one target the
+# reporter collects from them through a targets file.
+#
+#   python benchmarks/loadtest.py --beans 200 --methods 20 --targets 1 --duration 120
+#   python benchmarks/loadtest.py --targets 10 --latency 0.05 --error-rate 0.01 --restart-every 300
+#   python benchmarks/loadtest.py --env WILDFLY_COLLECTION_MODE=subsystem --env WILDFLY_STATE_STORE=columnar
+#   python benchmarks/loadtest.py --env DOCUMENT_LAYOUT=bean
+
+benchmarkDirectory = os.path.dirname(os.path.abspath(__file__))
+reporterScript = os.path.join(benchmarkDirectory, "..", "wildfly-monitor.py")
+
+# The lines of the reporter log that summarise its work, they are logged when it stops
+uptimeMarker = "Uptime was"
+summaryMarkers = ("stats:", uptimeMarker)
+
+logger = logging.getLogger("loadtest")
+
+
+def readProcessUsage(pid):
+    # The CPU seconds and resident memory in bytes of a running process, from /proc where there is one
+    try:
+        with open("/proc/{0}/stat".format(pid)) as statFile:
+            fields = statFile.read().rsplit(")", 1)[1].split()
+
+        with open("/proc/{0}/statm".format(pid)) as statmFile:
+            residentPages = int(statmFile.read().split()[1])
+
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpuSeconds = (int(fields[11]) + int(fields[12])) / ticks
+
+        return cpuSeconds, residentPages * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        return None, None
+
+
+def buildReporterEnvironment(args, wildflies, elasticsearch, workDirectory):
+    environment = dict(os.environ)
+    environment.update({
+        "WILDFLY_HOST": "127.0.0.1",
+        "WILDFLY_PORT": str(wildflies[0].port),
+        "WILDFLY_DEPLOYMENT": wildflies[0].deployment,
+        "WILDFLY_SUBDEPLOYMENT": wildflies[0].subdeployment,
+        "WILDFLY_USER": wildflies[0].user,
+        "WILDFLY_PASS": wildflies[0].password,
+        "WILDFLY_COLLECTION_INTERVAL": str(args.interval),
+        "ES_HOST": "127.0.0.1",
+        "ES_PORT": str(elasticsearch.port),
+        "LOG_LEVEL": "INFO",
+        "PYTHONUNBUFFERED": "1"
+    })
+
+    if len(wildflies) > 1:
+        targetsPath = os.path.join(workDirectory, "targets.json")
+
+        with open(targetsPath, "w") as targetsFile:
+            json.dump({"targets": [{
+                "host": "127.0.0.1",
+                "port": str(wildfly.port),
+                "deployment": wildfly.deployment,
+                "subdeployment": wildfly.subdeployment,
+                "alias": "simulated{0}".format(index)
+            } for index, wildfly in enumerate(wildflies)]}, targetsFile, indent=2)
+
+        environment["WILDFLY_TARGETS_FILE"] = targetsPath
+
+    for setting in args.env:
+        key, _, value = setting.partition("=")
+        environment[key] = value
+
+    return environment
+
+
+def runReporter(args, environment, logPath):
+    samples = list()
+
+    with open(logPath, "w") as logFile:
+        startTime = time.monotonic()
+        process = subprocess.Popen([sys.executable, reporterScript], env=environment, stdout=logFile,
+                                   stderr=subprocess.STDOUT)
+
+        while time.monotonic() - startTime < args.duration and process.poll() is None:
+            time.sleep(1)
+            samples.append(readProcessUsage(process.pid))
+
+        if process.poll() is None:
+            # The reporter flushes, disables the statistics and logs its stats on SIGTERM
+            process.send_signal(signal.SIGTERM)
+
+            try:
+                process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+        elapsed = time.monotonic() - startTime
+
+    return process.returncode, elapsed, [sample for sample in samples if sample[0] is not None]
+
+
+def formatBytes(value):
+    return "{0:.1f} MiB".format(value / (1024 * 1024))
+
+
+def report(args, wildflies, elasticsearch, returnCode, elapsed, samples, usage, logPath):
+    print("")
+    print("Load: {0} targets x {1} beans x {2} methods, collected every {3} seconds for {4:.0f} seconds".format(
+        len(wildflies), args.beans, args.methods, args.interval, elapsed))
+    print("Reporter exited with {0}, its log is {1}".format(returnCode, logPath))
+
+    print("")
+    print("Reporter resources:")
+    cpuSeconds = usage.ru_utime + usage.ru_stime
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peakResident = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    print("  CPU {0:.2f} seconds, {1:.1f}% of one core".format(cpuSeconds, cpuSeconds / elapsed * 100))
+    print("  Peak resident memory {0}".format(formatBytes(peakResident)))
+
+    if samples:
+        residents = [resident for cpu, resident in samples]
+        print("  Resident memory mean {0}, last {1}".format(formatBytes(sum(residents) / len(residents)),
+                                                             formatBytes(residents[-1])))
+
+    print("")
+    print("Wildfly targets:")
+    requests = sum(wildfly.requestCounter for wildfly in wildflies)
+    operations = sum(wildfly.operationCounter for wildfly in wildflies)
+    print("  {0} requests ({1:.2f} pr. second), {2} operations, {3} digest challenges".format(
+        requests, requests / elapsed, operations, sum(wildfly.challengeCounter for wildfly in wildflies)))
+    print("  {0} injected failures, {1} restarts".format(sum(wildfly.failureCounter for wildfly in wildflies),
+                                                          sum(wildfly.restartCounter for wildfly in wildflies)))
+
+    for index, wildfly in enumerate(wildflies):
+        histogram = wildfly.latencyHistogram
+        print("  simulated{0} (port {1}): {2} requests, latency mean {3:.4f}, p90 {4:.4f}, max {5:.4f} seconds".format(
+            index, wildfly.port, wildfly.requestCounter, histogram.mean, histogram.percentile(0.9), histogram.max))
+
+    print("")
+    print("Elasticsearch:")
+    print("  {0} documents ({1:.1f} pr. second) in {2} bulk and {3} index requests, {4} injected failures".format(
+        elasticsearch.documentCounter, elasticsearch.documentsPerSecond, elasticsearch.bulkRequestCounter,
+        elasticsearch.indexRequestCounter, elasticsearch.failureCounter))
+    print("  {0} documents refused as already there".format(elasticsearch.duplicateCounter))
+    print("  {0} of documents, {1:.0f} bytes pr. document".format(
+        formatBytes(elasticsearch.documentBytes), elasticsearch.documentBytes / max(1, elasticsearch.documentCounter)))
+    print("  Indices: {0}, templates: {1}".format(
+        ", ".join("{0} ({1})".format(index, count) for index, count in sorted(elasticsearch.indexDocumentCounts.items())),
+        ", ".join(sorted(elasticsearch.templates)) or "none"))
+
+    latency = elasticsearch.deliveryLatency
+    print("  Delivery latency, sample to arrival: mean {0:.3f}, p50 {1:.3f}, p90 {2:.3f}, p99 {3:.3f}, "
+          "max {4:.3f} seconds".format(latency.mean, latency.percentile(0.5), latency.percentile(0.9),
+                                       latency.percentile(0.99), latency.max))
+
+    print("")
+    print("Reporter summary:")
+    with open(logPath) as logFile:
+        lines = logFile.readlines()
+
+    # The stats are logged every few minutes, and on the way out, ending with the uptime. Only the last are of interest
+    uptimeLines = [index for index, line in enumerate(lines) if uptimeMarker in line]
+    if len(uptimeLines) > 1:
+        lines = lines[uptimeLines[-2] + 1:]
+
+    for line in lines:
+        if any(marker in line for marker in summaryMarkers):
+            print("  " + line.split(" - ", 1)[-1].rstrip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the wildfly reporter against simulated wildfly targets and "
+                                                 "elasticsearch, and reports its throughput and resource usage")
+    parser.add_argument("--beans", type=int, default=50, help="stateless beans pr. target")
+    parser.add_argument("--methods", type=int, default=10, help="methods pr. bean")
+    parser.add_argument("--targets", type=int, default=1)
+    parser.add_argument("--active-fraction", type=float, default=0.5, help="share of methods being invoked")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run the reporter for")
+    parser.add_argument("--interval", type=float, default=5, help="the collection interval of the reporter")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every wildfly request")
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of wildfly requests failing")
+    parser.add_argument("--restart-every", type=float, default=0, help="seconds between simulated restarts")
+    parser.add_argument("--es-latency", type=float, default=0.0)
+    parser.add_argument("--es-error-rate", type=float, default=0.0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="environment setting of the reporter, may be repeated")
+    parser.add_argument("--log", default="", help="where to write the reporter log, default a temporary file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    wildflies = [SimulatedWildfly(args.beans, args.methods, activeFraction=args.active_fraction,
+                                  latency=args.latency, latencyJitter=args.latency_jitter, errorRate=args.error_rate,
+                                  restartInterval=args.restart_every) for index in range(args.targets)]
+    elasticsearch = SimulatedElasticsearch(args.es_latency, args.es_error_rate)
+
+    for wildfly in wildflies:
+        wildfly.start()
+    elasticsearch.start()
+
+    workDirectory = tempfile.mkdtemp(prefix="wildfly-loadtest-")
+    logPath = args.log or os.path.join(workDirectory, "reporter.log")
+
+    try:
+        environment = buildReporterEnvironment(args, wildflies, elasticsearch, workDirectory)
+        logger.info("Running the reporter for {0} seconds".format(args.duration))
+
+        returnCode, elapsed, samples = runReporter(args, environment, logPath)
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        report(args, wildflies, elasticsearch, returnCode, elapsed, samples, usage, logPath)
+    finally:
+        for wildfly in wildflies:
+            wildfly.stop()
+        elasticsearch.stop()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import logging
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from wildfly.monitor import BeanMonitor
+from payloads import makeSubsystemJson, methodsPerBean
+
+# Measures the cost pr. sample of the bean and method monitors, updating them from a subsystem read and building the
+# elasticsearch documents of the sample, as done every cycle. Run it as "python benchmarks/monitors.py [methods]".
+
+cycles = 10
+
+
+def buildDocuments(beanMonitors):
+    documents = 0
+
+    for beanMonitor in beanMonitors.values():
+        if not beanMonitor.reportToElasticsearch:
+            continue
+
+        fields = {
+            "bean-name": beanMonitor.name,
+            "sample-time": beanMonitor.formattedSampleTime,
+            "wildfly-host-url": "http://localhost:9990",
+            "monitor-name": "wildfly-monitor"
+        }
+        beanMonitor.buildDocument("bean-", fields)
+        documents += 1
+
+        for methodMonitor in beanMonitor.methods.values():
+            if methodMonitor.reportToElasticsearch:
+                methodStats = methodMonitor.buildDocument("method-", fields)
+                methodStats["method-name"] = methodMonitor.name
+                documents += 1
+
+    return documents
+
+
+def run(methodCount):
+    logging.basicConfig(level=logging.INFO)
+
+    samples = [makeSubsystemJson(methodCount, cycle) for cycle in range(cycles + 1)]
+    beanCount = len(samples[0])
+    sampleTime = datetime.utcnow()
+
+    beanMonitors = dict()
+    for beanName in samples[0]:
+        beanMonitors[beanName] = BeanMonitor(beanName)
+        beanMonitors[beanName].updateStats(samples[0][beanName], sampleTime)
+
+    updateSeconds = 0
+    documentSeconds = 0
+    documents = 0
+
+    for cycle in range(1, cycles + 1):
+        sampleTime += timedelta(seconds=5)
+
+        startTime = time.perf_counter()
+        for beanName, beanJson in samples[cycle].items():
+            beanMonitors[beanName].updateStats(beanJson, sampleTime)
+        updateSeconds += time.perf_counter() - startTime
+
+        startTime = time.perf_counter()
+        documents += buildDocuments(beanMonitors)
+        documentSeconds += time.perf_counter() - startTime
+
+    sampleCount = cycles * beanCount * (methodsPerBean + 1)
+
+    print("{0} beans, {1} methods, {2} cycles".format(beanCount, beanCount * methodsPerBean, cycles))
+    print("updateStats:     {0:.3f} us pr. sample".format(updateSeconds / sampleCount * 1e6))
+    print("buildDocument:   {0:.3f} us pr. document ({1} documents)".format(documentSeconds / documents * 1e6,
+                                                                             documents))
+    print("cycle:           {0:.2f} ms".format((updateSeconds + documentSeconds) / cycles * 1000))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,84 @@
+import json
+
+# Generates, or loads recorded, DMR payloads for the benchmarks, shaped as the "result" of a recursive read-resource of
+# the ejb3 subsystem: the stateless-session-bean map of a subdeployment, each bean with its methods map.
+
+methodsPerBean = 20
+
+
+def makeStatsJson(invocations):
+    return {
+        "execution-time": invocations * 3,
+        "invocations": invocations,
+        "peak-concurrent-invocations": 1,
+        "wait-time": invocations // 2
+    }
+
+
+def makeBeanJson(methodCount, cycle, seed=0):
+    methods = dict()
+
+    for methodIndex in range(methodCount):
+        # Every other method is active in a cycle, so both the changed and the settled paths are exercised
+        methods["method{0}".format(methodIndex)] = makeStatsJson(cycle * (methodIndex % 2) + seed)
+
+    beanJson = makeStatsJson(cycle * 10 + seed)
+    beanJson.update({
+        "component-class-name": "com.example.Bean",
+        "declared-roles": [],
+        "pool-available-count": 20,
+        "pool-current-size": 0,
+        "pool-max-size": 20,
+        "security-domain": "other",
+        "methods": methods
+    })
+
+    return beanJson
+
+
+def makeSubsystemJson(methodCount, cycle, beanMethods=methodsPerBean):
+    beanMethods = max(1, min(beanMethods, methodCount))
+    beans = dict()
+
+    for beanIndex in range(max(1, methodCount // beanMethods)):
+        beans["Bean{0}".format(beanIndex)] = makeBeanJson(beanMethods, cycle, beanIndex)
+
+    return beans
+
+
+def loadSubsystemJson(path, methodCount):
+    # A recorded response is repeated, with renamed beans, until it holds at least methodCount methods
+    with open(path) as payloadFile:
+        responseJson = json.load(payloadFile)
+
+    responseJson = responseJson.get("result", responseJson)
+    recordedBeans = responseJson.get("stateless-session-bean", responseJson) or dict()
+
+    beans = dict()
+    methods = 0
+    copy = 0
+
+    while methods < methodCount and recordedBeans:
+        for beanName, beanJson in recordedBeans.items():
+            beans["{0}-{1}".format(beanName, copy)] = json.loads(json.dumps(beanJson))
+            methods += len(beanJson.get("methods") or dict())
+
+        copy += 1
+
+        if methods == 0:
+            break
+
+    return beans
+
+
+def advanceSubsystemJson(beans, cycle):
+    # The next sample of a loaded payload, every other method and the beans active
+    for beanJson in beans.values():
+        beanJson["invocations"] = beanJson.get("invocations", 0) + cycle
+
+        for methodIndex, methodJson in enumerate((beanJson.get("methods") or dict()).values()):
+            if methodIndex % 2:
+                methodJson["invocations"] = methodJson.get("invocations", 0) + 1
+                methodJson["execution-time"] = methodJson.get("execution-time", 0) + 3
+
+    return beans
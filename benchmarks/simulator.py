@@ -0,0 +1,686 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+import socketserver
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from histogram import Histogram
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".simulator")
+
+# The management realm and opaque of WildFly, the reporter authenticates with HTTP digest against them
+REALM = "ManagementRealm"
+OPAQUE = "00000000000000000000000000000000"
+
+DIGEST_PARAMETER = re.compile(r'(\w+)=(?:"([^"]*)"|([^,\s]*))')
+
+
+# A SimulatedMethod holds the counters of a bean method. It switches between an active phase, where it is invoked at
+# its own rate, and an idle phase, as real methods do, and its counters are advanced by the time passed when read.
+class SimulatedMethod(object):
+    def __init__(self, name, activeFraction):
+        self.name = name
+        self.invocations = 0
+        self.executionTime = 0
+        self.waitTime = 0
+
+        self._rate = random.lognormvariate(0, 1)
+        self._meanExecutionTime = random.lognormvariate(2, 1)
+        self._active = random.random() < activeFraction
+        self._activeFraction = activeFraction
+
+    def advance(self, seconds):
+        # Switch phase about once a minute, keeping the share of active methods at the active fraction
+        if random.random() < seconds / 60:
+            self._active = random.random() < self._activeFraction
+
+        if not self._active:
+            return
+
+        invocations = int(self._rate * seconds + random.random())
+
+        self.invocations += invocations
+        self.executionTime += int(invocations * self._meanExecutionTime * random.uniform(0.5, 1.5))
+        self.waitTime += int(invocations * random.uniform(0, 0.2))
+
+    def reset(self):
+        self.invocations = 0
+        self.executionTime = 0
+        self.waitTime = 0
+
+    def toJson(self):
+        return {
+            "execution-time": self.executionTime,
+            "invocations": self.invocations,
+            "wait-time": self.waitTime
+        }
+
+
+class SimulatedBean(object):
+    def __init__(self, name, methodCount, activeFraction):
+        self.name = name
+        self.methods = [SimulatedMethod("method{0}".format(index), activeFraction) for index in range(methodCount)]
+        self.peakConcurrentInvocations = 0
+
+    def toJson(self, includeRuntime=True, recursive=True):
+        beanJson = {
+            "component-class-name": "com.example.{0}".format(self.name),
+            "declared-roles": [],
+            "run-as-role": None,
+            "security-domain": "other",
+            "timers": [],
+            "service": None
+        }
+
+        if includeRuntime:
+            beanJson.update({
+                "execution-time": sum(method.executionTime for method in self.methods),
+                "invocations": sum(method.invocations for method in self.methods),
+                "wait-time": sum(method.waitTime for method in self.methods),
+                "peak-concurrent-invocations": self.peakConcurrentInvocations,
+                "pool-available-count": 20,
+                "pool-create-count": 1,
+                "pool-current-size": 1,
+                "pool-max-size": 20,
+                "pool-remove-count": 0
+            })
+
+            # Like WildFly, methods only show once they have been invoked
+            methods = dict((method.name, method.toJson()) for method in self.methods if method.invocations > 0)
+            beanJson["methods"] = methods if methods else None
+
+        return beanJson
+
+
+# The SimulatedWildfly answers the parts of the HTTP management API that the reporter uses, for one deployment with a
+# subdeployment of stateless beans: GET reads of resources and attributes, and POSTed operations, composites included,
+# behind digest authentication. The counters of the beans only advance while statistics are enabled. Latency, failed
+# requests and server restarts, resetting all counters, can be injected.
+class SimulatedWildfly(object):
+    def __init__(self, beans=50, methods=10, deployment="etel.ear", subdeployment="etel-ejb.jar", user="etel",
+                 password="etel", activeFraction=0.5, latency=0.0, latencyJitter=0.0, errorRate=0.0,
+                 restartInterval=0, nonceLifetime=300):
+        self.deployment = deployment
+        self.subdeployment = subdeployment
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.latencyJitter = latencyJitter
+        self.errorRate = errorRate
+        self.restartInterval = restartInterval
+        self.nonceLifetime = nonceLifetime
+
+        self.beans = dict(("Bean{0}".format(index), SimulatedBean("Bean{0}".format(index), methods, activeFraction))
+                          for index in range(beans))
+        self.statisticsEnabled = False
+
+        self._lock = threading.Lock()
+        self._nonces = dict()
+        self._lastAdvanceTime = time.monotonic()
+        self._startTime = time.monotonic()
+        self._lastRestartTime = time.monotonic()
+
+        self.requestCounter = 0
+        self.operationCounter = 0
+        self.challengeCounter = 0
+        self.failureCounter = 0
+        self.restartCounter = 0
+        self.latencyHistogram = Histogram()
+
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self, host="127.0.0.1", port=0):
+        self._server = ThreadingHTTPServer((host, port), makeHandler(WildflyRequestHandler, self))
+        self._thread = threading.Thread(target=self._server.serve_forever, name="simulated-wildfly")
+        self._thread.daemon = True
+        self._thread.start()
+
+        logger.info("Simulating wildfly with {0} beans on port {1}".format(len(self.beans), self.port))
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def restart(self):
+        with self._lock:
+            for bean in self.beans.values():
+                for method in bean.methods:
+                    method.reset()
+
+            self.restartCounter += 1
+            self._lastRestartTime = time.monotonic()
+
+        logger.info("Simulated a restart of the wildfly on port {0}, all counters are reset".format(self.port))
+
+    def _advance(self):
+        now = time.monotonic()
+
+        if self.restartInterval > 0 and now - self._lastRestartTime >= self.restartInterval:
+            self.restart()
+
+        with self._lock:
+            seconds = now - self._lastAdvanceTime
+            self._lastAdvanceTime = now
+
+            if not self.statisticsEnabled or seconds <= 0:
+                return
+
+            for bean in self.beans.values():
+                for method in bean.methods:
+                    method.advance(seconds)
+
+    # Digest authentication, RFC 2617 with qop "auth" as WildFly offers it
+
+    def challenge(self, stale=False):
+        nonce = hashlib.md5(os.urandom(16)).hexdigest()
+
+        with self._lock:
+            self._nonces[nonce] = time.monotonic()
+            self.challengeCounter += 1
+
+        return ('Digest realm="{0}", domain="/management", nonce="{1}", opaque="{2}", algorithm=MD5, qop="auth"{3}'
+                .format(REALM, nonce, OPAQUE, ", stale=true" if stale else ""))
+
+    def authenticate(self, method, authorization):
+        # Returns None when authenticated, otherwise whether the nonce was stale
+        if not authorization or not authorization.startswith("Digest "):
+            return False
+
+        parameters = dict((match.group(1), match.group(2) if match.group(2) is not None else match.group(3))
+                          for match in DIGEST_PARAMETER.finditer(authorization[len("Digest "):]))
+
+        if parameters.get("username") != self.user:
+            return False
+
+        ha1 = hashlib.md5("{0}:{1}:{2}".format(self.user, REALM, self.password).encode()).hexdigest()
+        ha2 = hashlib.md5("{0}:{1}".format(method, parameters.get("uri", "")).encode()).hexdigest()
+        expected = hashlib.md5("{0}:{1}:{2}:{3}:{4}:{5}".format(
+            ha1, parameters.get("nonce"), parameters.get("nc"), parameters.get("cnonce"), parameters.get("qop"),
+            ha2).encode()).hexdigest()
+
+        if expected != parameters.get("response"):
+            return False
+
+        with self._lock:
+            issued = self._nonces.get(parameters.get("nonce"))
+
+        if issued is None or time.monotonic() - issued > self.nonceLifetime:
+            return True
+
+        return None
+
+    def delay(self):
+        if self.latency > 0 or self.latencyJitter > 0:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.latencyJitter, self.latencyJitter)))
+
+    def injectFailure(self):
+        return self.errorRate > 0 and random.random() < self.errorRate
+
+    # The management model
+
+    def _readResource(self, address, includeRuntime, recursive):
+        pairs = list(zip(address[0::2], address[1::2]))
+
+        if pairs == [("subsystem", "ejb3")]:
+            return True, {
+                "default-resource-adapter-name": "activemq-ra",
+                "default-sfsb-cache": "simple",
+                "default-slsb-instance-pool": "slsb-strict-max-pool",
+                "enable-statistics": self.statisticsEnabled,
+                "in-vm-remote-interface-invocation-pass-by-value": True
+            }
+
+        if not pairs or pairs[0] != ("deployment", self.deployment):
+            return False, "WFLYCTL0216: Management resource '{0}' not found".format(address)
+
+        if len(pairs) == 1:
+            return True, {
+                "enabled": True,
+                "name": self.deployment,
+                "runtime-name": self.deployment,
+                "status": "OK",
+                "subdeployment": {self.subdeployment: None}
+            }
+
+        if pairs[1] != ("subdeployment", self.subdeployment):
+            return False, "WFLYCTL0216: Management resource '{0}' not found".format(address)
+
+        if len(pairs) == 2:
+            return True, {"subsystem": {"ejb3": None}}
+
+        if pairs[2] != ("subsystem", "ejb3"):
+            return False, "WFLYCTL0216: Management resource '{0}' not found".format(address)
+
+        if len(pairs) == 3:
+            beans = dict((name, bean.toJson(includeRuntime) if recursive else None)
+                         for name, bean in self.beans.items())
+
+            return True, {
+                "entity-bean": None,
+                "message-driven-bean": None,
+                "singleton-bean": None,
+                "stateful-session-bean": None,
+                "stateless-session-bean": beans if beans else None
+            }
+
+        if len(pairs) == 4 and pairs[3][0] == "stateless-session-bean" and pairs[3][1] in self.beans:
+            return True, self.beans[pairs[3][1]].toJson(includeRuntime)
+
+        return False, "WFLYCTL0216: Management resource '{0}' not found".format(address)
+
+    def perform(self, operation):
+        # Returns the outcome of a DMR operation, as the json WildFly answers a POST to /management with
+        self.operationCounter += 1
+
+        name = operation.get("operation")
+        address = operation.get("address", [])
+
+        # The address may be given as a list of names and values, or a list of single entry dicts
+        if address and isinstance(address[0], dict):
+            address = [part for entry in address for item in entry.items() for part in item]
+
+        if name == "composite":
+            results = dict()
+            success = True
+
+            for index, step in enumerate(operation.get("steps", []), start=1):
+                results["step-{0}".format(index)] = self.perform(step)
+                success = success and results["step-{0}".format(index)]["outcome"] == "success"
+
+            if success:
+                return {"outcome": "success", "result": results}
+
+            return {"outcome": "failed", "result": results, "rolled-back": False,
+                    "failure-description": "WFLYCTL0062: Composite operation failed and was rolled back. Steps that "
+                                           "failed: {0}".format(dict((key, value.get("failure-description"))
+                                                                     for key, value in results.items()
+                                                                     if value["outcome"] != "success"))}
+
+        if name == "read-resource":
+            found, result = self._readResource(address, isTrue(operation.get("include-runtime")),
+                                               isTrue(operation.get("recursive")))
+        elif name == "read-attribute":
+            found, resource = self._readResource(address, True, False)
+            result = resource
+
+            if found:
+                if operation.get("name") not in resource:
+                    return failed("WFLYCTL0201: Unknown attribute '{0}'".format(operation.get("name")))
+                result = resource[operation.get("name")]
+        elif name == "write-attribute" and address == ["subsystem", "ejb3"] and \
+                operation.get("name") == "enable-statistics":
+            with self._lock:
+                self.statisticsEnabled = isTrue(operation.get("value"))
+            return {"outcome": "success"}
+        else:
+            return failed("WFLYCTL0031: No operation named '{0}' exists at address {1}".format(name, address))
+
+        if not found:
+            return failed(result)
+
+        return {"outcome": "success", "result": result}
+
+    def handle(self, method, path, query, body):
+        # Returns the HTTP status and json of a request to the management API
+        self._advance()
+
+        with self._lock:
+            self.requestCounter += 1
+
+        if self.injectFailure():
+            self.failureCounter += 1
+            return 500, failed("WFLYSIM0001: Injected failure")
+
+        if method == "POST":
+            outcome = self.perform(body)
+            return (200 if outcome["outcome"] == "success" else 500), outcome
+
+        # A GET addresses the resource in the path, optionally ending with the operation, and answers the result only
+        segments = [unquote(segment) for segment in path.split("/")[2:]]
+        if segments and segments[-1] == "":
+            segments = segments[:-1]
+
+        operation = {"operation": "read-resource"}
+        childType = None
+
+        if len(segments) % 2 == 1:
+            if segments[-1] in ("read-resource", "read-attribute"):
+                operation["operation"] = segments[-1]
+            else:
+                # A child type without a name, the children of that type are read from the parent
+                childType = segments[-1]
+            segments = segments[:-1]
+
+        operation["address"] = segments
+        for key, values in query.items():
+            operation[key] = values[0]
+
+        outcome = self.perform(operation)
+
+        if outcome["outcome"] != "success":
+            return 404 if "WFLYCTL0216" in outcome.get("failure-description", "") else 500, outcome
+
+        if childType is not None:
+            return 200, {childType: (outcome["result"] or dict()).get(childType)}
+
+        return 200, outcome["result"]
+
+
+# The SimulatedElasticsearch accepts documents sent to the index and _bulk APIs, and measures the delay from the
+# sample time of a document to its arrival, the delivery latency of the reporter, and the bytes of the documents and
+# the index they went to. Index creation, mappings, templates and aliases are acknowledged and kept, a rollover never
+# rolls over. Documents created with an id that is already taken are refused with a version conflict. Latency and
+# failed requests can be injected, half of the failed requests fail after the documents were taken, as when the
+# response is lost on the way back.
+class SimulatedElasticsearch(object):
+    def __init__(self, latency=0.0, errorRate=0.0):
+        self.latency = latency
+        self.errorRate = errorRate
+
+        self._lock = threading.Lock()
+        self.requestCounter = 0
+        self.indexRequestCounter = 0
+        self.bulkRequestCounter = 0
+        self.documentCounter = 0
+        self.documentBytes = 0
+        self.failureCounter = 0
+        self.deliveryLatency = Histogram()
+        self.mappings = dict()
+        self.templates = dict()
+        self.aliases = dict()
+        self.indexDocumentCounts = dict()
+        self.duplicateCounter = 0
+        self._documentIds = dict()
+        self._firstDocumentTime = None
+        self._lastDocumentTime = None
+
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def documentsPerSecond(self):
+        if self._firstDocumentTime is None or self._lastDocumentTime <= self._firstDocumentTime:
+            return 0
+
+        return self.documentCounter / (self._lastDocumentTime - self._firstDocumentTime)
+
+    def start(self, host="127.0.0.1", port=0):
+        self._server = ThreadingHTTPServer((host, port), makeHandler(ElasticsearchRequestHandler, self))
+        self._thread = threading.Thread(target=self._server.serve_forever, name="simulated-elasticsearch")
+        self._thread.daemon = True
+        self._thread.start()
+
+        logger.info("Simulating elasticsearch on port {0}".format(self.port))
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _countIndex(self, index):
+        with self._lock:
+            self.indexDocumentCounts[index] = self.indexDocumentCounts.get(index, 0) + 1
+
+    def _create(self, index, docId):
+        # Whether the document can be created, it can not when its id is taken
+        with self._lock:
+            ids = self._documentIds.setdefault(index, set())
+
+            if docId in ids:
+                self.duplicateCounter += 1
+                return False
+
+            ids.add(docId)
+            return True
+
+    def _received(self, document, size):
+        now = time.time()
+        sampleTime = document.get("sample-time") if isinstance(document, dict) else None
+
+        with self._lock:
+            self.documentCounter += 1
+            self.documentBytes += size
+            if self._firstDocumentTime is None:
+                self._firstDocumentTime = now
+            self._lastDocumentTime = now
+
+        if isinstance(sampleTime, int):
+            # Milliseconds since the epoch
+            self.deliveryLatency.observe(max(0.0, now - sampleTime / 1000))
+        elif sampleTime:
+            try:
+                sampled = datetime.strptime(sampleTime[:23], "%Y-%m-%dT%H:%M:%S.%f")
+                self.deliveryLatency.observe(max(0.0, (datetime.utcnow() - sampled).total_seconds()))
+            except ValueError:
+                pass
+
+    def handle(self, method, path, query, body):
+        with self._lock:
+            self.requestCounter += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if path in ("", "/"):
+            return 200, {
+                "name": "simulated",
+                "cluster_name": "loadtest",
+                "version": {"number": "6.8.0"},
+                "tagline": "You Know, for Search"
+            }
+
+        segments = [segment for segment in path.split("/") if segment]
+
+        if method == "HEAD" and len(segments) == 1:
+            # Whether the index exists, it does once it has been created or has a mapping
+            with self._lock:
+                return (200 if segments[0] in self.mappings else 404), dict()
+
+        if method == "HEAD" and segments[0] == "_alias":
+            with self._lock:
+                return (200 if segments[-1] in self.aliases else 404), dict()
+
+        if method == "PUT" and segments[0] == "_template":
+            with self._lock:
+                self.templates[segments[-1]] = json.loads(body.decode("utf-8"))
+
+            return 200, {"acknowledged": True}
+
+        if method == "PUT" and (len(segments) == 1 or "_mapping" in segments):
+            with self._lock:
+                mapping = json.loads(body.decode("utf-8")) if body else dict()
+                self.mappings.setdefault(segments[0], list()).append(mapping)
+
+                for alias in mapping.get("aliases", dict()):
+                    self.aliases[alias] = segments[0]
+
+            return 200, {"acknowledged": True}
+
+        if method == "POST" and segments[-1] == "_rollover":
+            with self._lock:
+                index = self.aliases.get(segments[0])
+
+            return 200, {"acknowledged": False, "rolled_over": False, "old_index": index, "new_index": index}
+
+        if method not in ("POST", "PUT"):
+            return 404, {"error": "no handler for {0} {1}".format(method, path), "status": 404}
+
+        failure = 503, {"error": {"type": "unavailable_shards_exception", "reason": "injected"}, "status": 503}
+
+        if self.errorRate > 0 and random.random() < self.errorRate:
+            self.failureCounter += 1
+
+            if random.random() < 0.5:
+                return failure
+
+            self._store(segments, query, body)
+            return failure
+
+        return self._store(segments, query, body)
+
+    def _conflict(self, index, docId):
+        return {"_index": index, "_id": docId, "status": 409, "error": {
+            "type": "version_conflict_engine_exception",
+            "reason": "[{0}]: version conflict, document already exists".format(docId)}}
+
+    def _store(self, segments, query, body):
+        if segments[-1] == "_bulk":
+            with self._lock:
+                self.bulkRequestCounter += 1
+
+            lines = [line for line in body.decode("utf-8").split("\n") if line.strip()]
+            items = list()
+
+            # Action and source lines alternate, the index and create actions used by the reporter always have a source
+            for action, source in zip(lines[0::2], lines[1::2]):
+                actionJson = json.loads(action)
+                actionName = "create" if "create" in actionJson else "index"
+                meta = actionJson[actionName]
+
+                if actionName == "create" and not self._create(meta.get("_index"), meta.get("_id")):
+                    items.append({actionName: self._conflict(meta.get("_index"), meta.get("_id"))})
+                    continue
+
+                self._received(json.loads(source), len(source))
+                self._countIndex(meta.get("_index"))
+                items.append({actionName: {"_index": meta.get("_index"), "_type": meta.get("_type"),
+                                           "_id": meta.get("_id") or hashlib.md5(source.encode()).hexdigest(),
+                                           "status": 201, "result": "created"}})
+
+            return 200, {"took": 1, "errors": any("error" in item[next(iter(item))] for item in items),
+                         "items": items}
+
+        with self._lock:
+            self.indexRequestCounter += 1
+
+        docId = segments[2] if len(segments) > 2 else None
+
+        if docId is not None and (query.get("op_type") == ["create"] or segments[-1] == "_create"):
+            if not self._create(segments[0], docId):
+                return 409, dict(self._conflict(segments[0], docId), status=409)
+
+        document = json.loads(body.decode("utf-8")) if body else dict()
+        self._received(document, len(body))
+        self._countIndex(segments[0])
+
+        return 201, {
+            "_index": segments[0],
+            "_type": segments[1] if len(segments) > 1 else "_doc",
+            "_id": docId or hashlib.md5(body).hexdigest(),
+            "_version": 1,
+            "result": "created",
+            "_shards": {"total": 1, "successful": 1, "failed": 0}
+        }
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, the reporter reuses its connections
+    protocol_version = "HTTP/1.1"
+    simulator = None
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _readBody(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length > 0 else b""
+
+    def _respond(self, status, responseJson, headers=None):
+        body = json.dumps(responseJson).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class WildflyRequestHandler(SimulatorRequestHandler):
+    def _handle(self):
+        startTime = time.monotonic()
+        body = self._readBody()
+        split = urlsplit(self.path)
+
+        stale = self.simulator.authenticate(self.command, self.headers.get("Authorization"))
+
+        if stale is not None:
+            self._respond(401, {"outcome": "failed", "failure-description": "Unauthorized"},
+                          {"WWW-Authenticate": self.simulator.challenge(stale)})
+            return
+
+        if not split.path.startswith("/management"):
+            self._respond(404, failed("WFLYSIM0002: Not found"))
+            return
+
+        self.simulator.delay()
+
+        try:
+            status, responseJson = self.simulator.handle(self.command, split.path, parse_qs(split.query),
+                                                         json.loads(body.decode("utf-8")) if body else dict())
+        except ValueError as exception:
+            status, responseJson = 400, failed("WFLYSIM0003: Malformed request {0}".format(exception))
+
+        self._respond(status, responseJson)
+        self.simulator.latencyHistogram.observe(time.monotonic() - startTime)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+class ElasticsearchRequestHandler(SimulatorRequestHandler):
+    def _handle(self):
+        body = self._readBody()
+        split = urlsplit(self.path)
+
+        try:
+            status, responseJson = self.simulator.handle(self.command, split.path, parse_qs(split.query), body)
+        except ValueError as exception:
+            status, responseJson = 400, {"error": "Malformed request {0}".format(exception), "status": 400}
+
+        self._respond(status, responseJson)
+
+    do_GET = _handle
+    do_HEAD = _handle
+    do_POST = _handle
+    do_PUT = _handle
+
+
+def makeHandler(handlerClass, simulator):
+    return type(handlerClass.__name__, (handlerClass,), {"simulator": simulator})
+
+
+def failed(description):
+    return {"outcome": "failed", "failure-description": description, "rolled-back": True}
+
+
+def isTrue(value):
+    return value is True or str(value).lower() in ("true", "1", "yes")
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from jsoncodec import loads
+from wildfly.monitor import BeanMonitor
+from wildfly.stream import StreamReader, CHUNK_SIZE
+from payloads import makeSubsystemJson, loadSubsystemJson
+
+# Measures a cycle of the subsystem collection mode on a large recursive read-resource response of the ejb3 subsystem:
+# the response parsed whole and then sampled, and the response parsed as it is streamed, sampling a bean at a time.
+# Reports the time of a cycle and the peak of the memory it allocates, traced with tracemalloc, on monitors sampled
+# once already. Run it as "python benchmarks/stream.py [--methods N] [--bean-methods M] [--payload dmr.json]".
+
+
+def iterChunks(content):
+    # As requests hands out the body of a streamed response
+    for start in range(0, len(content), CHUNK_SIZE):
+        yield content[start:start + CHUNK_SIZE]
+
+
+def sampleWhole(content, beanMonitors, sampleTime):
+    responseJson = loads(content)
+
+    for beanName, beanJson in (responseJson["stateless-session-bean"] or dict()).items():
+        beanMonitors[beanName].updateStats(beanJson, sampleTime)
+
+
+def sampleStreamed(content, beanMonitors, sampleTime):
+    reader = StreamReader(iterChunks(content))
+
+    for beanName, beanJson in reader.iterObject(("stateless-session-bean",)):
+        beanMonitors[beanName].updateStats(beanJson, sampleTime)
+
+
+def measure(function, content, beanMonitors, minSeconds):
+    sampleTime = datetime(2020, 1, 1)
+    best = None
+
+    for repeat in range(5):
+        rounds = 0
+        startTime = time.perf_counter()
+
+        while rounds == 0 or (time.perf_counter() - startTime) < minSeconds:
+            sampleTime += timedelta(seconds=5)
+            function(content, beanMonitors, sampleTime)
+            rounds += 1
+
+        elapsed = (time.perf_counter() - startTime) / rounds
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        startMemory = tracemalloc.get_traced_memory()[0]
+        function(content, beanMonitors, sampleTime + timedelta(seconds=5))
+        peakMemory = tracemalloc.get_traced_memory()[1] - startMemory
+    finally:
+        tracemalloc.stop()
+
+    return best, peakMemory
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmarks parsing the subsystem response whole and streamed")
+    parser.add_argument("--methods", type=int, default=20000, help="methods in the generated response")
+    parser.add_argument("--bean-methods", type=int, default=0, help="methods pr. generated bean, default spread out")
+    parser.add_argument("--payload", default="", help="a recorded ejb3 subsystem read-resource response to use")
+    parser.add_argument("--min-time", type=float, default=0.5, help="minimum seconds pr. round")
+    args = parser.parse_args()
+
+    if args.payload:
+        beans = loadSubsystemJson(args.payload, args.methods)
+    elif args.bean_methods:
+        beans = makeSubsystemJson(args.methods, 1, args.bean_methods)
+    else:
+        beans = makeSubsystemJson(args.methods, 1)
+
+    content = json.dumps({"stateless-session-bean": beans}, separators=(",", ":")).encode("utf-8")
+    largestBean = max(len(json.dumps(beanJson, separators=(",", ":"))) for beanJson in beans.values())
+    del beans
+
+    print("Response: {0} bytes, the largest bean {1} bytes".format(len(content), largestBean))
+
+    results = list()
+
+    for name, function in (("parsed whole", sampleWhole), ("streamed", sampleStreamed)):
+        beanMonitors = dict((beanName, BeanMonitor(beanName)) for beanName in loads(content)["stateless-session-bean"])
+        function(content, beanMonitors, datetime(2020, 1, 1))
+
+        results.append((name,) + measure(function, content, beanMonitors, args.min_time))
+
+    print("  {0:<16} {1:>12} {2:>16}".format("", "ms/cycle", "peak bytes"))
+    for name, seconds, peakMemory in results:
+        print("  {0:<16} {1:>12.3f} {2:>16}".format(name, seconds * 1000, peakMemory))
+
+
+if __name__ == "__main__":
+    run()
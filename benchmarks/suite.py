@@ -0,0 +1,371 @@
+import os
+import sys
+import gc
+import json
+import time
+import logging
+import argparse
+import tracemalloc
+import importlib.util
+from datetime import datetime, timedelta
+
+# The reporter script is loaded without a dispatch queue or bulk writer, so documents go straight to the stubbed client
+os.environ["DISPATCH_QUEUE_SIZE"] = "0"
+os.environ["ES_BULK_ENABLED"] = "False"
+
+benchmarkDirectory = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarkDirectory, ".."))
+
+import wildfly.monitor
+from wildfly.monitor import Monitor, BeanMonitor, STAT_NAMES
+from wildfly.rawpayload import RawPayloads
+from payloads import makeStatsJson, makeSubsystemJson, loadSubsystemJson, advanceSubsystemJson
+
+# The benchmark suite for the hot paths of the reporter: the monitors, and the composition of the elasticsearch
+# documents in the reporter script. Each case is run at a number of scales, methods monitored, and reports the time
+# pr. operation, an operation being one sample or one document, with the memory blocks an operation leaves allocated
+# and the peak memory it allocates (traced with tracemalloc). The results can be saved as a
+# baseline, and later runs compared to it, flagging the cases that got slower than the threshold.
+#
+#   python benchmarks/suite.py                      Run all cases at 10, 1k and 100k methods
+#   python benchmarks/suite.py --save-baseline      ... and save the results to benchmarks/baseline.json
+#   python benchmarks/suite.py --compare            ... and compare them to benchmarks/baseline.json
+#   python benchmarks/suite.py --payload dmr.json   Use a recorded read-resource response instead of generated beans
+
+defaultScales = "10,1000,100000"
+defaultBaseline = os.path.join(benchmarkDirectory, "baseline.json")
+sampleInterval = timedelta(seconds=5)
+
+
+class StubElasticsearch(object):
+    def __init__(self):
+        self.documents = 0
+
+    def index(self, index, doc_type, body, id=None, op_type=None):
+        self.documents += 1
+        return {"result": "created"}
+
+
+def loadReporter():
+    spec = importlib.util.spec_from_file_location("reporter", os.path.join(benchmarkDirectory, "..",
+                                                                           "wildfly-monitor.py"))
+    reporter = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(reporter)
+
+    reporter.esClient = StubElasticsearch()
+    # The script logs to the console at INFO, keep the benchmark output readable
+    reporter.logger.setLevel(logging.WARNING)
+
+    return reporter
+
+
+class Case(object):
+    def __init__(self, name, setup):
+        self.name = name
+        self.setup = setup
+
+
+def makeSamples(methodCount, payloadPath, beanMethods=None):
+    if payloadPath:
+        first = loadSubsystemJson(payloadPath, methodCount)
+        second = advanceSubsystemJson(json.loads(json.dumps(first)), 1)
+    elif beanMethods:
+        first = makeSubsystemJson(methodCount, 0, beanMethods)
+        second = makeSubsystemJson(methodCount, 1, beanMethods)
+    else:
+        first = makeSubsystemJson(methodCount, 0)
+        second = makeSubsystemJson(methodCount, 1)
+
+    return first, second
+
+
+def sampledBeanMonitors(methodCount, payloadPath):
+    first, second = makeSamples(methodCount, payloadPath)
+    sampleTime = datetime(2020, 1, 1)
+
+    beanMonitors = dict()
+    for beanName, beanJson in first.items():
+        beanMonitors[beanName] = BeanMonitor(beanName)
+        beanMonitors[beanName].updateStats(beanJson, sampleTime)
+
+    for beanName, beanJson in second.items():
+        beanMonitors[beanName].updateStats(beanJson, sampleTime + sampleInterval)
+
+    return beanMonitors
+
+
+def setupMonitorUpdateStats(methodCount, payloadPath, reporter):
+    monitors = [Monitor("method{0}".format(index)) for index in range(methodCount)]
+    samples = ([makeStatsJson(index % 7) for index in range(methodCount)],
+               [makeStatsJson(index % 7 + index % 2) for index in range(methodCount)])
+    state = {"cycle": 0, "sampleTime": datetime(2020, 1, 1)}
+
+    def run():
+        state["cycle"] += 1
+        state["sampleTime"] += sampleInterval
+        sample = samples[state["cycle"] % 2]
+        sampleTime = state["sampleTime"]
+
+        for monitor, statsJson in zip(monitors, sample):
+            monitor.updateStats(statsJson, sampleTime)
+
+    run()
+    return run, methodCount
+
+
+def setupCalculateStats(methodCount, payloadPath, reporter):
+    monitors = [Monitor("method{0}".format(index)) for index in range(methodCount)]
+    sampleTime = datetime(2020, 1, 1)
+
+    for monitor in monitors:
+        monitor.updateStats(makeStatsJson(1), sampleTime)
+
+    nextSampleTime = sampleTime + sampleInterval
+
+    def run():
+        for monitor in monitors:
+            monitor._calculateStats(9, 3, 1, nextSampleTime)
+
+    return run, methodCount
+
+
+def setupBeanUpdateStats(methodCount, payloadPath, reporter):
+    # Few beans with large methods maps
+    samples = makeSamples(methodCount, payloadPath, beanMethods=1000)
+    beanMonitors = dict((beanName, BeanMonitor(beanName)) for beanName in samples[0])
+    state = {"cycle": 0, "sampleTime": datetime(2020, 1, 1)}
+
+    def run():
+        state["cycle"] += 1
+        state["sampleTime"] += sampleInterval
+        sampleTime = state["sampleTime"]
+
+        for beanName, beanJson in samples[state["cycle"] % 2].items():
+            beanMonitors[beanName].updateStats(beanJson, sampleTime)
+
+    run()
+    operations = sum(len(beanJson.get("methods") or dict()) + 1 for beanJson in samples[0].values())
+    return run, operations
+
+
+def withReportRaw(reportRaw, function, *args):
+    previousReportRaw = wildfly.monitor.reportRawJson
+    wildfly.monitor.reportRawJson = reportRaw
+
+    try:
+        return function(*args)
+    finally:
+        wildfly.monitor.reportRawJson = previousReportRaw
+
+
+def setupGetMonitorStats(methodCount, payloadPath, reporter, reportRaw=False):
+    # The monitors only keep the responses to report when sampled with raw reporting on
+    beanMonitors = withReportRaw(reportRaw, sampledBeanMonitors, methodCount, payloadPath)
+    methodMonitors = [methodMonitor for beanMonitor in beanMonitors.values()
+                      for methodMonitor in beanMonitor.methods.values()]
+
+    def getAllMonitorStats():
+        for methodMonitor in methodMonitors:
+            methodMonitor.getMonitorStats(prefix="method-")
+
+    def run():
+        withReportRaw(reportRaw, getAllMonitorStats)
+
+    return run, len(methodMonitors)
+
+
+def setupGetMonitorStatsRaw(methodCount, payloadPath, reporter):
+    return setupGetMonitorStats(methodCount, payloadPath, reporter, reportRaw=True)
+
+
+def setupRawPayloadReference(methodCount, payloadPath, reporter, keepReferences=False):
+    # The raw payloads of the beans, a new response each cycle with the same content but for the counters, referenced
+    # from scratch, or with the reference to the last response kept as the monitors do
+    samples = makeSamples(methodCount, payloadPath)
+    rawPayloads = RawPayloads(counterNames=STAT_NAMES)
+    references = dict()
+    state = {"cycle": 0}
+
+    def run():
+        state["cycle"] += 1
+
+        for beanName, beanJson in samples[state["cycle"] % 2].items():
+            jsondoc = dict()
+
+            if keepReferences:
+                references[beanName] = rawPayloads.addTo(jsondoc, beanJson, references.get(beanName))
+            else:
+                rawPayloads.addTo(jsondoc, beanJson)
+
+    run()
+    return run, len(samples[0])
+
+
+def setupRawPayloadReferenceKept(methodCount, payloadPath, reporter):
+    return setupRawPayloadReference(methodCount, payloadPath, reporter, keepReferences=True)
+
+
+def setupDispatchBeanStats(methodCount, payloadPath, reporter):
+    beanMonitors = list(sampledBeanMonitors(methodCount, payloadPath).values())
+
+    def run():
+        for beanMonitor in beanMonitors:
+            reporter.dispatchBeanStatsToElasticsearch(beanMonitor)
+
+    return run, len(beanMonitors)
+
+
+def setupDispatchMethodStats(methodCount, payloadPath, reporter):
+    methodMonitors = [methodMonitor for beanMonitor in sampledBeanMonitors(methodCount, payloadPath).values()
+                      for methodMonitor in beanMonitor.methods.values()]
+
+    def run():
+        for methodMonitor in methodMonitors:
+            reporter.dispatchMethodStatsToElasticSearch(methodMonitor)
+
+    return run, len(methodMonitors)
+
+
+cases = [
+    Case("Monitor.updateStats", setupMonitorUpdateStats),
+    Case("Monitor._calculateStats", setupCalculateStats),
+    Case("BeanMonitor.updateStats", setupBeanUpdateStats),
+    Case("Monitor.getMonitorStats", setupGetMonitorStats),
+    Case("Monitor.getMonitorStats/raw", setupGetMonitorStatsRaw),
+    Case("RawPayloads.addTo", setupRawPayloadReference),
+    Case("RawPayloads.addTo/last-reference", setupRawPayloadReferenceKept),
+    Case("dispatchBeanStatsToElasticsearch", setupDispatchBeanStats),
+    Case("dispatchMethodStatsToElasticSearch", setupDispatchMethodStats)
+]
+
+
+def measure(run, operations, minSeconds, repeats):
+    # Time: the best of the repeats, each running the case for at least minSeconds, with the garbage collector off
+    rounds = 1
+    best = None
+
+    gc.disable()
+    try:
+        for repeat in range(repeats):
+            startTime = time.perf_counter()
+            completed = 0
+
+            while completed < rounds or (time.perf_counter() - startTime) < minSeconds:
+                run()
+                completed += 1
+
+            elapsed = (time.perf_counter() - startTime) / completed
+            rounds = completed
+
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        gc.enable()
+
+    # Allocations: the memory blocks still allocated after one more round of the case, and the peak of the memory
+    # traced during another round, both pr. operation
+    gc.collect()
+    gc.disable()
+    try:
+        startBlocks = sys.getallocatedblocks()
+        run()
+        retainedBlocks = sys.getallocatedblocks() - startBlocks
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    try:
+        startMemory = tracemalloc.get_traced_memory()[0]
+        run()
+        peakMemory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ns-per-op": best / operations * 1e9,
+        "retained-blocks-per-op": max(0, retainedBlocks) / operations,
+        "peak-bytes-per-op": max(0, peakMemory - startMemory) / operations,
+        "operations": operations
+    }
+
+
+def compareToBaseline(results, baseline, threshold):
+    regressions = list()
+
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+
+        ratio = result["ns-per-op"] / baseline[key]["ns-per-op"]
+        flag = ""
+
+        if ratio > threshold:
+            flag = "REGRESSION"
+            regressions.append(key)
+
+        print("{0:<48} {1:>12.1f} ns/op  baseline {2:>12.1f} ns/op  {3:>6.2f}x  {4}".format(
+            key, result["ns-per-op"], baseline[key]["ns-per-op"], ratio, flag))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths of the wildfly reporter")
+    parser.add_argument("--scales", default=defaultScales, help="comma separated numbers of monitored methods")
+    parser.add_argument("--cases", default="", help="comma separated names of the cases to run, default all")
+    parser.add_argument("--payload", default="", help="a recorded ejb3 subsystem read-resource response to use")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds pr. repeat of a case")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--baseline", default=defaultBaseline, help="the baseline file to save to or compare to")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="flag a case as a regression when slower than this times the baseline")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(",") if scale]
+    selectedCases = [name for name in args.cases.split(",") if name]
+
+    reporter = loadReporter()
+    results = dict()
+
+    print("{0:<48} {1:>12} {2:>20} {3:>16}".format("case", "ns/op", "retained blocks/op", "peak bytes/op"))
+
+    for case in cases:
+        if selectedCases and case.name not in selectedCases:
+            continue
+
+        for scale in scales:
+            run, operations = case.setup(scale, args.payload, reporter)
+            result = measure(run, operations, args.min_time, args.repeats)
+
+            key = "{0}@{1}".format(case.name, scale)
+            results[key] = result
+
+            print("{0:<48} {1:>12.1f} {2:>20.2f} {3:>16.1f}".format(
+                key, result["ns-per-op"], result["retained-blocks-per-op"], result["peak-bytes-per-op"]))
+
+    regressions = list()
+
+    if args.compare:
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+
+        print("")
+        regressions = compareToBaseline(results, baseline, args.threshold)
+
+        if regressions:
+            print("\n{0} regressions over {1:.2f}x the baseline: {2}".format(len(regressions), args.threshold,
+                                                                              ", ".join(regressions)))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baselineFile:
+            json.dump(results, baselineFile, indent=2, sort_keys=True)
+
+        print("\nSaved the baseline to {0}".format(args.baseline))
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
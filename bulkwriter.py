@@ -0,0 +1,273 @@
+import os
+import time
+import logging
+import threading
+
+from histogram import Histogram
+from jsoncodec import dumpb
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".bulkwriter")
+
+
+# The BulkWriter buffers documents headed for elasticsearch and ships them in batches through the _bulk API. A batch
+# is sent once it holds maxDocs documents, maxBytes of serialised data, or its oldest document is maxAge seconds
+# old. Once started, sending happens on a background thread, so the collection loop never waits for elasticsearch.
+# Without the thread, the owner has to call flushIfDue() regularly. Given a spool, documents that could not be
+# delivered, because elasticsearch was unreachable or overloaded, are spooled instead of lost.
+#
+# Documents added with an id are created rather than indexed, elasticsearch refuses a second document with the same
+# id with a version conflict, which counts as delivered. That makes sending them again harmless, so documents rejected
+# for lack of capacity are sent again up to retries times, backing off retryBackoff seconds doubling each time, and so
+# is a whole batch when the request failed without telling which of its documents made it. A batch holding documents
+# without an id is not sent again after such a failure, as they could end up in elasticsearch twice.
+class BulkWriter(object):
+    def __init__(self, esClient, maxDocs=500, maxBytes=5 * 1024 * 1024, maxAge=5.0, spool=None, retries=0,
+                 retryBackoff=0.5):
+        self._esClient = esClient
+        self._spool = spool
+        self._maxDocs = maxDocs
+        self._maxBytes = maxBytes
+        self._maxAge = maxAge
+        self._retries = retries
+        self._retryBackoff = retryBackoff
+
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+        # The buffer holds the serialised action and source lines of the bulk body, as bytes, joined into the body as is
+        self._buffer = list()
+        self._bufferDocs = 0
+        self._bufferBytes = 0
+        self._bufferStartTime = 0
+
+        self._requestCount = 0
+        self._documentsAdded = 0
+        self._documentsShipped = 0
+        self._documentsFailed = 0
+        self._documentsDuplicate = 0
+        self._retryCount = 0
+        self._latencyHistogram = Histogram()
+
+    @property
+    def requestCount(self):
+        return self._requestCount
+
+    @property
+    def documentsAdded(self):
+        return self._documentsAdded
+
+    @property
+    def documentsShipped(self):
+        return self._documentsShipped
+
+    @property
+    def documentsFailed(self):
+        return self._documentsFailed
+
+    @property
+    def documentsDuplicate(self):
+        return self._documentsDuplicate
+
+    @property
+    def retryCount(self):
+        return self._retryCount
+
+    @property
+    def bufferedDocuments(self):
+        return self._bufferDocs
+
+    @property
+    def latencyHistogram(self):
+        return self._latencyHistogram
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="bulkwriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, index, docType, jsondoc, docId=None):
+        if docId is None:
+            action = dumpb({"index": {"_index": index, "_type": docType}})
+        else:
+            action = dumpb({"create": {"_index": index, "_type": docType, "_id": docId}})
+        source = dumpb(jsondoc)
+
+        with self._condition:
+            if self._bufferDocs == 0:
+                self._bufferStartTime = time.time()
+
+            self._buffer.append(action)
+            self._buffer.append(source)
+            self._bufferDocs += 1
+            self._bufferBytes += len(action) + len(source) + 2
+            self._documentsAdded += 1
+
+            if self._isDue():
+                self._condition.notify()
+
+    def flushIfDue(self):
+        with self._condition:
+            if not self._isDue():
+                return
+            lines, docs = self._takeBuffer()
+
+        self._send(lines, docs)
+
+    def flush(self):
+        with self._condition:
+            lines, docs = self._takeBuffer()
+
+        if docs > 0:
+            self._send(lines, docs)
+
+    def close(self, timeout=30):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+
+        if self._thread is not None:
+            logger.info("Draining {0} buffered documents to elasticsearch".format(self._bufferDocs))
+            self._thread.join(timeout)
+        else:
+            self.flush()
+
+    def _isDue(self):
+        if self._bufferDocs == 0:
+            return False
+
+        return ((self._bufferDocs >= self._maxDocs) or (self._bufferBytes >= self._maxBytes) or
+                ((time.time() - self._bufferStartTime) >= self._maxAge))
+
+    def _takeBuffer(self):
+        lines = self._buffer
+        docs = self._bufferDocs
+
+        self._buffer = list()
+        self._bufferDocs = 0
+        self._bufferBytes = 0
+
+        return lines, docs
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._isDue():
+                    if self._bufferDocs == 0:
+                        self._condition.wait(self._maxAge)
+                    else:
+                        self._condition.wait(max(0.0, self._bufferStartTime + self._maxAge - time.time()))
+
+                lines, docs = self._takeBuffer()
+                closed = self._closed
+
+            if docs > 0:
+                self._send(lines, docs)
+
+            if closed:
+                return
+
+    def sendLines(self, lines):
+        # Sends already serialised bulk lines, such as those replayed from the spool, without spooling them again
+        return self._send(lines, len(lines) // 2, spoolFailures=False)
+
+    def _spoolLines(self, action, source):
+        if self._spool is not None:
+            self._spool.append(action, source)
+
+    def _isIdempotent(self, lines):
+        return all(lines[position].startswith(b'{"create"') for position in range(0, len(lines), 2))
+
+    def _sleepBeforeRetry(self, attempt):
+        self._retryCount += 1
+        time.sleep(self._retryBackoff * (2 ** attempt))
+
+    def _send(self, lines, docs, spoolFailures=True):
+        attempt = 0
+
+        while True:
+            body = b"\n".join(lines) + b"\n"
+
+            startTime = time.monotonic()
+
+            try:
+                logger.debug("Dispatching {0} documents ({1} bytes) to elasticsearch".format(docs, len(body)))
+                response = self._esClient.bulk(body=body)
+                self._requestCount += 1
+            except Exception as exception:
+                self._latencyHistogram.observe(time.monotonic() - startTime)
+
+                if attempt < self._retries and self._isIdempotent(lines):
+                    logger.warning("An error occurred when pushing {0} documents to elasticsearch, sending them again: "
+                                   "{1}".format(docs, exception))
+                    self._sleepBeforeRetry(attempt)
+                    attempt += 1
+                    continue
+
+                logger.error("An error occurred when pushing {0} documents to elasticsearch: {1}".format(
+                    docs, exception))
+                self._documentsFailed += docs
+                if spoolFailures:
+                    for position in range(0, len(lines), 2):
+                        self._spoolLines(lines[position], lines[position + 1])
+                return False
+
+            self._latencyHistogram.observe(time.monotonic() - startTime)
+
+            if not response.get("errors", False):
+                self._documentsShipped += docs
+                return True
+
+            lines, capacityFailures = self._handleRejections(response, lines, attempt < self._retries,
+                                                             spoolFailures)
+            docs = len(lines) // 2
+
+            if docs == 0:
+                # Unless spooled here, the documents rejected for lack of capacity are not delivered, the caller keeps
+                # them and sends them again later, such as the spool replayer does with its chunk
+                return spoolFailures or capacityFailures == 0
+
+            logger.warning("Elasticsearch rejected {0} documents for lack of capacity, sending them again".format(docs))
+            self._sleepBeforeRetry(attempt)
+            attempt += 1
+
+    def _handleRejections(self, response, lines, retry, spoolFailures):
+        # Reports each of the documents that were rejected, and returns the lines of those to send again, with how many
+        # were rejected for lack of capacity without being sent again
+        retryLines = list()
+        capacityFailures = 0
+
+        for position, item in enumerate(response.get("items", [])):
+            for action, result in item.items():
+                status = result.get("status", 0)
+
+                if "error" not in result:
+                    self._documentsShipped += 1
+                elif action == "create" and status == 409:
+                    # Already there, from an earlier attempt or an earlier run
+                    self._documentsShipped += 1
+                    self._documentsDuplicate += 1
+                elif retry and (status == 429 or status >= 500):
+                    retryLines.append(lines[position * 2])
+                    retryLines.append(lines[position * 2 + 1])
+                else:
+                    self._documentsFailed += 1
+                    logger.error("Elasticsearch rejected a document for the index {0} with status {1}: {2}"
+                                 .format(result.get("_index"), status, result["error"]))
+
+                    # Rejected for lack of capacity, the document itself is fine and can be delivered later
+                    if status == 429 or status >= 500:
+                        capacityFailures += 1
+                        if spoolFailures:
+                            self._spoolLines(lines[position * 2], lines[position * 2 + 1])
+
+        return retryLines, capacityFailures
+
+    def logStatistics(self):
+        logger.info("Bulk stats: {0} documents added, {1} shipped ({2} already there) and {3} failed in {4} bulk "
+                    "requests, {5} of them retries, {6} buffered"
+                    .format(self._documentsAdded, self._documentsShipped, self._documentsDuplicate,
+                            self._documentsFailed, self._requestCount, self._retryCount, self._bufferDocs))
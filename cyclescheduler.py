@@ -0,0 +1,107 @@
+import os
+import time
+import logging
+
+from histogram import Histogram
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".cyclescheduler")
+
+OVERRUN_SKIP = "skip"
+OVERRUN_COALESCE = "coalesce"
+
+
+# The CycleScheduler runs collection cycles at a fixed rate, one every period seconds on the monotonic clock, no matter
+# how long each of them takes. Call startCycle() when a cycle begins and sleep for what finishCycle() returns when it
+# ends. A cycle that runs past the start of the next one is an overrun. With the skip policy the cycles that were
+# missed are skipped, and the next one starts on the original grid. With the coalesce policy they are coalesced into
+# one that starts straight away, and the grid moves along with it. The lateness of every cycle start, the jitter, and
+# the duration of every cycle are kept in histograms.
+class CycleScheduler(object):
+    def __init__(self, period, overrunPolicy=OVERRUN_SKIP):
+        if overrunPolicy not in (OVERRUN_SKIP, OVERRUN_COALESCE):
+            raise ValueError("Unknown overrun policy {0}".format(overrunPolicy))
+
+        self._period = period
+        self._overrunPolicy = overrunPolicy
+
+        self._scheduledStartTime = None
+        self._cycleStartTime = None
+
+        self._cycleCounter = 0
+        self._overrunCounter = 0
+        self._missedCycleCounter = 0
+
+        self._jitterHistogram = Histogram()
+        self._durationHistogram = Histogram()
+
+    @property
+    def period(self):
+        return self._period
+
+    @property
+    def cycleCounter(self):
+        return self._cycleCounter
+
+    @property
+    def overrunCounter(self):
+        return self._overrunCounter
+
+    @property
+    def missedCycleCounter(self):
+        return self._missedCycleCounter
+
+    @property
+    def jitterHistogram(self):
+        return self._jitterHistogram
+
+    @property
+    def durationHistogram(self):
+        return self._durationHistogram
+
+    @property
+    def lastCycleStartTime(self):
+        return self._cycleStartTime
+
+    def startCycle(self):
+        now = time.monotonic()
+
+        if self._scheduledStartTime is None:
+            self._scheduledStartTime = now
+
+        self._jitterHistogram.observe(max(0.0, now - self._scheduledStartTime))
+        self._cycleStartTime = now
+        self._cycleCounter += 1
+
+    def finishCycle(self):
+        now = time.monotonic()
+        self._durationHistogram.observe(now - self._cycleStartTime)
+
+        nextStartTime = self._scheduledStartTime + self._period
+
+        if now > nextStartTime:
+            missed = int((now - nextStartTime) // self._period) + 1
+
+            self._overrunCounter += 1
+            self._missedCycleCounter += missed
+
+            logger.warning("Cycle took {0:.3f} seconds, overrunning the period of {1} seconds, {2} cycles {3}"
+                           .format(now - self._cycleStartTime, self._period, missed,
+                                   "skipped" if self._overrunPolicy == OVERRUN_SKIP else "coalesced"))
+
+            if self._overrunPolicy == OVERRUN_SKIP:
+                nextStartTime += missed * self._period
+            else:
+                nextStartTime = now
+
+        self._scheduledStartTime = nextStartTime
+
+        return max(0.0, nextStartTime - now)
+
+    def logStatistics(self):
+        logger.info("Cycle stats: {0} cycles of {1} seconds, {2} overran and {3} were missed. Duration mean {4:.3f}, "
+                    "p99 {5:.3f}, max {6:.3f} seconds. Start jitter mean {7:.3f}, p99 {8:.3f}, max {9:.3f} seconds"
+                    .format(self._cycleCounter, self._period, self._overrunCounter, self._missedCycleCounter,
+                            self._durationHistogram.mean, self._durationHistogram.percentile(0.99),
+                            self._durationHistogram.max, self._jitterHistogram.mean,
+                            self._jitterHistogram.percentile(0.99), self._jitterHistogram.max))
@@ -0,0 +1,139 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".dispatchqueue")
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_DROP_NEWEST = "drop-newest"
+
+
+# The DispatchQueue connects the collection of statistics with the shipping of them. Collectors put documents on the
+# queue and return straight away, a worker thread takes them off and hands them to the consumer. The queue holds at
+# most maxSize documents, when it is full the overflow policy decides whether the collector waits for room (block),
+# the oldest queued document is dropped to make room (drop-oldest), or the new document is dropped (drop-newest).
+# When the queue has been empty for idleInterval seconds the idle callback is run on the worker, a bulk writer uses
+# this to flush documents that have aged.
+class DispatchQueue(object):
+    def __init__(self, consumer, maxSize=10000, overflowPolicy=OVERFLOW_DROP_OLDEST, idleCallback=None,
+                 idleInterval=1.0):
+        if overflowPolicy not in (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+            raise ValueError("Unknown overflow policy {0}".format(overflowPolicy))
+
+        self._consumer = consumer
+        self._maxSize = maxSize
+        self._overflowPolicy = overflowPolicy
+        self._idleCallback = idleCallback
+        self._idleInterval = idleInterval
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+        self._enqueuedCounter = 0
+        self._dispatchedCounter = 0
+        self._droppedCounter = 0
+        self._errorCounter = 0
+        self._maxDepth = 0
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    @property
+    def maxDepth(self):
+        return self._maxDepth
+
+    @property
+    def enqueuedCounter(self):
+        return self._enqueuedCounter
+
+    @property
+    def dispatchedCounter(self):
+        return self._dispatchedCounter
+
+    @property
+    def droppedCounter(self):
+        return self._droppedCounter
+
+    @property
+    def errorCounter(self):
+        return self._errorCounter
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="dispatchqueue")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, item):
+        with self._condition:
+            if self._closed:
+                self._droppedCounter += 1
+                return False
+
+            if len(self._queue) >= self._maxSize:
+                if self._overflowPolicy == OVERFLOW_DROP_NEWEST:
+                    self._droppedCounter += 1
+                    return False
+                elif self._overflowPolicy == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    self._droppedCounter += 1
+                else:
+                    while len(self._queue) >= self._maxSize and not self._closed:
+                        self._condition.wait()
+
+            self._queue.append(item)
+            self._enqueuedCounter += 1
+            self._maxDepth = max(self._maxDepth, len(self._queue))
+            self._condition.notify_all()
+
+            return True
+
+    def close(self, timeout=30):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+
+        if self._thread is not None:
+            logger.info("Draining {0} queued documents".format(len(self._queue)))
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._queue) == 0 and not self._closed:
+                    self._condition.wait(self._idleInterval)
+
+                if len(self._queue) == 0:
+                    if self._closed:
+                        return
+                    item = None
+                else:
+                    item = self._queue.popleft()
+                    # Wakes up a collector waiting for room
+                    self._condition.notify_all()
+
+            try:
+                if item is None:
+                    if self._idleCallback is not None:
+                        self._idleCallback()
+                else:
+                    self._consumer(*item)
+                    self._dispatchedCounter += 1
+            except Exception as exception:
+                self._errorCounter += 1
+                logger.error("An error occurred when dispatching a queued document: {0}".format(exception))
+
+    def logStatistics(self):
+        logger.info("Queue stats: {0} documents queued, {1} dispatched, {2} dropped ({3}), {4} errors. Depth is {5} "
+                    "of {6}, the deepest it has been is {7}"
+                    .format(self._enqueuedCounter, self._dispatchedCounter, self._droppedCounter,
+                            self._overflowPolicy, self._errorCounter, len(self._queue), self._maxSize,
+                            self._maxDepth))
@@ -0,0 +1,227 @@
+import os
+import base64
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".esindices")
+
+ROTATION_NONE = "none"
+ROTATION_DAILY = "daily"
+ROTATION_ROLLOVER = "rollover"
+
+MILLISECONDS_PER_DAY = 86400 * 1000
+
+# The fields of a document that tell it apart from every other document of the same index
+DOCUMENT_ID_FIELDS = ("wildfly-alias", "wildfly-host-url", "bean-name", "method-name", "sample-time", "window-seconds")
+
+
+def getDocumentId(jsondoc):
+    # A raw payload stored apart is identified by the hash of its content
+    if "raw-hash" in jsondoc and "raw-json" in jsondoc:
+        return jsondoc["raw-hash"]
+
+    # The same sample of the same bean or method always gets the same id, so a document that is sent again, by a retry
+    # or a replay of the spool, is refused as a conflict instead of indexed twice. The consolidated documents of a bean,
+    # or a cycle, are told apart from the flat documents by the nested fields
+    key = "|".join(str(jsondoc.get(field, "")) for field in DOCUMENT_ID_FIELDS)
+
+    if "beans" in jsondoc:
+        key += "|beans"
+    elif "methods" in jsondoc:
+        key += "|methods"
+
+    return base64.urlsafe_b64encode(hashlib.blake2b(key.encode("utf-8"), digest_size=15).digest()).decode("ascii")
+
+
+# The IndexManager decides which elasticsearch index a document is written to, and installs an index template for each
+# of the indices the reporter writes to, with the settings and the mapping of its documents. An index is either:
+#
+#   none      the index itself, as named, the template applies when the index is created
+#   daily     an index pr. day of the sample time, <index>-yyyy.mm.dd, read through the alias <index>
+#   rollover  the write alias <index>-write, pointing at <index>-000001 until elasticsearch rolls it over to the next
+#             index, on a condition checked every rolloverCheckInterval seconds, read through the alias <index>
+#
+# The names of the daily indices start with a year, and the rollover indices with a zero, and the templates match on
+# that, so the templates of an index and of, say, <index>-rollup do not both apply to the same index. Old data is
+# dropped by deleting whole indices.
+class IndexManager(object):
+    def __init__(self, esClient, rotation=ROTATION_NONE, settings=None, rolloverConditions=None,
+                 rolloverCheckInterval=300):
+        if rotation not in (ROTATION_NONE, ROTATION_DAILY, ROTATION_ROLLOVER):
+            raise ValueError("Unknown index rotation {0}".format(rotation))
+
+        self._esClient = esClient
+        self._rotation = rotation
+        self._settings = settings or dict()
+        self._rolloverConditions = rolloverConditions or dict()
+        self._rolloverCheckInterval = rolloverCheckInterval
+
+        # The document type and mapping of each index
+        self._indices = OrderedDict()
+        # The daily index names by index and day, made once a day rather than for every document
+        self._dailyNames = dict()
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self._rolloverCounter = 0
+
+    @property
+    def rotation(self):
+        return self._rotation
+
+    @property
+    def rolloverCounter(self):
+        return self._rolloverCounter
+
+    def addIndex(self, index, docType, mapping):
+        self._indices[index] = (docType, mapping)
+
+    def getWriteAlias(self, index):
+        return index + "-write"
+
+    def getPattern(self, index):
+        if self._rotation == ROTATION_DAILY:
+            return index + "-2*"
+        elif self._rotation == ROTATION_ROLLOVER:
+            return index + "-0*"
+
+        return index
+
+    def _dailyName(self, index, jsondoc):
+        sampleTime = jsondoc.get("sample-time")
+
+        if isinstance(sampleTime, int):
+            day = sampleTime // MILLISECONDS_PER_DAY
+        elif sampleTime:
+            # yyyy-mm-dd of the ISO 8601 sample time
+            day = sampleTime[:10]
+        else:
+            day = datetime.utcnow().strftime("%Y-%m-%d")
+
+        name = self._dailyNames.get((index, day))
+
+        if name is None:
+            if isinstance(day, int):
+                date = datetime.utcfromtimestamp(day * 86400).strftime("%Y.%m.%d")
+            else:
+                date = day.replace("-", ".")
+
+            name = self._dailyNames[(index, day)] = "{0}-{1}".format(index, date)
+
+        return name
+
+    def indexFor(self, index, jsondoc):
+        # The index, or alias, to write the document to
+        if self._rotation == ROTATION_DAILY:
+            return self._dailyName(index, jsondoc)
+        elif self._rotation == ROTATION_ROLLOVER:
+            return self.getWriteAlias(index)
+
+        return index
+
+    def installTemplates(self):
+        # Returns False when any of the templates could not be installed, the documents are then mapped dynamically
+        installed = True
+
+        for index, (docType, mapping) in self._indices.items():
+            template = {
+                "index_patterns": [self.getPattern(index)],
+                "settings": self._settings,
+                "mappings": {docType: mapping}
+            }
+
+            if self._rotation != ROTATION_NONE:
+                template["aliases"] = {index: dict()}
+
+            try:
+                self._esClient.indices.put_template(name=index, body=template)
+                logger.info("Installed the index template {0} for the indices {1}".format(index,
+                                                                                        self.getPattern(index)))
+
+                if self._rotation == ROTATION_NONE:
+                    self._putMapping(index, docType, mapping)
+                elif self._rotation == ROTATION_ROLLOVER:
+                    self._bootstrapRollover(index)
+
+            except Exception as exception:
+                installed = False
+                logger.error("An error occurred when installing the index template for {0}: {1}".format(
+                    index, exception))
+
+        return installed
+
+    def findIndicesInTheWay(self):
+        # With rotation, the name of an index is the alias its indices are read through, the template can not give a
+        # new index that alias while an index of the name, written before the rotation was turned on, is still there
+        if self._rotation == ROTATION_NONE:
+            return []
+
+        indicesInTheWay = list()
+
+        for index in self._indices:
+            try:
+                if self._esClient.indices.exists(index=index) and not self._esClient.indices.exists_alias(name=index):
+                    indicesInTheWay.append(index)
+            except Exception as exception:
+                logger.error("An error occurred when checking whether the index {0} exists: {1}".format(
+                    index, exception))
+
+        return indicesInTheWay
+
+    def _putMapping(self, index, docType, mapping):
+        # The template only applies when the index is created, an existing index is given the mapping as far as it
+        # goes, fields it has already mapped dynamically keep their types
+        if not self._esClient.indices.exists(index=index):
+            return
+
+        try:
+            self._esClient.indices.put_mapping(index=index, doc_type=docType, body=mapping)
+        except Exception as exception:
+            logger.warning("The existing index {0} keeps its mapping, the template applies to it once it is "
+                           "recreated: {1}".format(index, exception))
+
+    def _bootstrapRollover(self, index):
+        writeAlias = self.getWriteAlias(index)
+
+        if not self._esClient.indices.exists_alias(name=writeAlias):
+            firstIndex = "{0}-000001".format(index)
+            self._esClient.indices.create(index=firstIndex, body={"aliases": {writeAlias: dict()}})
+            logger.info("Created the index {0} behind the write alias {1}".format(firstIndex, writeAlias))
+
+    def rollover(self):
+        for index in self._indices:
+            try:
+                response = self._esClient.indices.rollover(alias=self.getWriteAlias(index),
+                                                           body={"conditions": self._rolloverConditions})
+
+                if response.get("rolled_over"):
+                    self._rolloverCounter += 1
+                    logger.info("Rolled the index {0} over to {1}".format(response.get("old_index"),
+                                                                           response.get("new_index")))
+
+            except Exception as exception:
+                logger.error("An error occurred when rolling over the index {0}: {1}".format(index, exception))
+
+    def start(self):
+        # Only rollover indices need checking
+        if self._rotation != ROTATION_ROLLOVER or not self._rolloverConditions:
+            return
+
+        self._thread = threading.Thread(target=self._run, name="indexmanager")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopped.set()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.wait(self._rolloverCheckInterval):
+            self.rollover()
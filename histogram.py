@@ -0,0 +1,70 @@
+import bisect
+import threading
+
+# Upper bounds in seconds, suitable for request latencies as well as cycle durations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+# The Histogram counts observations in fixed buckets, each holding the observations up to and including its upper
+# bound, with a last bucket for everything above the highest bound. It can be observed from several threads.
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0
+        self._count = 0
+        self._max = 0
+        self._lock = threading.Lock()
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    @property
+    def counts(self):
+        return list(self._counts)
+
+    @property
+    def sum(self):
+        return self._sum
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def mean(self):
+        return (self._sum / self._count) if self._count > 0 else 0
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self._buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+            self._max = max(self._max, value)
+
+    def snapshot(self):
+        # The bucket counts and sum of the observations as of one instant, for exporting while others observe
+        with self._lock:
+            return list(self._counts), self._sum
+
+    def percentile(self, fraction):
+        # The upper bound of the bucket holding the percentile, or the largest observation if that is lower
+        if self._count == 0:
+            return 0
+
+        rank = fraction * self._count
+        cumulative = 0
+
+        for index, count in enumerate(self._counts):
+            cumulative += count
+            if cumulative >= rank and count > 0:
+                if index < len(self._buckets):
+                    return min(self._buckets[index], self._max)
+                return self._max
+
+        return self._max
@@ -0,0 +1,139 @@
+import os
+import json
+import logging
+
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch.exceptions import SerializationError
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".jsoncodec")
+
+CODEC_AUTO = "auto"
+CODEC_ORJSON = "orjson"
+CODEC_UJSON = "ujson"
+CODEC_STDLIB = "stdlib"
+
+# Either "auto", the fastest of the codecs installed, or one of "orjson", "ujson" and "stdlib". Every json the reporter
+# reads or writes, the management responses, the documents and the bulk bodies, goes through the codec
+jsonCodec = os.getenv("JSON_CODEC", CODEC_AUTO)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+# The codecs all write compact json, without escaping non-ascii characters, so the same value is written the same by
+# each of them. loads() takes bytes as well as text, and dumpb() writes bytes, without text in between where the
+# implementation allows it.
+class StdlibCodec(object):
+    name = CODEC_STDLIB
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+        self._sortingEncoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+    def loads(self, data):
+        # Bytes are decoded by the parser itself, utf-8, -16 or -32
+        return json.loads(data)
+
+    def dumps(self, value, sortKeys=False):
+        return (self._sortingEncoder if sortKeys else self._encoder).encode(value)
+
+    def dumpb(self, value, sortKeys=False):
+        return self.dumps(value, sortKeys).encode("utf-8")
+
+
+class OrjsonCodec(object):
+    name = CODEC_ORJSON
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+    def dumps(self, value, sortKeys=False):
+        return self.dumpb(value, sortKeys).decode("utf-8")
+
+    def dumpb(self, value, sortKeys=False):
+        return self._orjson.dumps(value, option=self._orjson.OPT_SORT_KEYS if sortKeys else 0)
+
+
+class UjsonCodec(object):
+    name = CODEC_UJSON
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+    def dumps(self, value, sortKeys=False):
+        return self._ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False, sort_keys=sortKeys)
+
+    def dumpb(self, value, sortKeys=False):
+        return self.dumps(value, sortKeys).encode("utf-8")
+
+
+# Fastest first
+CODECS = (OrjsonCodec, UjsonCodec, StdlibCodec)
+
+
+def getAvailableCodecs():
+    codecs = list()
+
+    for codecClass in CODECS:
+        try:
+            codecs.append(codecClass())
+        except ImportError:
+            pass
+
+    return codecs
+
+
+def getCodec(name=CODEC_AUTO):
+    # The named codec, or the fastest installed when it is not
+    codecs = getAvailableCodecs()
+
+    for codec in codecs:
+        if codec.name == name:
+            return codec
+
+    if name != CODEC_AUTO:
+        logger.warning("The json codec {0} is not installed, using {1}".format(name, codecs[0].name))
+
+    return codecs[0]
+
+
+codec = getCodec(jsonCodec)
+codecName = codec.name
+
+loads = codec.loads
+dumps = codec.dumps
+dumpb = codec.dumpb
+
+
+def decodeResponse(response):
+    # Parses the body of a response as it came off the wire, without decoding it to text first
+    return loads(response.content)
+
+
+# The CodecSerializer has the elasticsearch client write its request bodies with the codec, as bytes, and read its
+# responses with it. What the codec can not serialise, such as dates and decimals, goes through the serializer of the
+# client.
+class CodecSerializer(JSONSerializer):
+    def loads(self, s):
+        try:
+            return loads(s)
+        except (ValueError, TypeError) as exception:
+            raise SerializationError(s, exception)
+
+    def dumps(self, data):
+        # Already serialised, such as a bulk body
+        if isinstance(data, (str, bytes)):
+            return data
+
+        try:
+            return dumpb(data)
+        except (ValueError, TypeError, OverflowError):
+            return super(CodecSerializer, self).dumps(data)
@@ -0,0 +1,122 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+from selfmetrics import escapeLabelValue, formatValue
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".monitorexporter")
+
+# The series exported for each bean and method: the metric name, its type, the help text and the monitor attribute
+MONITOR_FAMILIES = (
+    ("invocations", "counter", "Invocations", "invocationCount"),
+    ("execution_time_milliseconds", "counter", "Time spent executing", "executionTime"),
+    ("wait_time_milliseconds", "counter", "Time spent waiting for an instance", "waitTime"),
+    ("invocations_per_second", "gauge", "Invocations pr. second over the last sample", "invocationsPerSecond"),
+    ("execution_time_per_second", "gauge", "Milliseconds executing pr. second over the last sample",
+     "executionTimePerSecond"),
+    ("wait_time_per_second", "gauge", "Milliseconds waiting pr. second over the last sample", "waitTimePerSecond")
+)
+
+
+def makeFamilies(prefix, subject):
+    families = list()
+
+    for name, metricType, help, attribute in MONITOR_FAMILIES:
+        metricName = prefix + name
+        header = "# TYPE {0} {1}\n# HELP {0} {2} of {3}\n".format(metricName, metricType, help, subject)
+        sampleName = metricName + ("_total" if metricType == "counter" else "")
+        families.append((header, sampleName, attribute))
+
+    return families
+
+
+# The labels of the bean series, and of the method series
+LABELS = {
+    2: "{{target=\"{0}\",bean=\"{1}\"}}",
+    3: "{{target=\"{0}\",bean=\"{1}\",method=\"{2}\"}}"
+}
+
+BEAN_FAMILIES = makeFamilies("wildfly_ejb_bean_", "a stateless session bean")
+METHOD_FAMILIES = makeFamilies("wildfly_ejb_method_", "a stateless session bean method")
+
+
+# The MonitorExporter exposes the state of the bean and method monitors of one or more targets as OpenMetrics series,
+# in place of, or besides, the documents shipped to elasticsearch. The text is rendered by refresh(), after the
+# monitors have been updated, and kept for the scrapes, which then cost next to nothing. A refresh only renders the
+# lines of the monitors that took a new sample since the last one, the lines of the others are reused as they are.
+class MonitorExporter(object):
+    def __init__(self):
+        self._targets = OrderedDict()
+        self._lock = threading.Lock()
+
+        # The rendered lines of each monitor, with the sample time they were rendered for
+        self._cache = dict()
+        self._text = ""
+
+        self._refreshCounter = 0
+        self._renderedCounter = 0
+
+    @property
+    def text(self):
+        return self._text
+
+    @property
+    def refreshCounter(self):
+        return self._refreshCounter
+
+    @property
+    def renderedCounter(self):
+        # How many monitors have had their lines rendered, the rest of the refreshes reused them
+        return self._renderedCounter
+
+    def addTarget(self, name, beanMonitors):
+        self._targets[name] = beanMonitors
+
+    def _render(self, monitor, families, cache, *labelValues):
+        cached = self._cache.get(monitor)
+
+        if cached is None or cached[0] is not monitor.lastSampleTime:
+            labels = LABELS[len(labelValues)].format(*[escapeLabelValue(value) for value in labelValues])
+            cached = (monitor.lastSampleTime, tuple("{0}{1} {2}\n".format(sampleName, labels,
+                                                                          formatValue(getattr(monitor, attribute)))
+                                                    for header, sampleName, attribute in families))
+            self._renderedCounter += 1
+
+        cache[monitor] = cached
+
+        return cached[1]
+
+    def refresh(self):
+        with self._lock:
+            beanLines = [list() for family in BEAN_FAMILIES]
+            methodLines = [list() for family in METHOD_FAMILIES]
+            cache = dict()
+
+            for targetName, beanMonitors in self._targets.items():
+                # Beans may be added by the collection while the lines are rendered
+                for beanName, beanMonitor in list(beanMonitors.items()):
+                    if beanMonitor.lastSampleTime == 0:
+                        continue
+
+                    for lines, line in zip(beanLines, self._render(beanMonitor, BEAN_FAMILIES, cache, targetName,
+                                                                   beanName)):
+                        lines.append(line)
+
+                    for methodName, methodMonitor in list(beanMonitor.methods.items()):
+                        for lines, line in zip(methodLines, self._render(methodMonitor, METHOD_FAMILIES, cache,
+                                                                         targetName, beanName, methodName)):
+                            lines.append(line)
+
+            parts = list()
+            for families, familyLines in ((BEAN_FAMILIES, beanLines), (METHOD_FAMILIES, methodLines)):
+                for (header, sampleName, attribute), lines in zip(families, familyLines):
+                    if lines:
+                        parts.append(header)
+                        parts.extend(lines)
+
+            # Monitors that are gone drop out of the cache with the rebuild
+            self._cache = cache
+            self._text = "".join(parts)
+            self._refreshCounter += 1
@@ -0,0 +1,63 @@
+import os
+import logging
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".pollschedule")
+
+
+# The AdaptivePollSchedule decides which beans to poll in a cycle. A bean that showed activity on its last sample is
+# polled every cycle. An idle bean is backed off exponentially, skipping 1, 2, 4, ... cycles up to maxSkipCycles, and
+# is polled every cycle again as soon as a sample shows activity. The rates of the monitors stay correct over the
+# longer intervals, as they are calculated from the actual time between two samples. A maxSkipCycles of 0 polls every
+# bean every cycle.
+class AdaptivePollSchedule(object):
+    def __init__(self, maxSkipCycles):
+        self._maxSkipCycles = maxSkipCycles
+
+        self._cycle = 0
+        self._skipCycles = dict()
+        self._nextCycle = dict()
+
+        self._polledCounter = 0
+        self._skippedCounter = 0
+
+    @property
+    def polledCounter(self):
+        return self._polledCounter
+
+    @property
+    def skippedCounter(self):
+        return self._skippedCounter
+
+    def startCycle(self, monitors):
+        self._cycle += 1
+
+        due = list()
+        for monitor in monitors:
+            if self._nextCycle.get(monitor.name, 0) <= self._cycle:
+                due.append(monitor)
+            else:
+                self._skippedCounter += 1
+
+        self._polledCounter += len(due)
+
+        return due
+
+    def update(self, monitor):
+        if self._maxSkipCycles <= 0:
+            return
+
+        if monitor.activityOnLastSample:
+            skipCycles = 0
+        else:
+            skipCycles = min(max(1, self._skipCycles.get(monitor.name, 0) * 2), self._maxSkipCycles)
+
+            if skipCycles != self._skipCycles.get(monitor.name, 0):
+                logger.debug("Bean {0} is idle, polling it every {1} cycles".format(monitor.name, skipCycles + 1))
+
+        self._skipCycles[monitor.name] = skipCycles
+        self._nextCycle[monitor.name] = self._cycle + skipCycles + 1
+
+    def logStatistics(self):
+        logger.info("Poll stats: polled {0} beans and skipped {1} idle beans over {2} cycles"
+                    .format(self._polledCounter, self._skippedCounter, self._cycle))
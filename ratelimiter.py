@@ -0,0 +1,23 @@
+import threading
+import time
+
+
+# The RateLimiter spaces calls to acquire() out evenly, so that no more than ratePerSecond of them pass per second,
+# no matter how many threads are calling it. A rate of 0 disables the limit.
+class RateLimiter(object):
+    def __init__(self, ratePerSecond):
+        self._interval = (1.0 / ratePerSecond) if ratePerSecond > 0 else 0
+        self._lock = threading.Lock()
+        self._nextTime = time.monotonic()
+
+    def acquire(self):
+        if self._interval == 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            slotTime = max(self._nextTime, now)
+            self._nextTime = slotTime + self._interval
+
+        if slotTime > now:
+            time.sleep(slotTime - now)
@@ -0,0 +1,250 @@
+import os
+import sys
+import time
+import logging
+import resource
+import threading
+import socketserver
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".selfmetrics")
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# The metric names of the reporter all start with this
+PREFIX = "wildfly_reporter_"
+
+
+def escapeLabelValue(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join("{0}=\"{1}\"".format(name, escapeLabelValue(value)) for name, value in labels) + "}"
+
+
+def formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# A MetricFamily holds the samples of one metric, each sample a name suffix, its labels and a value, as exposed in
+# the OpenMetrics text format.
+class MetricFamily(object):
+    def __init__(self, name, metricType, help):
+        self.name = name
+        self.metricType = metricType
+        self.help = help
+        self.samples = list()
+
+    def render(self, lines):
+        lines.append("# TYPE {0} {1}".format(self.name, self.metricType))
+        lines.append("# HELP {0} {1}".format(self.name, self.help))
+
+        for suffix, labels, value in self.samples:
+            lines.append("{0}{1}{2} {3}".format(self.name, suffix, formatLabels(labels), formatValue(value)))
+
+
+# A MetricsSnapshot is filled by the collectors each time the metrics are scraped. Samples of the same name, with
+# different labels, end up in the same family.
+class MetricsSnapshot(object):
+    def __init__(self):
+        self._families = OrderedDict()
+
+    def _family(self, name, metricType, help):
+        family = self._families.get(name)
+
+        if family is None:
+            family = self._families[name] = MetricFamily(PREFIX + name, metricType, help)
+
+        return family
+
+    def counter(self, name, help, value, labels=()):
+        self._family(name, "counter", help).samples.append(("_total", tuple(labels), value))
+
+    def gauge(self, name, help, value, labels=()):
+        self._family(name, "gauge", help).samples.append(("", tuple(labels), value))
+
+    def histogram(self, name, help, histogram, labels=()):
+        family = self._family(name, "histogram", help)
+        counts, total = histogram.snapshot()
+        labels = tuple(labels)
+
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), counts):
+            cumulative += count
+            family.samples.append(("_bucket", labels + (("le", formatValue(float(bound))),), cumulative))
+
+        family.samples.append(("_count", labels, cumulative))
+        family.samples.append(("_sum", labels, total))
+
+    def render(self, expositions=()):
+        # Expositions are complete metric families rendered elsewhere, they go before the end of the text
+        lines = list()
+
+        for family in self._families.values():
+            family.render(lines)
+
+        return "\n".join(lines) + "\n" + "".join(expositions) + "# EOF\n"
+
+
+# SelfMetrics gathers the metrics of the reporter itself. The components keep their own counters and histograms,
+# the collectors read them when the metrics are scraped, so nothing is spent on metrics between scrapes. Errors are
+# counted here by the place they were caught at. The liveness of the reporter is judged by the time since the last
+# progress, a cycle completed or a wait for a host to come up, against the liveness timeout.
+class SelfMetrics(object):
+    def __init__(self, livenessTimeout=300):
+        self._collectors = list()
+        self._expositions = list()
+        self._livenessTimeout = livenessTimeout
+
+        self._lock = threading.Lock()
+        self._errorCounts = dict()
+        self._startTime = time.time()
+        self._lastProgressTime = time.monotonic()
+
+    @property
+    def livenessTimeout(self):
+        return self._livenessTimeout
+
+    @property
+    def secondsSinceProgress(self):
+        return time.monotonic() - self._lastProgressTime
+
+    @property
+    def alive(self):
+        return self.secondsSinceProgress <= self._livenessTimeout
+
+    def addCollector(self, collector):
+        self._collectors.append(collector)
+
+    def addExposition(self, exposition):
+        # The exposition returns the text of its metric families, as already rendered
+        self._expositions.append(exposition)
+
+    def countError(self, site):
+        with self._lock:
+            self._errorCounts[site] = self._errorCounts.get(site, 0) + 1
+
+    def markProgress(self):
+        self._lastProgressTime = time.monotonic()
+
+    def _collectProcess(self, snapshot):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        snapshot.gauge("process_start_time_seconds", "Start time of the reporter since the unix epoch",
+                       self._startTime)
+        snapshot.counter("process_cpu_seconds", "User and system CPU time spent by the reporter",
+                         usage.ru_utime + usage.ru_stime)
+
+        residentBytes = readResidentBytes()
+        if residentBytes is not None:
+            snapshot.gauge("process_resident_memory_bytes", "Resident memory of the reporter", residentBytes)
+
+        snapshot.gauge("process_threads", "Threads of the reporter", threading.active_count())
+
+    def collect(self):
+        snapshot = MetricsSnapshot()
+
+        self._collectProcess(snapshot)
+
+        with self._lock:
+            errorCounts = sorted(self._errorCounts.items())
+
+        for site, count in errorCounts:
+            snapshot.counter("errors", "Errors caught, by the function they were caught in", count,
+                             (("site", site),))
+
+        snapshot.gauge("seconds_since_progress", "Seconds since the reporter last made progress",
+                       self.secondsSinceProgress)
+        snapshot.gauge("alive", "1 while the reporter makes progress within the liveness timeout",
+                       1 if self.alive else 0)
+
+        for collector in self._collectors:
+            try:
+                collector(snapshot)
+            except Exception as exception:
+                logger.error("An error occurred when collecting the metrics of the reporter: {0}".format(exception))
+
+        return snapshot.render([exposition() for exposition in self._expositions])
+
+
+def readResidentBytes():
+    # /proc is there on Linux, anywhere else the peak resident memory is the closest
+    try:
+        with open("/proc/self/statm") as statmFile:
+            return int(statmFile.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        maxResident = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxResident if sys.platform == "darwin" else maxResident * 1024
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class SelfMetricsRequestHandler(BaseHTTPRequestHandler):
+    selfMetrics = None
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _respond(self, status, contentType, body):
+        body = body.encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+
+        if path == "/metrics":
+            self._respond(200, CONTENT_TYPE, self.selfMetrics.collect())
+        elif path in ("/healthz", "/livez"):
+            # Orchestration restarts the reporter when this fails, a wedged reporter does not recover on its own
+            if self.selfMetrics.alive:
+                self._respond(200, "text/plain; charset=utf-8", "ok\n")
+            else:
+                self._respond(503, "text/plain; charset=utf-8", "no progress for {0:.0f} seconds\n".format(
+                    self.selfMetrics.secondsSinceProgress))
+        else:
+            self._respond(404, "text/plain; charset=utf-8", "not found\n")
+
+
+# The SelfMetricsServer serves the metrics on /metrics, and the liveness on /healthz, from a thread of its own.
+class SelfMetricsServer(object):
+    def __init__(self, selfMetrics, host="0.0.0.0", port=9180):
+        self._selfMetrics = selfMetrics
+        self._host = host
+        self._port = port
+
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1] if self._server is not None else self._port
+
+    def start(self):
+        handler = type("SelfMetricsRequestHandler", (SelfMetricsRequestHandler,), {"selfMetrics": self._selfMetrics})
+
+        self._server = ThreadingHTTPServer((self._host, self._port), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="selfmetrics")
+        self._thread.daemon = True
+        self._thread.start()
+
+        logger.info("Serving the metrics of the reporter on http://{0}:{1}/metrics".format(self._host, self.port))
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
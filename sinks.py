@@ -0,0 +1,364 @@
+import os
+import re
+import sys
+import gzip
+import time
+import shutil
+import socket
+import logging
+import threading
+from collections import deque
+
+from jsoncodec import dumps, dumpb
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".sinks")
+
+SINK_ELASTICSEARCH = "elasticsearch"
+SINK_NDJSON = "ndjson"
+SINK_STDOUT = "stdout"
+SINK_STATSD = "statsd"
+
+# The rates of the bean and method documents, sent as gauges by the statsd sink
+RATE_SUFFIX = "-per-second"
+
+
+def bulkAction(index, docType):
+    return {"index": {"_index": index, "_type": docType}}
+
+
+# A Sink receives every document produced by the collection, with the index and document type it would have been
+# indexed with in elasticsearch. write() is called on the collecting threads, so it has to return straight away.
+class Sink(object):
+    def __init__(self, name):
+        self._name = name
+
+        self._writtenCounter = 0
+        self._droppedCounter = 0
+        self._errorCounter = 0
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def writtenCounter(self):
+        return self._writtenCounter
+
+    @property
+    def droppedCounter(self):
+        return self._droppedCounter
+
+    @property
+    def errorCounter(self):
+        return self._errorCounter
+
+    def start(self):
+        pass
+
+    def write(self, index, docType, jsondoc):
+        raise NotImplementedError()
+
+    def close(self, timeout=30):
+        pass
+
+    def logStatistics(self):
+        logger.info("Sink stats: {0} wrote {1} documents, dropped {2}, {3} errors"
+                    .format(self._name, self._writtenCounter, self._droppedCounter, self._errorCounter))
+
+
+# The ElasticsearchSink hands the documents to the existing elasticsearch dispatch, which has its own queue, bulk
+# writer and spool, and is started and closed along with them.
+class ElasticsearchSink(Sink):
+    def __init__(self, dispatch):
+        super(ElasticsearchSink, self).__init__(SINK_ELASTICSEARCH)
+        self._dispatch = dispatch
+
+    def write(self, index, docType, jsondoc):
+        self._dispatch(index, jsondoc, docType)
+        self._writtenCounter += 1
+
+
+# A BatchingSink queues the documents and writes them in batches on a thread of its own, once maxBatch documents are
+# queued or the oldest has waited maxAge seconds. At most maxQueued documents are kept, beyond that the oldest are
+# dropped, a sink that can not keep up should never hold back the collection or the other sinks.
+class BatchingSink(Sink):
+    def __init__(self, name, maxBatch=500, maxAge=1.0, maxQueued=10000):
+        super(BatchingSink, self).__init__(name)
+        self._maxBatch = maxBatch
+        self._maxAge = maxAge
+        self._maxQueued = maxQueued
+
+        self._queue = deque()
+        self._queueStartTime = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sink-" + self._name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, index, docType, jsondoc):
+        with self._condition:
+            if self._closed:
+                self._droppedCounter += 1
+                return
+
+            if len(self._queue) >= self._maxQueued:
+                self._queue.popleft()
+                self._droppedCounter += 1
+
+            if len(self._queue) == 0:
+                self._queueStartTime = time.time()
+
+            self._queue.append((index, docType, jsondoc))
+
+            if len(self._queue) >= self._maxBatch:
+                self._condition.notify()
+
+    def close(self, timeout=30):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+        else:
+            self._writeQueued()
+
+        self._closeOutput()
+
+    def _isDue(self):
+        return len(self._queue) >= self._maxBatch or (
+            len(self._queue) > 0 and (time.time() - self._queueStartTime) >= self._maxAge)
+
+    def _takeBatch(self):
+        batch = list()
+
+        while self._queue and len(batch) < self._maxBatch:
+            batch.append(self._queue.popleft())
+
+        self._queueStartTime = time.time()
+
+        return batch
+
+    def _writeQueued(self):
+        while True:
+            with self._condition:
+                batch = self._takeBatch()
+
+            if not batch:
+                return
+
+            self._writeBatchSafely(batch)
+
+    def _writeBatchSafely(self, batch):
+        try:
+            self._writeBatch(batch)
+            self._writtenCounter += len(batch)
+        except Exception as exception:
+            self._errorCounter += 1
+            self._droppedCounter += len(batch)
+            logger.error("An error occurred when writing {0} documents to the {1} sink: {2}".format(
+                len(batch), self._name, exception))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._isDue():
+                    if len(self._queue) == 0:
+                        self._condition.wait(self._maxAge)
+                    else:
+                        self._condition.wait(max(0.0, self._queueStartTime + self._maxAge - time.time()))
+
+                closed = self._closed
+                batch = self._takeBatch()
+
+            if batch:
+                self._writeBatchSafely(batch)
+
+            if closed:
+                self._writeQueued()
+                return
+
+    def _writeBatch(self, batch):
+        raise NotImplementedError()
+
+    def _closeOutput(self):
+        pass
+
+
+# The NdjsonFileSink writes the documents as newline delimited json to a file in the given directory, for a shipper
+# such as Filebeat to pick up. Each document is preceded by the bulk action line it would have been indexed with, so
+# the samples, rollups and raw payloads can be told apart, and a file can be replayed as the body of a bulk request. The file is rotated once it reaches maxBytes or is rotateInterval seconds old, the
+# rotated file is gzipped, and only the newest maxFiles rotated files are kept.
+class NdjsonFileSink(BatchingSink):
+    def __init__(self, directory, prefix="wildfly-stats", maxBytes=64 * 1024 * 1024, rotateInterval=3600,
+                 maxFiles=48, compress=True, **batching):
+        super(NdjsonFileSink, self).__init__(SINK_NDJSON, **batching)
+        self._directory = directory
+        self._prefix = prefix
+        self._maxBytes = maxBytes
+        self._rotateInterval = rotateInterval
+        self._maxFiles = maxFiles
+        self._compress = compress
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._path = os.path.join(directory, prefix + ".ndjson")
+        self._file = None
+        self._fileBytes = 0
+        self._fileOpenTime = 0
+
+        self._rotationCounter = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    def _open(self):
+        # A file left behind by an earlier run is appended to, and rotated on its own schedule
+        self._file = open(self._path, "ab")
+        self._fileBytes = self._file.tell()
+        self._fileOpenTime = os.path.getmtime(self._path) if self._fileBytes > 0 else time.time()
+
+    def _writeBatch(self, batch):
+        if self._file is None:
+            self._open()
+
+        data = b"".join(dumpb(bulkAction(index, docType)) + b"\n" + dumpb(jsondoc) + b"\n"
+                        for index, docType, jsondoc in batch)
+        self._file.write(data)
+        self._file.flush()
+        self._fileBytes += len(data)
+
+        if self._fileBytes >= self._maxBytes or (time.time() - self._fileOpenTime) >= self._rotateInterval:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+
+        # Files rotated within the same second are told apart, and kept in order, by the rotation counter
+        rotatedPath = os.path.join(self._directory, "{0}-{1}-{2:04d}.ndjson".format(
+            self._prefix, time.strftime("%Y%m%d-%H%M%S", time.gmtime()), self._rotationCounter % 10000))
+        os.rename(self._path, rotatedPath)
+        self._rotationCounter += 1
+
+        if self._compress:
+            with open(rotatedPath, "rb") as source, gzip.open(rotatedPath + ".gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotatedPath)
+
+        rotated = sorted(name for name in os.listdir(self._directory)
+                         if name.startswith(self._prefix + "-") and name.endswith((".ndjson", ".ndjson.gz")))
+        for name in rotated[:max(0, len(rotated) - self._maxFiles)]:
+            os.remove(os.path.join(self._directory, name))
+
+    def _closeOutput(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def logStatistics(self):
+        super(NdjsonFileSink, self).logStatistics()
+        logger.info("Sink stats: {0} has rotated {1} files in {2}, the current holds {3} bytes"
+                    .format(self._name, self._rotationCounter, self._directory, self._fileBytes))
+
+
+# The StdoutSink writes the documents as newline delimited json to the standard output, for when the output of the
+# container is collected, each preceded by its bulk action line as in the NdjsonFileSink. The log of the reporter goes to the standard error.
+class StdoutSink(BatchingSink):
+    def __init__(self, stream=None, **batching):
+        super(StdoutSink, self).__init__(SINK_STDOUT, **batching)
+        self._stream = stream
+
+    def _writeBatch(self, batch):
+        stream = self._stream or sys.stdout
+        stream.write("".join(dumps(bulkAction(index, docType)) + "\n" + dumps(jsondoc) + "\n"
+                             for index, docType, jsondoc in batch))
+        stream.flush()
+
+
+def sanitizeStatsdName(name):
+    return re.sub(r"[^A-Za-z0-9_-]", "_", str(name))
+
+
+# The StatsdSink sends the per second rates of the bean and method documents as statsd gauges over UDP, named
+# <prefix>.<target>.<bean>[.<method>].<stat>, packed into datagrams of at most maxPacketBytes. Sending is fire and
+# forget, a datagram that can not be sent is counted and forgotten.
+class StatsdSink(BatchingSink):
+    def __init__(self, host="localhost", port=8125, prefix="wildfly", maxPacketBytes=1432, **batching):
+        super(StatsdSink, self).__init__(SINK_STATSD, **batching)
+        self._address = (host, port)
+        self._prefix = prefix
+        self._maxPacketBytes = maxPacketBytes
+
+        self._socket = None
+        self._packetCounter = 0
+
+    @property
+    def packetCounter(self):
+        return self._packetCounter
+
+    def _gauges(self, jsondoc, names=None):
+        if names is None:
+            # The alias of a target of the targets file, or the host and port of the single wildfly host
+            target = jsondoc.get("wildfly-alias") or jsondoc.get("wildfly-host-url", "").split("://", 1)[-1]
+            names = [self._prefix, sanitizeStatsdName(target)]
+
+        for nameKey in ("bean-name", "method-name"):
+            if nameKey in jsondoc:
+                names = names + [sanitizeStatsdName(jsondoc[nameKey])]
+        name = ".".join(names)
+
+        for key, value in jsondoc.items():
+            if key.endswith(RATE_SUFFIX):
+                # The stat without its bean- or method- prefix
+                yield "{0}.{1}:{2}|g".format(name, sanitizeStatsdName(key.split("-", 1)[1]), value)
+
+        # The beans and methods nested in the documents of the consolidated layouts
+        for nestedKey in ("beans", "methods"):
+            for nested in jsondoc.get(nestedKey) or ():
+                for gauge in self._gauges(nested, names):
+                    yield gauge
+
+    def _send(self, packet):
+        try:
+            self._socket.sendto(packet.encode("utf-8"), self._address)
+            self._packetCounter += 1
+        except (IOError, OSError):
+            self._errorCounter += 1
+
+    def _writeBatch(self, batch):
+        if self._socket is None:
+            # Resolved once, rather than for every datagram
+            self._address = (socket.gethostbyname(self._address[0]), self._address[1])
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+
+        packet = ""
+        for index, docType, jsondoc in batch:
+            for line in self._gauges(jsondoc):
+                if packet and len(packet) + len(line) + 1 > self._maxPacketBytes:
+                    self._send(packet)
+                    packet = ""
+
+                packet = packet + "\n" + line if packet else line
+
+        if packet:
+            self._send(packet)
+
+    def _closeOutput(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def logStatistics(self):
+        super(StatsdSink, self).logStatistics()
+        logger.info("Sink stats: {0} sent {1} datagrams to {2}:{3}".format(self._name, self._packetCounter,
+                                                                          *self._address))
@@ -0,0 +1,311 @@
+import os
+import gzip
+import zlib
+import time
+import logging
+import threading
+
+from ratelimiter import RateLimiter
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".spool")
+
+SEGMENT_PREFIX = "spool-"
+SEGMENT_SUFFIX = ".ndjson.gz"
+OFFSET_FILE = "replay.offset"
+
+
+# The Spool is a write-ahead log on local disk for documents that could not be delivered to elasticsearch. Documents
+# are kept as the action and source lines of a bulk request, as bytes, appended to segment files. Appends are collected
+# in memory and written as one gzip member, followed by an fsync, every syncInterval seconds or syncBytes bytes, so the
+# cost of an append is little more than a list append. Segments are rolled over at segmentBytes, and the oldest are
+# deleted when the spool grows past maxBytes or they get older than maxAge seconds.
+#
+# Segments are never appended to after a restart, a new one is started instead, and a segment with a torn last write
+# is read up to the tear. How far the replay got into the oldest segment is kept in a small offset file, so a restart
+# does not replay documents twice.
+class Spool(object):
+    def __init__(self, directory, maxBytes=512 * 1024 * 1024, segmentBytes=8 * 1024 * 1024, maxAge=7 * 86400,
+                 syncInterval=1.0, syncBytes=256 * 1024):
+        self._directory = directory
+        self._maxBytes = maxBytes
+        self._segmentBytes = segmentBytes
+        self._maxAge = maxAge
+        self._syncInterval = syncInterval
+        self._syncBytes = syncBytes
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+
+        self._segments = sorted(name for name in os.listdir(directory)
+                                if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        self._sequence = 0
+        if self._segments:
+            self._sequence = int(self._segments[-1][len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1
+            logger.info("Found {0} spooled segments in {1} to replay".format(len(self._segments), directory))
+
+        self._currentName = None
+        self._currentFile = None
+
+        self._pending = list()
+        self._pendingBytes = 0
+        self._lastSyncTime = time.time()
+
+        self._spooledCounter = 0
+        self._replayedCounter = 0
+        self._discardedSegmentCounter = 0
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def spooledCounter(self):
+        return self._spooledCounter
+
+    @property
+    def replayedCounter(self):
+        return self._replayedCounter
+
+    @property
+    def isEmpty(self):
+        return len(self._segments) == 0 and len(self._pending) == 0
+
+    def append(self, action, source):
+        with self._lock:
+            self._pending.append(action)
+            self._pending.append(source)
+            self._pendingBytes += len(action) + len(source) + 2
+            self._spooledCounter += 1
+
+            if (self._pendingBytes >= self._syncBytes) or ((time.time() - self._lastSyncTime) >= self._syncInterval):
+                self._sync()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def seal(self):
+        # Makes everything appended so far available for replay
+        with self._lock:
+            self._sync()
+            self._closeCurrent()
+
+    def close(self):
+        self.seal()
+
+    def _sync(self):
+        self._lastSyncTime = time.time()
+
+        if len(self._pending) == 0:
+            return
+
+        data = gzip.compress(b"\n".join(self._pending) + b"\n", compresslevel=1)
+
+        if self._currentFile is None:
+            self._currentName = "{0}{1:012d}{2}".format(SEGMENT_PREFIX, self._sequence, SEGMENT_SUFFIX)
+            self._currentFile = open(os.path.join(self._directory, self._currentName), "ab")
+            self._segments.append(self._currentName)
+            self._sequence += 1
+
+        self._currentFile.write(data)
+        self._currentFile.flush()
+        os.fsync(self._currentFile.fileno())
+
+        self._pending = list()
+        self._pendingBytes = 0
+
+        if self._currentFile.tell() >= self._segmentBytes:
+            self._closeCurrent()
+
+        self._enforceLimits()
+
+    def _closeCurrent(self):
+        if self._currentFile is not None:
+            self._currentFile.close()
+            self._currentFile = None
+            self._currentName = None
+
+    def _enforceLimits(self):
+        now = time.time()
+        sizes = dict()
+        modifiedTimes = dict()
+
+        # A segment removed underneath the spool counts as empty, and too old to keep
+        for name in self._segments:
+            try:
+                sizes[name] = os.path.getsize(os.path.join(self._directory, name))
+                modifiedTimes[name] = os.path.getmtime(os.path.join(self._directory, name))
+            except OSError:
+                sizes[name] = 0
+                modifiedTimes[name] = 0
+
+        totalBytes = sum(sizes.values())
+
+        for name in list(self._segments):
+            if name == self._currentName:
+                break
+
+            tooOld = (now - modifiedTimes[name]) > self._maxAge
+            if not tooOld and totalBytes <= self._maxBytes:
+                break
+
+            logger.warning("Discarding the spooled segment {0}, the spool is {1} bytes and the segment is {2}"
+                           .format(name, totalBytes, "too old" if tooOld else "the oldest"))
+            totalBytes -= sizes[name]
+            self._discardedSegmentCounter += 1
+            self.removeSegment(name)
+
+    def sealedSegments(self):
+        with self._lock:
+            return [name for name in self._segments if name != self._currentName]
+
+    def readSegment(self, name):
+        # Yields the (action, source) pairs of the segment, stopping at a torn write
+        action = None
+
+        try:
+            with gzip.open(os.path.join(self._directory, name), "rb") as segmentFile:
+                for line in segmentFile:
+                    if not line.endswith(b"\n"):
+                        break
+
+                    if action is None:
+                        action = line[:-1]
+                    else:
+                        yield action, line[:-1]
+                        action = None
+
+        except (EOFError, OSError, zlib.error) as exception:
+            logger.warning("The spooled segment {0} ends in a torn write, replaying what could be read: {1}"
+                           .format(name, exception))
+
+    def removeSegment(self, name):
+        with self._lock:
+            if name in self._segments:
+                self._segments.remove(name)
+
+            try:
+                os.remove(os.path.join(self._directory, name))
+            except OSError:
+                pass
+
+            if self.loadOffset()[0] == name:
+                os.remove(os.path.join(self._directory, OFFSET_FILE))
+
+    def loadOffset(self):
+        try:
+            with open(os.path.join(self._directory, OFFSET_FILE)) as offsetFile:
+                name, count = offsetFile.read().split()
+                return name, int(count)
+        except (OSError, ValueError):
+            return None, 0
+
+    def saveOffset(self, name, count):
+        path = os.path.join(self._directory, OFFSET_FILE)
+
+        with open(path + ".tmp", "w") as offsetFile:
+            offsetFile.write("{0} {1}\n".format(name, count))
+            offsetFile.flush()
+            os.fsync(offsetFile.fileno())
+
+        os.replace(path + ".tmp", path)
+
+    def countReplayed(self, documents):
+        with self._lock:
+            self._replayedCounter += documents
+
+    def logStatistics(self):
+        logger.info("Spool stats: {0} documents spooled, {1} replayed, {2} segments waiting and {3} discarded in {4}"
+                    .format(self._spooledCounter, self._replayedCounter, len(self._segments),
+                            self._discardedSegmentCounter, self._directory))
+
+
+# The SpoolReplayer watches the spool from a thread of its own, and syncs it every second. While there is something
+# spooled, it probes elasticsearch every probeInterval seconds, and once it responds, replays the spooled documents
+# oldest first, in bulk requests of chunkSize documents and at no more than ratePerSecond documents pr. second. The
+# sender gets the bulk lines of a chunk and returns whether they were delivered, if not the replay stops and waits for
+# the next probe.
+class SpoolReplayer(object):
+    def __init__(self, spool, sender, probe, ratePerSecond=500, chunkSize=500, probeInterval=10):
+        self._spool = spool
+        self._sender = sender
+        self._probe = probe
+        self._chunkSize = chunkSize
+        self._probeInterval = probeInterval
+        self._rateLimiter = RateLimiter(float(ratePerSecond) / chunkSize)
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="spoolreplayer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopped.set()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        nextProbeTime = 0
+
+        while not self._stopped.is_set():
+            # Makes sure appends reach the disk even when no more documents come in to trigger it
+            self._spool.sync()
+
+            if not self._spool.isEmpty and time.time() >= nextProbeTime:
+                if not (self._probe() and self._replay()):
+                    nextProbeTime = time.time() + self._probeInterval
+
+            self._stopped.wait(1.0)
+
+    def _replay(self):
+        if len(self._spool.sealedSegments()) == 0:
+            self._spool.seal()
+
+        for name in self._spool.sealedSegments():
+            offsetName, skip = self._spool.loadOffset()
+            if offsetName != name:
+                skip = 0
+
+            logger.info("Replaying the spooled segment {0} to elasticsearch".format(name))
+
+            count = 0
+            chunk = list()
+
+            for action, source in self._spool.readSegment(name):
+                count += 1
+                if count <= skip:
+                    continue
+
+                chunk.append(action)
+                chunk.append(source)
+
+                if len(chunk) >= self._chunkSize * 2:
+                    if not self._sendChunk(chunk):
+                        return False
+                    self._spool.saveOffset(name, count)
+                    chunk = list()
+
+            if chunk and not self._sendChunk(chunk):
+                return False
+
+            self._spool.removeSegment(name)
+
+        return True
+
+    def _sendChunk(self, chunk):
+        if self._stopped.is_set():
+            return False
+
+        self._rateLimiter.acquire()
+
+        if not self._sender(chunk):
+            return False
+
+        self._spool.countReplayed(len(chunk) // 2)
+        return True
@@ -8,16 +8,40 @@
 # DONE: Update the monitor to report methodlevel stats
 
 from datetime import datetime
+import asyncio
 import signal
 import logging
+import threading
 import time
 import requests
-from requests.auth import HTTPDigestAuth
 import os
 import sys
+from collections import OrderedDict
 from elasticsearch import Elasticsearch
-
-from monitor import Monitor
+from elasticsearch.exceptions import ConflictError
+
+from wildfly.monitor import BeanMonitor, formatSampleTime, reportRawJson, rawPayloads
+from wildfly.rawpayload import STORE_INLINE, STORE_INDEX
+from wildfly.engine import CollectionEngine, loadTargets
+from wildfly.stream import readStreamedObject, streamResponses
+from wildfly.rollup import MonitorRollups, getRollupMapping
+from wildfly.layout import documentLayout, getMapping, getRawPayloadMapping, buildBeanDocument, buildCycleDocument, \
+    LAYOUT_FLAT, LAYOUT_CYCLE
+from bulkwriter import BulkWriter
+from esindices import IndexManager, getDocumentId
+from asynccollector import AsyncCollector
+from ratelimiter import RateLimiter
+from dispatchqueue import DispatchQueue
+from spool import Spool, SpoolReplayer
+from pollschedule import AdaptivePollSchedule
+from cyclescheduler import CycleScheduler
+from concurrent.futures import ThreadPoolExecutor
+from wildfly.connection import defaultConnectionPool, connectionPoolSize
+from selfmetrics import SelfMetrics, SelfMetricsServer
+from monitorexporter import MonitorExporter
+from sinks import ElasticsearchSink, NdjsonFileSink, StdoutSink, StatsdSink
+from histogram import Histogram
+from jsoncodec import CodecSerializer, decodeResponse, dumpb, codecName
 
 monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
 
@@ -59,6 +83,28 @@ wildflySubDeployment = os.getenv('WILDFLY_SUBDEPLOYMENT', 'etel-ejb-1.0-SNAPSHOT
 wildflyUser = os.getenv('WILDFLY_USER', 'etel')
 wildflyPassword = os.getenv('WILDFLY_PASS', 'etel')
 wildflyDisableStatsTrackingOnExit = os.getenv('WILDFLY_DISABLE_EJB3_TRACKING_ON_EXIT', "True")
+# A json file listing several wildfly targets to collect from, instead of the single host configured above
+wildflyTargetsFile = os.getenv('WILDFLY_TARGETS_FILE', '')
+# Collection cycles start every WILDFLY_COLLECTION_INTERVAL seconds, a cycle running past the start of the next either
+# has the missed cycles skipped, or coalesced into one starting straight away, see WILDFLY_CYCLE_OVERRUN_POLICY
+wildflyCollectionInterval = float(os.getenv('WILDFLY_COLLECTION_INTERVAL', '5'))
+wildflyCycleOverrunPolicy = os.getenv('WILDFLY_CYCLE_OVERRUN_POLICY', 'skip')
+# Either "bean", one request per bean each cycle, or "subsystem", one recursive read of the whole ejb3 subsystem
+wildflyCollectionMode = os.getenv('WILDFLY_COLLECTION_MODE', 'bean')
+# Either "monitors", a monitor object per bean and method, or "columnar" to keep the state of all beans and methods in
+# arrays, and calculate the deltas and rates of a whole cycle in one go (subsystem collection mode only)
+wildflyStateStore = os.getenv('WILDFLY_STATE_STORE', 'monitors')
+# Either "sequential", "threads" to collect the beans on WILDFLY_WORKER_THREADS threads, or "asyncio" to collect the
+# beans concurrently, with at most WILDFLY_MAX_IN_FLIGHT requests outstanding against the wildfly host (bean
+# collection mode only)
+wildflyCollectionEngine = os.getenv('WILDFLY_COLLECTION_ENGINE', 'sequential')
+wildflyMaxInFlight = int(os.getenv('WILDFLY_MAX_IN_FLIGHT', '8'))
+wildflyWorkerThreads = int(os.getenv('WILDFLY_WORKER_THREADS', '4'))
+# Bean requests pr. second over all threads of the sequential and threads engines, 0 for no limit
+wildflyMaxRequestsPerSecond = float(os.getenv('WILDFLY_MAX_REQUESTS_PER_SECOND', '10'))
+# Idle beans are polled less and less often, skipping at most this many cycles, 0 polls every bean every cycle (bean
+# collection mode only)
+wildflyIdleMaxSkipCycles = int(os.getenv('WILDFLY_IDLE_MAX_SKIP_CYCLES', '12'))
 
 # Compose the target Wildfly mangement HTTP endpoint that we are targeting
 wildflyHostUrl = (wildflyProtocol + '://' +
@@ -75,6 +121,76 @@ esHost = os.getenv('ES_HOST', 'localhost')
 esPort = os.getenv('ES_PORT', '9200')
 esIndex = os.getenv('ES_INDEX', 'etel')
 esDocType = os.getenv('ES_DOCTYPE', 'bean-stats')
+esBulkEnabled = os.getenv('ES_BULK_ENABLED', "True")
+esBulkMaxDocs = int(os.getenv('ES_BULK_MAX_DOCS', '500'))
+esBulkMaxBytes = int(os.getenv('ES_BULK_MAX_BYTES', str(5 * 1024 * 1024)))
+esBulkMaxAge = float(os.getenv('ES_BULK_MAX_AGE', '5'))
+# Documents are given an id made from the target, bean, method and sample time, and created rather than indexed, so a
+# document sent again is refused by elasticsearch instead of counted twice. That makes it safe to send documents again
+# ES_RETRIES times, backing off ES_RETRY_BACKOFF seconds doubling each time, when a request fails or times out after
+# ES_REQUEST_TIMEOUT seconds
+esDocumentIds = os.getenv('ES_DOCUMENT_IDS', "True")
+esRetries = int(os.getenv('ES_RETRIES', '3'))
+esRetryBackoff = float(os.getenv('ES_RETRY_BACKOFF', '0.5'))
+esRequestTimeout = float(os.getenv('ES_REQUEST_TIMEOUT', '10'))
+# An index template with the mapping of the documents is installed for each index on startup. ES_INDEX_ROTATION is
+# either "none", writing to ES_INDEX as is, "daily" for an index pr. day, or "rollover" for indices rolled over by
+# elasticsearch once one of the ES_ROLLOVER_* conditions is met. Both are read through the alias ES_INDEX.
+# An existing install written with "none" has a concrete index named ES_INDEX, ROLLUP_INDEX or RAW_PAYLOAD_INDEX, which
+# is in the way of the alias, and the reporter refuses to start with rotation until it is moved aside: copy it with the
+# _reindex api to a name its template matches, <index>-2000.01.01 for daily or <index>-000000 for rollover, and delete
+# it, or just delete it if its documents are not needed
+esIndexTemplate = os.getenv('ES_INDEX_TEMPLATE', "True")
+esIndexRotation = os.getenv('ES_INDEX_ROTATION', 'none')
+esIndexShards = int(os.getenv('ES_INDEX_SHARDS', '1'))
+esIndexReplicas = int(os.getenv('ES_INDEX_REPLICAS', '1'))
+esIndexRefreshInterval = os.getenv('ES_INDEX_REFRESH_INTERVAL', '30s')
+esRolloverMaxAge = os.getenv('ES_ROLLOVER_MAX_AGE', '1d')
+esRolloverMaxDocs = int(os.getenv('ES_ROLLOVER_MAX_DOCS', '0'))
+esRolloverMaxSize = os.getenv('ES_ROLLOVER_MAX_SIZE', '')
+esRolloverCheckInterval = float(os.getenv('ES_ROLLOVER_CHECK_INTERVAL', '300'))
+# Documents wait for dispatch in a queue of at most DISPATCH_QUEUE_SIZE documents, 0 dispatches on the collecting
+# thread. When the queue is full, DISPATCH_QUEUE_OVERFLOW decides between "block", "drop-oldest" and "drop-newest"
+dispatchQueueSize = int(os.getenv('DISPATCH_QUEUE_SIZE', '10000'))
+dispatchQueueOverflow = os.getenv('DISPATCH_QUEUE_OVERFLOW', 'drop-oldest')
+# Documents that could not be delivered are spooled to SPOOL_DIR, when set, and replayed once elasticsearch is back
+spoolDirectory = os.getenv('SPOOL_DIR', '')
+spoolMaxBytes = int(os.getenv('SPOOL_MAX_BYTES', str(512 * 1024 * 1024)))
+spoolMaxAge = float(os.getenv('SPOOL_MAX_AGE', str(7 * 86400)))
+spoolReplayRate = float(os.getenv('SPOOL_REPLAY_RATE', '500'))
+# The samples are rolled up into windows of ROLLUP_WINDOWS seconds, a comma separated list such as "60,900", and the
+# rollups written to ROLLUP_INDEX as each window ends. Empty for no rollups
+rollupWindows = [int(seconds) for seconds in os.getenv('ROLLUP_WINDOWS', '').split(",") if seconds.strip()]
+rollupIndex = os.getenv('ROLLUP_INDEX', esIndex + '-rollup')
+# The raw json of the samples, with REPORT_RAW set and stored apart, see RAW_PAYLOAD_STORE, goes to RAW_PAYLOAD_INDEX
+rawPayloadIndex = os.getenv('RAW_PAYLOAD_INDEX', esIndex + '-raw')
+# Either "elasticsearch", shipping a document per active bean and method each cycle, "prometheus" to expose the bean and
+# method stats on the /metrics endpoint of the reporter instead, or "both"
+outputMode = os.getenv('OUTPUT_MODE', 'elasticsearch')
+exportPrometheus = outputMode in ("prometheus", "both")
+# The documents are written to every sink of SINKS, a comma separated list of "elasticsearch", "ndjson" for a rotated
+# and gzipped newline delimited json file in NDJSON_DIR, "stdout", and "statsd" for the per second rates as gauges.
+# The ndjson and stdout sinks write each document after its bulk action line, with the index it belongs to.
+# Besides elasticsearch, each sink batches the documents on a thread of its own
+sinkNames = [name.strip() for name in os.getenv(
+    'SINKS', 'elasticsearch' if outputMode in ("elasticsearch", "both") else '').split(",") if name.strip()]
+shipToElasticsearch = "elasticsearch" in sinkNames
+sinkMaxBatch = int(os.getenv('SINK_MAX_BATCH', '500'))
+sinkMaxAge = float(os.getenv('SINK_MAX_AGE', '1'))
+sinkMaxQueued = int(os.getenv('SINK_MAX_QUEUED', '10000'))
+ndjsonDirectory = os.getenv('NDJSON_DIR', '/var/log/' + monitorName)
+ndjsonMaxBytes = int(os.getenv('NDJSON_MAX_BYTES', str(64 * 1024 * 1024)))
+ndjsonRotateInterval = float(os.getenv('NDJSON_ROTATE_INTERVAL', '3600'))
+ndjsonMaxFiles = int(os.getenv('NDJSON_MAX_FILES', '48'))
+ndjsonCompress = os.getenv('NDJSON_COMPRESS', "True")
+statsdHost = os.getenv('STATSD_HOST', 'localhost')
+statsdPort = int(os.getenv('STATSD_PORT', '8125'))
+statsdPrefix = os.getenv('STATSD_PREFIX', 'wildfly')
+# The metrics of the reporter itself are served on METRICS_PORT, when set, along with a liveness check that fails once
+# no collection cycle has completed for METRICS_LIVENESS_TIMEOUT seconds
+metricsHost = os.getenv('METRICS_HOST', '0.0.0.0')
+metricsPort = int(os.getenv('METRICS_PORT', '9180' if exportPrometheus else '0'))
+metricsLivenessTimeout = float(os.getenv('METRICS_LIVENESS_TIMEOUT', str(max(300.0, 10 * wildflyCollectionInterval))))
 
 # Compose the target Wildfly mangement HTTP endpoint that we are targeting
 esHostUrl = (esProtocol + '://' +
@@ -82,21 +198,144 @@ esHostUrl = (esProtocol + '://' +
              esPort)
 
 # Initiate the elasticsearch client
-esClient = Elasticsearch(hosts=[{'host': esHost, 'port': esPort}])
+esClient = Elasticsearch(hosts=[{'host': esHost, 'port': esPort}], timeout=esRequestTimeout,
+                         serializer=CodecSerializer())
+
+useDocumentIds = esDocumentIds in ("True", "1", "Yes")
+
+# Keep-alive sessions shared by every request towards the wildfly and elasticsearch hosts
+wildflySession = defaultConnectionPool.getSession("wildfly", wildflyHostUrl, wildflyUser, wildflyPassword,
+                                                  pool_size=max(connectionPoolSize, wildflyMaxInFlight,
+                                                                wildflyWorkerThreads))
+esSession = defaultConnectionPool.getSession("elasticsearch", esHostUrl)
+
+# The indices written to, and their templates
+rolloverConditions = dict()
+if esRolloverMaxAge:
+    rolloverConditions["max_age"] = esRolloverMaxAge
+if esRolloverMaxDocs > 0:
+    rolloverConditions["max_docs"] = esRolloverMaxDocs
+if esRolloverMaxSize:
+    rolloverConditions["max_size"] = esRolloverMaxSize
+
+indexManager = IndexManager(esClient, esIndexRotation, {
+    "number_of_shards": esIndexShards,
+    "number_of_replicas": esIndexReplicas,
+    "refresh_interval": esIndexRefreshInterval
+}, rolloverConditions, esRolloverCheckInterval)
+indexManager.addIndex(esIndex, esDocType, getMapping(documentLayout))
+if rollupWindows:
+    indexManager.addIndex(rollupIndex, esDocType, getRollupMapping())
+if reportRawJson and rawPayloads.store == STORE_INDEX:
+    indexManager.addIndex(rawPayloadIndex, esDocType, getRawPayloadMapping())
+    rawPayloads.setDispatcher(lambda jsondoc: dispatchRawPayloadDocument(jsondoc))
+
+spool = None
+if spoolDirectory:
+    spool = Spool(spoolDirectory, spoolMaxBytes, maxAge=spoolMaxAge)
+
+# Documents are buffered and shipped through the _bulk API, unless bulk indexing is disabled
+bulkWriter = None
+if (esBulkEnabled == "True") or (esBulkEnabled == "1") or (esBulkEnabled == "Yes"):
+    bulkWriter = BulkWriter(esClient, esBulkMaxDocs, esBulkMaxBytes, esBulkMaxAge, spool,
+                            esRetries if useDocumentIds else 0, esRetryBackoff)
+
+# The engine collecting from the targets of WILDFLY_TARGETS_FILE, when there is one
+collectionEngine = None
 
 # Initiate a dictionary for holding the names of the beans that we will monitor	
 beanMonitors = dict()
 
+# The bean documents of the current cycle, when the documents are laid out pr. cycle
+cycleBeanDocuments = list()
+
+# The engines poll bean by bean, the subsystem collection mode reads all beans in one request each cycle
+if wildflyCollectionMode == "subsystem" and wildflyCollectionEngine != "sequential":
+    logger.warning("The {0} collection engine polls bean by bean, it is not used in the subsystem collection mode"
+                   .format(wildflyCollectionEngine))
+    wildflyCollectionEngine = "sequential"
+
+if streamResponses and wildflyCollectionMode != "subsystem" and not wildflyTargetsFile:
+    logger.warning("Only the reads of the ejb3 subsystem are streamed, there are none in the {0} collection mode"
+                   .format(wildflyCollectionMode))
+
+# Holds the state of all beans and methods instead of the bean monitors, when the state store is columnar
+stateStore = None
+if wildflyCollectionMode == "subsystem" and wildflyStateStore == "columnar":
+    if exportPrometheus:
+        logger.warning("The columnar state store does not keep bean monitors to export, using the monitors")
+    else:
+        # Imported here, NumPy is only needed by the columnar state store
+        try:
+            from wildfly.statestore import ColumnarStateStore
+            stateStore = ColumnarStateStore()
+        except ImportError as importError:
+            logger.warning("The columnar state store needs NumPy, using the monitors: {0}".format(importError))
+
+# Rolls the samples of the bean monitors up into longer windows
+monitorRollups = None
+if rollupWindows:
+    if stateStore is not None:
+        logger.warning("The columnar state store does not keep bean monitors to roll up, there are no rollups")
+    else:
+        monitorRollups = MonitorRollups(rollupWindows, lambda jsondoc: dispatchRollupDocument(jsondoc), {
+            "wildfly-host-url": wildflyHostUrl,
+            "monitor-name": monitorName
+        })
+
 # Define how long the monitor should sleep, if it has some type of connection issue
 errorSleepTime = 20
 upstatusCheckSleepTime = 10
 
-# Set up global request counters
+# Set up global request counters, they are incremented from worker threads as well
 wildflyRequestCounter = 0
 esRequestCounter = 0
+requestCounterLock = threading.Lock()
+
+# Shared by all threads polling beans, replaces a fixed nap between each bean
+wildflyRateLimiter = RateLimiter(wildflyMaxRequestsPerSecond)
+
+# Decides which of the beans to poll in each cycle
+pollSchedule = AdaptivePollSchedule(wildflyIdleMaxSkipCycles)
+
+# Starts the collection cycles of the single wildfly host at a fixed rate
+cycleScheduler = CycleScheduler(wildflyCollectionInterval, wildflyCycleOverrunPolicy)
+
+# The metrics of the reporter itself, and the time of each document indexed without the bulk writer
+selfMetrics = SelfMetrics(metricsLivenessTimeout)
+esIndexLatencyHistogram = Histogram()
+
+# Renders the bean and method monitors for the /metrics endpoint, when exporting to prometheus
+monitorExporter = None
+if exportPrometheus:
+    monitorExporter = MonitorExporter()
+    selfMetrics.addExposition(lambda: monitorExporter.text)
+
+
+def countWildflyRequest():
+    global wildflyRequestCounter
+
+    with requestCounterLock:
+        wildflyRequestCounter += 1
 
 
-# Set up method to handle exit signal
+def countEsRequest():
+    global esRequestCounter
+
+    with requestCounterLock:
+        esRequestCounter += 1
+
+
+def getEsRequestCount():
+    # The documents shipped one at a time are counted here, the bulk requests by the bulk writer
+    if bulkWriter is not None:
+        return esRequestCounter + bulkWriter.requestCount
+
+    return esRequestCounter
+
+
+# Set up method to handle exit signal. The exit unwinds the collection loop, and the shutdown is done once, in its
+# finally block
 def sigint_handler(signal, frame):
     logger.info("Received SIGINT, exiting...")
     sys.exit(0)
@@ -104,52 +343,70 @@ def sigint_handler(signal, frame):
 
 def sigterm_handler(signal, frame):
     logger.info("Received SIGTERM, exiting...")
+    sys.exit(0)
+
+
+def stopCollectionEngine():
+    if collectionEngine is not None:
+        collectionEngine.stop()
+
+
+def disableStatisticsOnExit():
     if (wildflyDisableStatsTrackingOnExit == "True") or (wildflyDisableStatsTrackingOnExit == "1") or (
             wildflyDisableStatsTrackingOnExit == "Yes"):
-        disableWildflyEjb3Statistics()
-    logRequestStatistics()
-    logger.info("Uptime was {0}".format(getUptime()))
-    sys.exit(0)
+        if collectionEngine is not None:
+            for target in collectionEngine.targets:
+                target.disableStatistics()
+        else:
+            disableWildflyEjb3Statistics()
 
 
-class MethodMonitor(Monitor):
-    def __init__(self, beanMonitor, methodName):
-        super(MethodMonitor, self).__init__(methodName)
-        self._beanMonitor = beanMonitor
+def startDispatch():
+    for sink in sinks:
+        sink.start()
 
-    @property
-    def beanMonitor(self):
-        return self._beanMonitor
+    if spoolReplayer is not None:
+        spoolReplayer.start()
 
+    if shipToElasticsearch:
+        indexManager.start()
 
-# BeanMonitor is the class that we will use for holding information about a bean
-# that we are monitoring.
-class BeanMonitor(Monitor):
-    def __init__(self, beanName):
-        super(BeanMonitor, self).__init__(beanName)
-        self._methods = dict()
+    if dispatchQueue is not None:
+        # The queue worker drives the bulk writer, so it does not need a thread of its own
+        dispatchQueue.start()
+    elif bulkWriter is not None:
+        bulkWriter.start()
 
-    @property
-    def methods(self):
-        return self._methods
 
-    def updateStats(self, responseJson, sampleTime):
-        super(BeanMonitor, self).updateStats(responseJson, sampleTime)
+def closeDispatch():
+    # The windows still open are rolled up as they are, then everything queued and buffered is shipped before exiting
+    if monitorRollups is not None:
+        monitorRollups.close()
 
-        if "methods" not in responseJson:
-            # No methods have been invoked for the bean in question
-            pass
-        else:
-            for methodName, methodStats in responseJson["methods"].items():
-                if methodName not in self.methods:
-                    self.methods[methodName] = MethodMonitor(self, methodName)
+    if collectionEngine is not None:
+        for target in collectionEngine.targets:
+            if target.rollups is not None:
+                target.rollups.close()
 
-                self.methods[methodName].updateStats(methodStats, sampleTime)
+    for sink in sinks:
+        sink.close()
 
+    if dispatchQueue is not None:
+        dispatchQueue.close()
 
-def updateBeanNames(beanMonitors):
-    global wildflyRequestCounter
+    if bulkWriter is not None:
+        bulkWriter.close()
+
+    if spoolReplayer is not None:
+        spoolReplayer.stop()
+
+    indexManager.stop()
 
+    if spool is not None:
+        spool.close()
+
+
+def updateBeanNames(beanMonitors):
     url = (wildflyDeploymentUrl +
            "/subsystem/ejb3/stateless-session-bean/")
 
@@ -157,12 +414,12 @@ def updateBeanNames(beanMonitors):
 
     try:
         logger.debug("Requesting all beans from {0}".format(url))
-        response = requests.get(url, auth=HTTPDigestAuth(wildflyUser, wildflyPassword))
+        response = wildflySession.get(url)
         logger.debug("Received response from {0}: {1}".format(url, response))
 
-        wildflyRequestCounter += 1
+        countWildflyRequest()
 
-        responseJson = response.json()
+        responseJson = decodeResponse(response)
         logger.debug("Response json: {0}".format(responseJson))
         beanNames = responseJson['stateless-session-bean'].keys()
 
@@ -173,112 +430,522 @@ def updateBeanNames(beanMonitors):
                 beanMonitors[key] = BeanMonitor(key)
 
     except ConnectionError as conError:
-        logger.error("A ConnectionError occurred when connecting to the host {0}".format(wildflyHostUrl), conError)
+        selfMetrics.countError("updateBeanNames")
+        logger.error("A ConnectionError occurred when connecting to the host {0}: {1}".format(wildflyHostUrl, conError))
         logger.info("Sleeping {0}...".format(errorSleepTime))
         time.sleep(errorSleepTime)
     except Exception as exception:
-        logger.error("An error occurred when retrieving the beans to monitor from the host {0}".format(wildflyHostUrl),
-                     exception)
+        selfMetrics.countError("updateBeanNames")
+        logger.error("An error occurred when retrieving the beans to monitor from the host {0}: {1}".format(
+            wildflyHostUrl, exception))
         logger.info("Sleeping {0}...".format(errorSleepTime))
         time.sleep(errorSleepTime)
 
 
-def updateBeanStatistics(beanMonitor):
-    global wildflyRequestCounter
+def getBeanStatisticsUrl(beanName):
+    return (wildflyDeploymentUrl +
+            "/subsystem/ejb3/stateless-session-bean/{0}/read-resource?include-runtime=true&recursive=true"
+            .format(beanName))
+
 
+def updateBeanStatistics(beanMonitor):
     logger.debug("Getting statistics for the bean {0}".format(beanMonitor.name))
-    url = (wildflyDeploymentUrl +
-           "/subsystem/ejb3/stateless-session-bean/{0}/read-resource?include-runtime=true&recursive=true"
-           .format(beanMonitor.name))
+    url = getBeanStatisticsUrl(beanMonitor.name)
 
     try:
         logger.debug("Requesting bean statistics from {0}".format(url))
-        response = requests.get(url, auth=HTTPDigestAuth(wildflyUser, wildflyPassword))
+        response = wildflySession.get(url)
         sampleTime = datetime.utcnow()
         logger.debug("Received response from {0}: {1}".format(url, response))
 
-        wildflyRequestCounter += 1
+        countWildflyRequest()
 
-        responseJson = response.json()
+        responseJson = decodeResponse(response)
         logger.debug("Response json: {0}".format(responseJson))
 
         beanMonitor.updateStats(responseJson, sampleTime)
 
 
     except ConnectionError as conError:
+        selfMetrics.countError("updateBeanStatistics")
+        logger.error(
+            "A ConnectionError occurred when getting bean statistics for {0}, connecting to the host {1}: {2}".format(
+                beanMonitor.name, wildflyHostUrl, conError))
+        beanMonitor.reportToElasticsearch = False
+        sleepAfterBeanError()
+    except Exception as exception:
+        selfMetrics.countError("updateBeanStatistics")
         logger.error(
-            "A ConnectionError occurred when getting bean statistics for {0}, connecting to the host {1}".format(
-                beanMonitor.name, wildflyHostUrl), conError)
+            "An error occurred when retrieving bean statistics for the bean {0}, from the wildfly host {1}: {2}".format(
+                beanMonitor.name, wildflyHostUrl, exception))
+        beanMonitor.reportToElasticsearch = False
+        sleepAfterBeanError()
+
+
+def sleepAfterBeanError():
+    # A worker of the threads engine does not sleep, the cycle waits for all workers, and one failing bean would hold
+    # it up. The cycles keep to the collection interval, started by the cycle scheduler
+    if wildflyCollectionEngine == "threads":
+        return
+
+    logger.info("Sleeping {0}...".format(errorSleepTime))
+    time.sleep(errorSleepTime)
+
+
+def collectBeanStatistics(beanMonitor):
+    wildflyRateLimiter.acquire()
+
+    # Update the statistics for the bean
+    updateBeanStatistics(beanMonitor)
+    pollSchedule.update(beanMonitor)
+
+    dispatchBeanMonitorToElasticsearch(beanMonitor)
+
+
+def stopReportingAllBeans(beanMonitors):
+    # Nothing was sampled in a failed cycle, the beans reported in the cycle before should not be reported again with
+    # the same values
+    if stateStore is not None:
+        stateStore.discardCycle()
+
+    for beanMonitor in beanMonitors.values():
+        beanMonitor.reportToElasticsearch = False
+
+
+def updateAllBeanStatistics(beanMonitors):
+    logger.debug("Getting statistics for all beans in {0}".format(wildflySubDeployment))
+    url = (wildflyDeploymentUrl +
+           "/subsystem/ejb3/read-resource?include-runtime=true&recursive=true")
+
+    try:
+        logger.debug("Requesting ejb3 subsystem statistics from {0}".format(url))
+        # Streamed, the body is read as the beans are sampled, rather than before
+        response = wildflySession.get(url, stream=streamResponses)
+        # All beans share the same sample time, they are read in the same instant
+        sampleTime = datetime.utcnow()
+        logger.debug("Received response from {0}: {1}".format(url, response))
+
+        countWildflyRequest()
+
+        sampledBeanNames = set()
+
+        def sampleBean(beanName, beanJson):
+            sampledBeanNames.add(beanName)
+
+            if stateStore is not None:
+                stateStore.addBeanSample(beanName, beanJson, sampleTime)
+                return
+
+            if beanName not in beanMonitors:
+                beanMonitors[beanName] = BeanMonitor(beanName)
+
+            beanMonitors[beanName].updateStats(beanJson, sampleTime)
+
+        if streamResponses:
+            try:
+                reader = readStreamedObject(response, ("stateless-session-bean",), sampleBean)
+
+            except Exception as exception:
+                if not sampledBeanNames:
+                    raise
+
+                # The beans sampled before the response broke off have moved on to this sample, and are reported with
+                # it rather than thrown away. The rest are not reported, and are sampled again in the next cycle
+                selfMetrics.countError("updateAllBeanStatistics")
+                logger.error("The ejb3 subsystem statistics from {0} broke off after {1} beans, reporting those: {2}"
+                             .format(url, len(sampledBeanNames), exception))
+                reader = None
+
+            if reader is not None and not reader.found:
+                logger.error("Unexpected response when reading the ejb3 subsystem from {0}, was expecting the json "
+                             "key 'stateless-session-bean', but got these fields back: {1}".format(url, reader.fields))
+                stopReportingAllBeans(beanMonitors)
+                return
+        else:
+            responseJson = decodeResponse(response)
+            logger.log(TRACE, "Response json: {0}".format(responseJson))
+
+            if "stateless-session-bean" not in responseJson:
+                logger.error("Unexpected response when reading the ejb3 subsystem from {0}, was expecting the json "
+                             "key 'stateless-session-bean', but got this result back: {1}".format(url, responseJson))
+                stopReportingAllBeans(beanMonitors)
+                return
+
+            # The key is present, but null, if the subdeployment has no stateless beans
+            for beanName, beanJson in (responseJson["stateless-session-bean"] or dict()).items():
+                sampleBean(beanName, beanJson)
+
+        if stateStore is not None:
+            # Beans that have disappeared from the deployment are not sampled, and so not reported, in this cycle
+            stateStore.computeCycle()
+            return
+
+        # Beans that have disappeared from the deployment should not be reported again with their old values
+        for beanName, beanMonitor in beanMonitors.items():
+            if beanName not in sampledBeanNames:
+                beanMonitor.reportToElasticsearch = False
+
+    except ConnectionError as conError:
+        selfMetrics.countError("updateAllBeanStatistics")
+        stopReportingAllBeans(beanMonitors)
+        logger.error("A ConnectionError occurred when getting the ejb3 subsystem statistics, connecting to the host "
+                     "{0}: {1}".format(wildflyHostUrl, conError))
         logger.info("Sleeping {0}...".format(errorSleepTime))
         time.sleep(errorSleepTime)
     except Exception as exception:
-        logger.error(
-            "An error occurred when retrieving bean statistics for the bean {0}, from the wildfly host {1}".format(
-                beanMonitor.name, wildflyHostUrl), exception)
+        selfMetrics.countError("updateAllBeanStatistics")
+        stopReportingAllBeans(beanMonitors)
+        logger.error("An error occurred when retrieving the ejb3 subsystem statistics from the wildfly host {0}: {1}"
+                     .format(wildflyHostUrl, exception))
         logger.info("Sleeping {0}...".format(errorSleepTime))
         time.sleep(errorSleepTime)
 
 
+async def updateBeanStatisticsAsync(collector, beanMonitor):
+    url = getBeanStatisticsUrl(beanMonitor.name)
+
+    try:
+        responseJson, sampleTime = await collector.fetchJson(url)
+
+        countWildflyRequest()
+
+        logger.log(TRACE, "Response json: {0}".format(responseJson))
+
+        beanMonitor.updateStats(responseJson, sampleTime)
+        pollSchedule.update(beanMonitor)
+
+    except Exception as exception:
+        selfMetrics.countError("updateBeanStatisticsAsync")
+        # No sleeping here, the other beans are still being collected
+        logger.error(
+            "An error occurred when retrieving bean statistics for the bean {0}, from the wildfly host {1}: {2}".format(
+                beanMonitor.name, wildflyHostUrl, exception))
+        beanMonitor.reportToElasticsearch = False
+        return
+
+    if bulkWriter is not None or not shipToElasticsearch:
+        # Only buffers the documents, the bulk writer ships them on its own thread
+        dispatchBeanMonitorToElasticsearch(beanMonitor)
+    else:
+        # Indexing one document at a time blocks, keep it off the event loop
+        await asyncio.get_event_loop().run_in_executor(None, dispatchBeanMonitorToElasticsearch, beanMonitor)
+
+
+async def runAsyncCollection(collector):
+    global lastBeanNameUpdateTime
+
+    loop = asyncio.get_event_loop()
+
+    while True:
+        cycleScheduler.startCycle()
+
+        # Update bean names every hour, in case of a deploy with new beans
+        if (time.time() - lastBeanNameUpdateTime) > 3600:
+            await loop.run_in_executor(None, updateBeanNames, beanMonitors)
+            lastBeanNameUpdateTime = time.time()
+
+        logger.info("Running concurrent bean statistics collection and dispatch for {0} beans, {1} in flight"
+                    .format(len(beanMonitors), collector.maxInFlight))
+
+        beanStatisticsCollectionStartTime = time.time()
+
+        await asyncio.gather(*[updateBeanStatisticsAsync(collector, beanMonitor)
+                               for beanMonitor in pollSchedule.startCycle(beanMonitors.values())])
+
+        logger.info("Collected statistics for {0} beans in {1}".format(len(beanMonitors), getMinutesAndSecondsDiff(
+            beanStatisticsCollectionStartTime, time.time())))
+
+        if documentLayout == LAYOUT_CYCLE:
+            dispatchCycleDocument()
+
+        if monitorRollups is not None:
+            monitorRollups.closeDue()
+
+        if monitorExporter is not None:
+            monitorExporter.refresh()
+
+        # Report request stats every 5 minutes
+        if (time.time() - lastRequestStatsReportTime) > 300:
+            logRequestStatistics()
+
+        selfMetrics.markProgress()
+
+        # Take a nap until the next full poll cycle is due
+        await asyncio.sleep(cycleScheduler.finishCycle())
+
+
 def dispatchStatsToElasticsearch(index, jsondoc, doc_type):
-    global esRequestCounter
+    index = indexManager.indexFor(index, jsondoc)
+    docId = getDocumentId(jsondoc) if useDocumentIds else None
+
+    if dispatchQueue is not None:
+        dispatchQueue.put((index, jsondoc, doc_type, docId))
+    else:
+        shipStatsToElasticsearch(index, jsondoc, doc_type, docId)
+
+
+def flushBulkWriter():
+    if bulkWriter is not None:
+        bulkWriter.flushIfDue()
+
+
+def indexDocument(index, jsondoc, doc_type, docId):
+    # Without an id, a document is only sent once, it may have been indexed by a request that failed
+    if docId is None:
+        return esClient.index(index=index, doc_type=doc_type, body=jsondoc)
+
+    attempt = 0
+    while True:
+        try:
+            return esClient.index(index=index, doc_type=doc_type, body=jsondoc, id=docId, op_type="create")
+        except ConflictError:
+            # Already there, from an earlier attempt or an earlier run
+            return None
+        except Exception as exception:
+            if attempt >= esRetries:
+                raise
+
+            logger.warning("An error occurred when pushing a document to elasticsearch, sending it again: {0}"
+                           .format(exception))
+            time.sleep(esRetryBackoff * (2 ** attempt))
+            attempt += 1
+
+
+def shipStatsToElasticsearch(index, jsondoc, doc_type, docId=None):
+    if bulkWriter is not None:
+        bulkWriter.add(index, doc_type, jsondoc, docId)
+
+        # Without a thread of its own, the bulk writer ships on the dispatch queue worker
+        if dispatchQueue is not None:
+            bulkWriter.flushIfDue()
+        return
+
+    startTime = time.monotonic()
 
     try:
         logger.log(TRACE, "Dispatching document to elasticsearch: {0}".format(jsondoc))
-        res = esClient.index(index=index, doc_type=doc_type, body=jsondoc)
+        res = indexDocument(index, jsondoc, doc_type, docId)
+        esIndexLatencyHistogram.observe(time.monotonic() - startTime)
         logger.log(TRACE, "Received response from elasticsearch: {0}".format(res))
 
-        esRequestCounter += 1
+        countEsRequest()
 
     except ConnectionError as conError:
-        logger.error("A ConnectionError occurred when connecting to the elasticsearch host {0}".format(esHostUrl),
-                     conError)
-        logger.info("Sleeping {0}...".format(errorSleepTime))
-        time.sleep(errorSleepTime)
+        selfMetrics.countError("shipStatsToElasticsearch")
+        logger.error("A ConnectionError occurred when connecting to the elasticsearch host {0}: {1}".format(
+            esHostUrl, conError))
+        spoolDocument(index, jsondoc, doc_type, docId)
+        sleepAfterShippingError()
     except Exception as exception:
-        logger.error("An error occurred when pushing statistics to elasticsearch at {0}".format(esHostUrl), exception)
-        logger.info("Sleeping {0}...".format(errorSleepTime))
-        time.sleep(errorSleepTime)
+        selfMetrics.countError("shipStatsToElasticsearch")
+        logger.error("An error occurred when pushing statistics to elasticsearch at {0}: {1}".format(
+            esHostUrl, exception))
+        spoolDocument(index, jsondoc, doc_type, docId)
+        sleepAfterShippingError()
+
+
+def sleepAfterShippingError():
+    # Only the collection loop shipping its own documents backs off here. On the dispatch queue worker a sleep would
+    # hold up every document queued behind the failed one, and a spooled document is sent again by the replayer once
+    # elasticsearch answers its probes
+    if dispatchQueue is not None or spool is not None:
+        return
+
+    logger.info("Sleeping {0}...".format(errorSleepTime))
+    time.sleep(errorSleepTime)
+
+
+def spoolDocument(index, jsondoc, doc_type, docId=None):
+    if spool is not None:
+        if docId is None:
+            action = {"index": {"_index": index, "_type": doc_type}}
+        else:
+            action = {"create": {"_index": index, "_type": doc_type, "_id": docId}}
+
+        spool.append(dumpb(action), dumpb(jsondoc))
 
 
 def dispatchBeanStatsToElasticsearch(beanMonitor):
     logger.debug("Sending statistics for the bean {0}".format(beanMonitor.name))
 
     try:
-        beanStats = beanMonitor.getMonitorStats(prefix="bean-")
-        beanStats["bean-name"] = beanMonitor.name
-        beanStats["sample-time"] = beanMonitor.lastSampleTime.isoformat("T", "milliseconds")
-        beanStats["wildfly-host-url"] = wildflyHostUrl
-        beanStats["monitor-name"] = monitorName
+        beanStats = beanMonitor.buildDocument("bean-", {
+            "bean-name": beanMonitor.name,
+            "sample-time": beanMonitor.formattedSampleTime,
+            "wildfly-host-url": wildflyHostUrl,
+            "monitor-name": monitorName
+        })
 
-        dispatchStatsToElasticsearch(esIndex, beanStats, esDocType)
+        dispatchStats(esIndex, beanStats, esDocType)
 
     except Exception as exception:
-        logger.error("An error occurred when composing bean stats json for elasticsearch", exception)
-        logger.info("Sleeping {0}...".format(errorSleepTime))
-        time.sleep(errorSleepTime)
+        selfMetrics.countError("dispatchBeanStatsToElasticsearch")
+        # Composing a document is local, there is nothing to wait for
+        logger.error("An error occurred when composing bean stats json for elasticsearch: {0}".format(exception))
 
 
 def dispatchMethodStatsToElasticSearch(methodMonitor):
     logger.debug("Sending statistics for the method {0}".format(methodMonitor.name))
 
     try:
-        methodStats = method.getMonitorStats(prefix="method-")
-        methodStats["method-name"] = methodMonitor.name
-        methodStats["bean-name"] = methodMonitor.beanMonitor.name
-        methodStats["sample-time"] = methodMonitor.beanMonitor.lastSampleTime.isoformat("T", "milliseconds")
-        methodStats["wildfly-host-url"] = wildflyHostUrl
-        methodStats["monitor-name"] = monitorName
-
-        dispatchStatsToElasticsearch(esIndex, methodStats, esDocType)
+        methodStats = methodMonitor.buildDocument("method-", {
+            "method-name": methodMonitor.name,
+            "bean-name": methodMonitor.beanMonitor.name,
+            "sample-time": methodMonitor.beanMonitor.formattedSampleTime,
+            "wildfly-host-url": wildflyHostUrl,
+            "monitor-name": monitorName
+        })
+
+        dispatchStats(esIndex, methodStats, esDocType)
+    except Exception as exception:
+        selfMetrics.countError("dispatchMethodStatsToElasticSearch")
+        # Composing a document is local, there is nothing to wait for
+        logger.error("An error occurred when composing method stats json for elasticsearch: {0}".format(exception))
+
+
+def dispatchStats(index, jsondoc, doc_type):
+    for sink in sinks:
+        sink.write(index, doc_type, jsondoc)
+
+
+def dispatchDocument(jsondoc):
+    dispatchStats(esIndex, jsondoc, esDocType)
+
+
+def dispatchRollupDocument(jsondoc):
+    dispatchStats(rollupIndex, jsondoc, esDocType)
+
+
+def dispatchRawPayloadDocument(jsondoc):
+    # The time the payload was first stored, a payload is shared by every target and sample with the same content
+    jsondoc["sample-time"] = formatSampleTime(datetime.utcnow())
+    jsondoc["monitor-name"] = monitorName
+
+    dispatchStats(rawPayloadIndex, jsondoc, esDocType)
+
+
+def dispatchBeanMonitorToElasticsearch(beanMonitor):
+    if monitorRollups is not None:
+        monitorRollups.observeBeanMonitor(beanMonitor)
+
+    if not sinks:
+        return
+
+    if documentLayout != LAYOUT_FLAT:
+        if beanMonitor.reportToElasticsearch:
+            dispatchConsolidatedBeanStats(beanMonitor)
+        return
+
+    # Only dispatch the data if the bean stats were different
+    if beanMonitor.reportToElasticsearch:
+        # Dispatch the stats to elasticsearch for the bean
+        dispatchBeanStatsToElasticsearch(beanMonitor)
+
+        for method in beanMonitor.methods.values():
+            if method.reportToElasticsearch:
+                dispatchMethodStatsToElasticSearch(method)
+
+
+def dispatchConsolidatedBeanStats(beanMonitor):
+    logger.debug("Sending statistics for the bean {0} and its methods".format(beanMonitor.name))
+
+    try:
+        if documentLayout == LAYOUT_CYCLE:
+            # Sent with the rest of the beans of the cycle by dispatchCycleDocument()
+            cycleBeanDocuments.append(buildBeanDocument(beanMonitor, {
+                "bean-name": beanMonitor.name,
+                "sample-time": beanMonitor.formattedSampleTime
+            }))
+        else:
+            dispatchStats(esIndex, buildBeanDocument(beanMonitor, {
+                "bean-name": beanMonitor.name,
+                "sample-time": beanMonitor.formattedSampleTime,
+                "wildfly-host-url": wildflyHostUrl,
+                "monitor-name": monitorName
+            }), esDocType)
+
+    except Exception as exception:
+        selfMetrics.countError("dispatchConsolidatedBeanStats")
+        logger.error("An error occurred when composing bean stats json for elasticsearch: {0}".format(exception))
+
+
+def dispatchCycleDocument():
+    global cycleBeanDocuments
+
+    # The beans are collected on worker threads as well, they append to the list of the cycle they were collected in
+    beanDocuments = cycleBeanDocuments
+    cycleBeanDocuments = list()
+
+    if beanDocuments:
+        dispatchStats(esIndex, buildCycleDocument(beanDocuments, {
+            "wildfly-host-url": wildflyHostUrl,
+            "monitor-name": monitorName
+        }), esDocType)
+
+
+def dispatchStateStoreToElasticsearch(stateStore):
+    if documentLayout != LAYOUT_FLAT:
+        dispatchConsolidatedStateStore(stateStore)
+        return
+
+    try:
+        for beanName, methodName, sampleTime, stats in stateStore.reportedStats():
+            if methodName is not None:
+                stats["method-name"] = methodName
+            stats["bean-name"] = beanName
+            stats["sample-time"] = formatSampleTime(sampleTime)
+            stats["wildfly-host-url"] = wildflyHostUrl
+            stats["monitor-name"] = monitorName
+
+            dispatchStats(esIndex, stats, esDocType)
+
     except Exception as exception:
-        logger.error("An error occurred when composing method stats json for elasticsearch", exception)
+        selfMetrics.countError("dispatchStateStoreToElasticsearch")
+        logger.error("An error occurred when composing stats json for elasticsearch: {0}".format(exception))
         logger.info("Sleeping {0}...".format(errorSleepTime))
         time.sleep(errorSleepTime)
 
 
-def updateDeploymentUpStatus():
-    global wildflyRequestCounter
+def dispatchConsolidatedStateStore(stateStore):
+    try:
+        # A bean has its methods reported with it, a method added to the deployment later is still put with its bean
+        beanDocuments = OrderedDict()
+
+        for beanName, methodName, sampleTime, stats in stateStore.reportedStats():
+            beanDocument = beanDocuments.get(beanName)
+
+            if beanDocument is None:
+                beanDocument = beanDocuments[beanName] = {
+                    "bean-name": beanName,
+                    "sample-time": formatSampleTime(sampleTime),
+                    "methods": list()
+                }
+
+            if methodName is not None:
+                stats["method-name"] = methodName
+                beanDocument["methods"].append(stats)
+            else:
+                beanDocument.update(stats)
+
+        fields = {
+            "wildfly-host-url": wildflyHostUrl,
+            "monitor-name": monitorName
+        }
+
+        if documentLayout == LAYOUT_CYCLE:
+            if beanDocuments:
+                dispatchStats(esIndex, buildCycleDocument(list(beanDocuments.values()), fields), esDocType)
+        else:
+            for beanDocument in beanDocuments.values():
+                beanDocument.update(fields)
+                dispatchStats(esIndex, beanDocument, esDocType)
 
+    except Exception as exception:
+        selfMetrics.countError("dispatchConsolidatedStateStore")
+        logger.error("An error occurred when composing stats json for elasticsearch: {0}".format(exception))
+
+
+def updateDeploymentUpStatus():
     logger.debug("Getting server upstatus from {0}".format(wildflyDeploymentUrl))
     url = (wildflyDeploymentUrl +
            '/management/deployment/' + wildflyDeployment +
@@ -286,24 +953,26 @@ def updateDeploymentUpStatus():
 
     try:
         logger.debug("Requesting deployment upstatus from {0}".format(url))
-        response = requests.get(url, auth=HTTPDigestAuth(wildflyUser, wildflyPassword))
+        response = wildflySession.get(url)
         logger.debug("Received response from {0}: {1}".format(url, response))
 
-        wildflyRequestCounter += 1
+        countWildflyRequest()
 
-        responseJson = response.json()
+        responseJson = decodeResponse(response)
         logger.debug("Response json: {0}".format(responseJson))
 
         # TODO: Store the result somewhere before dispatching to ES
 
     except ConnectionError as conError:
-        logger.error("A ConnectionError occurred when connecting to the wildfly host {0}".format(wildflyHostUrl),
-                     conError)
+        selfMetrics.countError("updateDeploymentUpStatus")
+        logger.error("A ConnectionError occurred when connecting to the wildfly host {0}: {1}".format(
+            wildflyHostUrl, conError))
         logger.info("Sleeping {0}...".format(errorSleepTime))
         time.sleep(errorSleepTime)
     except Exception as exception:
-        logger.error("An error occurred when retrieving the beans to monitor from the host {0}".format(wildflyHostUrl),
-                     exception)
+        selfMetrics.countError("updateDeploymentUpStatus")
+        logger.error("An error occurred when retrieving the beans to monitor from the host {0}: {1}".format(
+            wildflyHostUrl, exception))
         logger.info("Sleeping {0}...".format(errorSleepTime))
         time.sleep(errorSleepTime)
 
@@ -311,17 +980,112 @@ def updateDeploymentUpStatus():
 def logRequestStatistics():
     global lastRequestStatsReportTime
 
+    esRequestCount = getEsRequestCount()
     wildflyRequestAverage = (wildflyRequestCounter / (time.time() - scriptStartTime))
-    esRequestAverage = (esRequestCounter / (time.time() - scriptStartTime))
+    esRequestAverage = (esRequestCount / (time.time() - scriptStartTime))
 
     logger.info("Request stats: Processed a total of {0} wildfly requests, average {1:.3f} pr. second"
                 .format(wildflyRequestCounter, wildflyRequestAverage))
     logger.info("Request stats: Processed a total of {0} elasticsearch requests, average {1:.3f} pr. second"
-                .format(esRequestCounter, esRequestAverage))
+                .format(esRequestCount, esRequestAverage))
+
+    if not wildflyTargetsFile:
+        cycleScheduler.logStatistics()
+
+    if wildflyCollectionMode != "subsystem" and not wildflyTargetsFile:
+        pollSchedule.logStatistics()
+
+    if dispatchQueue is not None:
+        dispatchQueue.logStatistics()
+
+    if spool is not None:
+        spool.logStatistics()
+
+    if bulkWriter is not None:
+        bulkWriter.logStatistics()
+
+    for sink in sinks:
+        sink.logStatistics()
+
+    if reportRawJson and rawPayloads.store != STORE_INLINE:
+        rawPayloads.logStatistics()
+
+    if collectionEngine is not None:
+        collectionEngine.logStatistics()
+
+    defaultConnectionPool.logStatistics()
+
+    # The elasticsearch client keeps its own pool of keep-alive connections
+    esConnectionsOpened = 0
+    for connection in esClient.transport.connection_pool.connections:
+        if hasattr(connection, "pool"):
+            esConnectionsOpened += connection.pool.num_connections
+
+    logger.info("Connection stats: elasticsearch client ({0}) opened {1} connections for {2} requests"
+                .format(esHostUrl, esConnectionsOpened, esRequestCount))
 
     lastRequestStatsReportTime = time.time()
 
 
+def runMultiTargetCollection():
+    global collectionEngine
+
+    if shipToElasticsearch:
+        waitForElasticsearchToBeUp()
+        installIndexTemplates()
+
+    startDispatch()
+
+    collectionEngine = CollectionEngine(loadTargets(wildflyTargetsFile, wildflyUser, wildflyPassword, wildflyProtocol),
+                                        dispatchDocument if sinks else None,
+                                        wildflyCollectionInterval)
+
+    if monitorExporter is not None:
+        for target in collectionEngine.targets:
+            monitorExporter.addTarget(target.alias, target.beanMonitors)
+
+    if rollupWindows:
+        for target in collectionEngine.targets:
+            target.rollups = MonitorRollups(rollupWindows, dispatchRollupDocument, {
+                "wildfly-host-url": target.wildflyHostUrl,
+                "wildfly-alias": target.alias,
+                "monitor-name": monitorName
+            })
+
+    lastCycleEndTime = None
+
+    try:
+        collectionEngine.start()
+
+        while True:
+            time.sleep(5)
+
+            # The engine makes progress as long as any of the targets completes a cycle, a target that is down still
+            # completes its cycles, failing
+            cycleEndTimes = [target.lastCycleEndTime for target in collectionEngine.targets
+                             if target.lastCycleEndTime is not None]
+            if cycleEndTimes and max(cycleEndTimes) != lastCycleEndTime:
+                lastCycleEndTime = max(cycleEndTimes)
+                selfMetrics.markProgress()
+
+                # Only the monitors of the targets that took a new sample are rendered again
+                if monitorExporter is not None:
+                    monitorExporter.refresh()
+
+            # Report request stats every 5 minutes
+            if (time.time() - lastRequestStatsReportTime) > 300:
+                logRequestStatistics()
+
+    except Exception as exception:
+        logger.error("Exception while running the collection engine, exiting: {0}".format(exception))
+    finally:
+        stopCollectionEngine()
+        disableStatisticsOnExit()
+        closeDispatch()
+        logRequestStatistics()
+        logger.info("Uptime was {0}".format(getUptime()))
+
+
 def getMinutesAndSecondsDiff(startTime, endTime):
     minutes = divmod(endTime - startTime, 60)
     seconds = divmod(minutes[1], 1)
@@ -355,7 +1119,7 @@ def waitForWildflyToBeUp():
 
             logger.debug("Requesting status from {0}".format(url))
 
-            response = requests.get(url, auth=HTTPDigestAuth(wildflyUser, wildflyPassword))
+            response = wildflySession.get(url)
 
             if response.status_code == requests.codes.ok:
                 wildflyUp = True
@@ -365,58 +1129,69 @@ def waitForWildflyToBeUp():
                 logger.warning(
                     "Was not able to reach the wildfly instance at {0}, napping for {1} seconds...".format(
                         url, upstatusCheckSleepTime))
+                selfMetrics.markProgress()
                 time.sleep(upstatusCheckSleepTime)
 
         except Exception as exception:
             logger.warning("Was not able to reach the wildfly instance at {0}, napping for {1} seconds...".format(
                 url, upstatusCheckSleepTime))
+            selfMetrics.markProgress()
             time.sleep(upstatusCheckSleepTime)
             pass
 
 
-def waitForElasticsearchToBeUp():
-    elasticsearchUp = False
-
+def isElasticsearchUp():
     url = (esHostUrl + "/?pretty")
 
+    try:
+        logger.debug("Requesting status from {0}".format(url))
+        response = esSession.get(url, timeout=upstatusCheckSleepTime)
+
+        return response.status_code == requests.codes.ok
+
+    except Exception as exception:
+        return False
+
+
+def waitForElasticsearchToBeUp():
     logger.info("Waiting for elasticseach instance at {0} to be available".format(esHostUrl))
 
-    while not elasticsearchUp:
-        try:
-            logger.debug("Requesting status from {0}".format(url))
-            response = requests.get(url)
+    while not isElasticsearchUp():
+        logger.warning("Was not able to reach the elasticsearch instance at {0}, napping for {1} seconds..."
+                       .format(esHostUrl, upstatusCheckSleepTime))
+        selfMetrics.markProgress()
+        time.sleep(upstatusCheckSleepTime)
 
-            if response.status_code == requests.codes.ok:
-                elasticsearchUp = True
-                logger.info("Elasticsearch instance at is ready".format(esHostUrl))
+    logger.info("Elasticsearch instance at {0} is ready".format(esHostUrl))
 
-            if not elasticsearchUp:
-                logger.warning(
-                    "Was not able to reach the elasticsearch instance at {0}, napping for {1} seconds...".format(
-                        esHostUrl, upstatusCheckSleepTime))
-                time.sleep(upstatusCheckSleepTime)
 
-        except Exception as exception:
-            logger.warning("Was not able to reach the elasticsearch instance at {0}, napping for {1} seconds..."
-                           .format(esHostUrl, upstatusCheckSleepTime))
-            time.sleep(upstatusCheckSleepTime)
-            pass
+def installIndexTemplates():
+    if esIndexTemplate not in ("True", "1", "Yes"):
+        return
 
+    indicesInTheWay = indexManager.findIndicesInTheWay()
+    if indicesInTheWay:
+        logger.error("The indices {0} exist, and are in the way of the aliases the {1} rotated indices are read "
+                     "through. Move them aside as described for ES_INDEX_ROTATION, or set ES_INDEX_ROTATION to none, "
+                     "exiting!".format(", ".join(indicesInTheWay), esIndexRotation))
+        sys.exit(1)
+
+    if not indexManager.installTemplates():
+        selfMetrics.countError("installIndexTemplates")
 
-def checkWildflyEjb3StatisticsEnabled():
-    global wildflyRequestCounter
 
+def checkWildflyEjb3StatisticsEnabled():
     url = (wildflyHostUrl +
            "/management/subsystem/ejb3")
 
     try:
         logger.debug("Requesting ejb3 subsystem properties from {0}".format(url))
-        response = requests.get(url, auth=HTTPDigestAuth(wildflyUser, wildflyPassword))
+        response = wildflySession.get(url)
         logger.debug("Received response from {0}: {1}".format(url, response))
 
-        wildflyRequestCounter += 1
+        countWildflyRequest()
 
-        responseJson = response.json()
+        responseJson = decodeResponse(response)
         logger.debug("Response json: {0}".format(responseJson))
 
         if 'enable-statistics' not in responseJson:
@@ -441,15 +1216,14 @@ def checkWildflyEjb3StatisticsEnabled():
             return False
 
     except Exception as exception:
+        selfMetrics.countError("checkWildflyEjb3StatisticsEnabled")
         logger.error(
             "An error occurred while requesting the ejb3 subsystem attributes at {0}, unable to determine if ejb3 "
-            "statistics are enabled".format(url), exception)
+            "statistics are enabled: {1}".format(url, exception))
         return False
 
 
 def enableWildflyEjb3Statistics():
-    global wildflyRequestCounter
-
     url = (wildflyHostUrl +
            "/management")
 
@@ -457,20 +1231,19 @@ def enableWildflyEjb3Statistics():
         "operation": "write-attribute",
         "name": "enable-statistics",
         "value": "true",
-        "address": ["subsystem", "ejb3"],
-        "json.pretty": 1
+        "address": ["subsystem", "ejb3"]
     }
 
     try:
         logger.debug("Attempting to enable the statistics logging for the ejb3 subsystem of the wildfly host, with "
                      "url {0} and HTTP post body {1}".format(url, body))
-        response = requests.post(url, json=body, auth=HTTPDigestAuth(wildflyUser, wildflyPassword))
+        response = wildflySession.post(url, json=body)
         logger.debug("Received response from {0}: {1}".format(url, response))
-        wildflyRequestCounter += 1
+        countWildflyRequest()
 
         if response.status_code == requests.codes.ok:
 
-            responseJson = response.json()
+            responseJson = decodeResponse(response)
             logger.debug("Response json: {0}".format(responseJson))
 
             if "outcome" not in responseJson:
@@ -495,14 +1268,13 @@ def enableWildflyEjb3Statistics():
             return False
 
     except Exception as exception:
+        selfMetrics.countError("enableWildflyEjb3Statistics")
         logger.error("An exception occurred when attempting to enable the ejb3 subsystem statistics logging for the "
-                     "wildfly host, with the url {0} and HTTP post body {1}".format(url, body), exception)
+                     "wildfly host, with the url {0} and HTTP post body {1}: {2}".format(url, body, exception))
         return False
 
 
 def disableWildflyEjb3Statistics():
-    global wildflyRequestCounter
-
     url = (wildflyHostUrl +
            "/management")
 
@@ -510,8 +1282,7 @@ def disableWildflyEjb3Statistics():
         "operation": "write-attribute",
         "name": "enable-statistics",
         "value": "false",
-        "address": ["subsystem", "ejb3"],
-        "json.pretty": 1
+        "address": ["subsystem", "ejb3"]
     }
 
     try:
@@ -519,12 +1290,12 @@ def disableWildflyEjb3Statistics():
 
         logger.debug("Attempting to disnable the statistics logging for the ejb3 subsystem of the wildfly host, with "
                      "url {0} and HTTP post body {1}".format(url, body))
-        response = requests.post(url, json=body, auth=HTTPDigestAuth(wildflyUser, wildflyPassword))
-        wildflyRequestCounter += 1
+        response = wildflySession.post(url, json=body)
+        countWildflyRequest()
 
         if response.status_code == requests.codes.ok:
 
-            responseJson = response.json()
+            responseJson = decodeResponse(response)
             logger.debug("Response json: {0}".format(responseJson))
 
             if "outcome" not in responseJson:
@@ -549,23 +1320,159 @@ def disableWildflyEjb3Statistics():
             return False
 
     except Exception as exception:
+        selfMetrics.countError("disableWildflyEjb3Statistics")
         logger.error("An exception occurred when attempting to disable the ejb3 subsystem statistics logging for the "
-                     "wildfly host, with the url {0} and HTTP post body {1}".format(url, body), exception)
+                     "wildfly host, with the url {0} and HTTP post body {1}: {2}".format(url, body, exception))
         return False
 
 
+# Spooled documents are replayed through the bulk API, whether or not the live documents are
+spoolReplayer = None
+if spool is not None:
+    spoolReplayer = SpoolReplayer(spool, (bulkWriter or BulkWriter(esClient)).sendLines, isElasticsearchUp,
+                                  spoolReplayRate, probeInterval=upstatusCheckSleepTime)
+
+# Collection only puts documents on the queue, so an elasticsearch outage can not stall the polling of wildfly
+dispatchQueue = None
+if dispatchQueueSize > 0:
+    dispatchQueue = DispatchQueue(shipStatsToElasticsearch, dispatchQueueSize, dispatchQueueOverflow,
+                                  idleCallback=flushBulkWriter)
+
+# Every document dispatched is written to each of the sinks
+sinks = list()
+for sinkName in sinkNames:
+    sinkBatching = {"maxBatch": sinkMaxBatch, "maxAge": sinkMaxAge, "maxQueued": sinkMaxQueued}
+
+    if sinkName == "elasticsearch":
+        sinks.append(ElasticsearchSink(dispatchStatsToElasticsearch))
+    elif sinkName == "ndjson":
+        sinks.append(NdjsonFileSink(ndjsonDirectory, monitorName, ndjsonMaxBytes, ndjsonRotateInterval,
+                                    ndjsonMaxFiles, ndjsonCompress in ("True", "1", "Yes"), **sinkBatching))
+    elif sinkName == "stdout":
+        sinks.append(StdoutSink(**sinkBatching))
+    elif sinkName == "statsd":
+        sinks.append(StatsdSink(statsdHost, statsdPort, statsdPrefix, **sinkBatching))
+    else:
+        logger.error("Unknown sink {0}, it is ignored".format(sinkName))
+
+
+def collectReporterMetrics(metrics):
+    if not wildflyTargetsFile:
+        metrics.counter("cycles", "Collection cycles started", cycleScheduler.cycleCounter)
+        metrics.counter("cycle_overruns", "Collection cycles overrunning the collection interval",
+                        cycleScheduler.overrunCounter)
+        metrics.counter("cycles_missed", "Collection cycles skipped or coalesced after an overrun",
+                        cycleScheduler.missedCycleCounter)
+        metrics.histogram("cycle_duration_seconds", "Duration of the collection cycles",
+                          cycleScheduler.durationHistogram)
+        metrics.histogram("cycle_start_jitter_seconds", "Delay of the start of the collection cycles",
+                          cycleScheduler.jitterHistogram)
+
+    if collectionEngine is not None:
+        for target in collectionEngine.targets:
+            labels = (("target", target.alias),)
+            metrics.counter("target_cycles", "Collection cycles of a target", target.cycleCounter, labels)
+            metrics.counter("target_cycle_errors", "Failed collection cycles of a target", target.errorCounter,
+                            labels)
+            metrics.counter("target_documents", "Documents produced from a target", target.documentCounter, labels)
+            metrics.histogram("target_cycle_duration_seconds", "Duration of the collection cycles of a target",
+                              target.cycleDurationHistogram, labels)
+
+    for session in defaultConnectionPool.sessions.values():
+        labels = (("target", session.name), ("url", session.baseUrl))
+        metrics.histogram("http_request_duration_seconds", "Duration of the HTTP requests to a target",
+                          session.latencyHistogram, labels)
+        metrics.counter("http_request_errors", "HTTP requests to a target failing without a response",
+                        session.errorCount, labels)
+        metrics.counter("http_digest_challenges", "Digest challenges answered for a target", session.challengeCount,
+                        labels)
+
+    if bulkWriter is not None:
+        metrics.histogram("elasticsearch_request_duration_seconds", "Duration of the requests to elasticsearch",
+                          bulkWriter.latencyHistogram, (("url", esHostUrl), ("api", "bulk")))
+        metrics.counter("documents_shipped", "Documents delivered to elasticsearch", bulkWriter.documentsShipped)
+        metrics.counter("documents_failed", "Documents elasticsearch failed or rejected", bulkWriter.documentsFailed)
+        metrics.counter("documents_duplicate", "Documents elasticsearch already had, counted as shipped",
+                        bulkWriter.documentsDuplicate)
+        metrics.counter("elasticsearch_retries", "Bulk requests sent again after a failure or rejection",
+                        bulkWriter.retryCount)
+        metrics.gauge("bulk_buffered_documents", "Documents buffered for the next bulk request",
+                      bulkWriter.bufferedDocuments)
+    else:
+        metrics.histogram("elasticsearch_request_duration_seconds", "Duration of the requests to elasticsearch",
+                          esIndexLatencyHistogram, (("url", esHostUrl), ("api", "index")))
+        metrics.counter("documents_shipped", "Documents delivered to elasticsearch", esRequestCounter)
+
+    if dispatchQueue is not None:
+        metrics.counter("documents_produced", "Documents produced by the collection", dispatchQueue.enqueuedCounter)
+        metrics.counter("documents_dropped", "Documents dropped from a full dispatch queue",
+                        dispatchQueue.droppedCounter)
+        metrics.gauge("dispatch_queue_depth", "Documents waiting in the dispatch queue", dispatchQueue.depth)
+        metrics.gauge("dispatch_queue_max_depth", "The deepest the dispatch queue has been", dispatchQueue.maxDepth)
+
+    if monitorRollups is not None:
+        metrics.counter("rollup_documents", "Rollup documents of the windows that ended", monitorRollups.documentCounter)
+
+    if reportRawJson and rawPayloads.store != STORE_INLINE:
+        labels = (("store", rawPayloads.store),)
+        metrics.counter("raw_payload_references", "Raw payloads referenced by hash from the documents",
+                        rawPayloads.referenceCounter, labels)
+        metrics.counter("raw_payloads_stored", "Raw payloads stored, once for each distinct content",
+                        rawPayloads.storedCounter, labels)
+
+    for sink in sinks:
+        labels = (("sink", sink.name),)
+        metrics.counter("sink_documents_written", "Documents written by a sink", sink.writtenCounter, labels)
+        metrics.counter("sink_documents_dropped", "Documents a sink dropped, when full or failing",
+                        sink.droppedCounter, labels)
+        metrics.counter("sink_errors", "Failed writes of a sink", sink.errorCounter, labels)
+
+    if spool is not None:
+        metrics.counter("documents_spooled", "Documents spooled to disk for later delivery", spool.spooledCounter)
+        metrics.counter("documents_replayed", "Spooled documents delivered", spool.replayedCounter)
+
+
+selfMetrics.addCollector(collectReporterMetrics)
+
+selfMetricsServer = None
+if metricsPort > 0:
+    selfMetricsServer = SelfMetricsServer(selfMetrics, metricsHost, metricsPort)
+
+if monitorExporter is not None:
+    monitorExporter.addTarget(wildflyHost, beanMonitors)
+
 # Start the main script here
-logger.info("Starting monitoring of {0}".format(wildflyHostUrl))
-logger.info("Shipping statistics to {0}".format(esHostUrl))
+logger.info("Starting monitoring of {0}".format(wildflyTargetsFile or wildflyHostUrl))
+if shipToElasticsearch:
+    logger.info("Shipping statistics to {0}".format(esHostUrl))
+if sinkNames:
+    logger.info("Writing statistics to the sinks {0}".format(", ".join(sinkNames)))
+if exportPrometheus:
+    logger.info("Exporting statistics on port {0}".format(metricsPort))
+logger.info("Reading and writing json with the {0} codec".format(codecName))
+if streamResponses and (wildflyCollectionMode == "subsystem" or wildflyTargetsFile):
+    logger.info("Parsing the ejb3 subsystem responses as they are streamed, a bean at a time")
 
 if __name__ == "__main__":
     # Hook up the exit signal handlers for SIGTERM and SIGINT
     signal.signal(signal.SIGTERM, sigterm_handler)
     signal.signal(signal.SIGINT, sigint_handler)
 
+    if selfMetricsServer is not None:
+        selfMetricsServer.start()
+
+    if wildflyTargetsFile:
+        # Collect from all the targets of the file, the single wildfly host configuration is not used
+        runMultiTargetCollection()
+        sys.exit(0)
+
     # Need to check that the wildfly instance and elasticsearch instances are available
     waitForWildflyToBeUp()
-    waitForElasticsearchToBeUp()
+    if shipToElasticsearch:
+        waitForElasticsearchToBeUp()
+        installIndexTemplates()
+
+    startDispatch()
 
     logger.info("Checking if the statistics logging for the ejb3 subsystem of the wildfly host "
                 "is enabled".format(wildflyHostUrl))
@@ -582,49 +1489,71 @@ if __name__ == "__main__":
         logger.info("Statistics logging for the ejb3 subsystem is enabled, continuing")
 
     try:
-        while True:
-
-            # Update bean names every hour, in case of a deploy with new beans
-            if (time.time() - lastBeanNameUpdateTime) > 3600:
-                updateBeanNames(beanMonitors)
-                lastBeanNameUpdateTime = time.time()
-
-            logger.info("Running bean statistics collection and dispatch for {0} beans".format(len(beanMonitors)))
-
-            beanStatisticsCollectionStartTime = time.time()
+        if wildflyCollectionEngine == "asyncio":
+            asyncCollector = AsyncCollector(wildflySession, wildflyMaxInFlight)
+            asyncio.get_event_loop().run_until_complete(runAsyncCollection(asyncCollector))
+        else:
+            beanPollExecutor = None
+            if wildflyCollectionEngine == "threads":
+                beanPollExecutor = ThreadPoolExecutor(max_workers=wildflyWorkerThreads)
+
+            while True:
+                cycleScheduler.startCycle()
+
+                # Update bean names every hour, in case of a deploy with new beans
+                if (time.time() - lastBeanNameUpdateTime) > 3600:
+                    updateBeanNames(beanMonitors)
+                    lastBeanNameUpdateTime = time.time()
+
+                logger.info("Running bean statistics collection and dispatch for {0} beans".format(len(beanMonitors)))
+
+                beanStatisticsCollectionStartTime = time.time()
+
+                if wildflyCollectionMode == "subsystem":
+                    # Pull the stats of all beans in one request
+                    updateAllBeanStatistics(beanMonitors)
+
+                    if stateStore is not None:
+                        dispatchStateStoreToElasticsearch(stateStore)
+                    else:
+                        for beanMonitor in beanMonitors.values():
+                            dispatchBeanMonitorToElasticsearch(beanMonitor)
+                elif beanPollExecutor is not None:
+                    # Each bean is handed to exactly one worker per cycle, and the cycle waits for all of them, so a
+                    # bean monitor is never updated by two workers at once
+                    for result in beanPollExecutor.map(collectBeanStatistics,
+                                                       pollSchedule.startCycle(beanMonitors.values())):
+                        pass
+                else:
+                    # Pull the bean status some stats
+                    for beanMonitor in pollSchedule.startCycle(beanMonitors.values()):
+                        collectBeanStatistics(beanMonitor)
 
-            # Pull the bean status some stats
-            for beanMonitor in beanMonitors.values():
-                # Update the statistics for the bean
-                updateBeanStatistics(beanMonitor)
+                logger.info("Collected statistics for {0} beans in {1}".format(
+                    len(beanMonitors), getMinutesAndSecondsDiff(beanStatisticsCollectionStartTime, time.time())))
 
-                # Only dispatch the data if the bean stats were different
-                if beanMonitor.reportToElasticsearch:
-                    # Dispatch the stats to elasticsearch for the bean
-                    dispatchBeanStatsToElasticsearch(beanMonitor)
+                if documentLayout == LAYOUT_CYCLE:
+                    dispatchCycleDocument()
 
-                    for method in beanMonitor.methods.values():
-                        if method.reportToElasticsearch:
-                            dispatchMethodStatsToElasticSearch(method)
+                if monitorRollups is not None:
+                    monitorRollups.closeDue()
 
-                # Take a powernap, before doing the next bean poll
-                time.sleep(0.1)
+                if monitorExporter is not None:
+                    monitorExporter.refresh()
 
-            logger.info("Collected statistics for {0} beans in {1}".format(len(beanMonitors), getMinutesAndSecondsDiff(
-                beanStatisticsCollectionStartTime, time.time())))
+                # Report request stats every 5 minutes
+                if (time.time() - lastRequestStatsReportTime) > 300:
+                    logRequestStatistics()
 
-            # Report request stats every 5 minutes
-            if (time.time() - lastRequestStatsReportTime) > 300:
-                logRequestStatistics()
+                selfMetrics.markProgress()
 
-            # Take a nap before doing the next full poll cycle
-            time.sleep(5)
+                # Take a nap until the next full poll cycle is due
+                time.sleep(cycleScheduler.finishCycle())
 
     except Exception as exception:
-        logger.error("Exception in the main loop, exiting...", exception)
+        logger.error("Exception in the main loop, exiting: {0}".format(exception))
     finally:
-        if (wildflyDisableStatsTrackingOnExit == "True") or (wildflyDisableStatsTrackingOnExit == "1") or (
-                wildflyDisableStatsTrackingOnExit == "Yes"):
-            disableWildflyEjb3Statistics()
+        disableStatisticsOnExit()
+        closeDispatch()
         logRequestStatistics()
         logger.info("Uptime was {0}".format(getUptime()))
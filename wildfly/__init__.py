@@ -1,16 +1,30 @@
 import os
+import time
 import logging
+import threading
 import requests
-from requests.auth import HTTPDigestAuth
+from datetime import datetime
+
+from histogram import Histogram
+from jsoncodec import decodeResponse
+
+from .connection import defaultConnectionPool
+from .operation import ManagementOperation
+from .monitor import BeanMonitor
+from .stream import readStreamedObject, streamResponses
+from .layout import documentLayout, buildBeanDocument, buildCycleDocument, LAYOUT_BEAN, LAYOUT_CYCLE
 
 
 monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
 logPath = "wildfly"
 logger = logging.getLogger(monitorName + "." + logPath)
 
+TRACE = 5
+
 
 class Wildfly(object):
-    def __init__(self, host, port, deployment, sub_deployment, user, password, alias="wildfly", protocol="http"):
+    def __init__(self, host, port, deployment, sub_deployment, user, password, alias="wildfly", protocol="http",
+                 connection_pool=defaultConnectionPool, request_timeout=30):
         self._host = host
         self._port = port
         self._wildfly_deployment = deployment
@@ -19,15 +33,34 @@ class Wildfly(object):
         self._wildfly_password = password
         self._alias = alias
         self._protocol = protocol
+        self._request_timeout = request_timeout
 
         self._bean_monitors = dict()
+        self._rollups = None
         self._request_counter = 0
+        self._queued_operations = list()
+
+        self._statistics_enabled = False
+        self._last_bean_name_update_time = 0
+
+        # Throughput counters of this target, they are read from other threads than the one collecting
+        self._counter_lock = threading.Lock()
+        self._start_time = time.time()
+        self._cycle_counter = 0
+        self._error_counter = 0
+        self._document_counter = 0
+        self._last_cycle_duration = 0
+        self._last_cycle_end_time = None
+        self._cycle_duration_histogram = Histogram()
 
         # Compose the target Wildfly mangement HTTP endpoint that we are targeting
         self._wildfly_host_url = (self.protocol + "://" + self.host + ":" + self.port)
 
         self._wildfly_management_url = (self._wildfly_host_url + "/management")
 
+        self._session = connection_pool.getSession(self.alias, self.wildflyHostUrl, self.wildflyUser,
+                                                   self.wildflyPassword)
+
     @property
     def host(self):
         return self._host
@@ -68,16 +101,65 @@ class Wildfly(object):
     def wildflyManagementUrl(self):
         return self._wildfly_management_url
 
+    @property
+    def beanMonitors(self):
+        return self._bean_monitors
+
+    @property
+    def rollups(self):
+        return self._rollups
+
+    @rollups.setter
+    def rollups(self, value):
+        self._rollups = value
+
+    @property
+    def requestCounter(self):
+        return self._request_counter
+
+    @property
+    def cycleCounter(self):
+        return self._cycle_counter
+
+    @property
+    def errorCounter(self):
+        return self._error_counter
+
+    @property
+    def documentCounter(self):
+        return self._document_counter
+
+    @property
+    def lastCycleDuration(self):
+        return self._last_cycle_duration
+
+    @property
+    def lastCycleEndTime(self):
+        # On the monotonic clock, None until the first cycle has ended
+        return self._last_cycle_end_time
+
+    @property
+    def cycleDurationHistogram(self):
+        return self._cycle_duration_histogram
+
+    def _post_management_request(self, request_body, stream=False):
+        logger.debug("Posting management request to {0}: {1}".format(self.wildflyManagementUrl, request_body))
+        response = self._session.post(self.wildflyManagementUrl, json=request_body, timeout=self._request_timeout,
+                                      stream=stream)
+        with self._counter_lock:
+            self._request_counter += 1
+        logger.debug("Received response from {0}: {1}".format(self.wildflyManagementUrl, response))
+
+        return response
+
     def _perform_management_request(self, request_body):
         try:
             # TODO: TRACE log
-            response = requests.post(self.wildflyManagementUrl, json=request_body, auth=HTTPDigestAuth(self.wildflyUser, self.wildflyPassword))
-            self._request_counter += 1
-            # TODO: Debug log response
+            response = self._post_management_request(request_body)
 
             if response.status_code == requests.codes.ok:
 
-                responseJson = response.json()
+                responseJson = decodeResponse(response)
                 # TODO: Debug log responseJson
 
                 # "outcome": "failed"
@@ -106,26 +188,327 @@ class Wildfly(object):
             # TODO: Error log what happened
             return False, None
 
-    def refreshBeanNames(self):
+    def queueOperation(self, request_body, callback=None):
+        operation = ManagementOperation(request_body, callback)
+        self._queued_operations.append(operation)
+
+        return operation
 
+    def flushOperations(self):
+        operations = self._queued_operations
+        self._queued_operations = list()
+
+        if len(operations) == 0:
+            return
+
+        # A composite of a single step is only overhead
+        if len(operations) == 1:
+            request_success, response_json = self._perform_management_request(operations[0].requestBody)
+            self._complete_operation(operations[0], request_success, response_json)
+            return
+
+        # Reads failing at runtime, a bean that was undeployed in the meantime for instance, should not roll back
+        # and fail the rest of the steps
         request_body = {
+            "operation": "composite",
+            "address": [],
+            "steps": [operation.step for operation in operations],
+            "operation-headers": {
+                "rollback-on-runtime-failure": False
+            }
+        }
+
+        step_results = None
+
+        try:
+            response = self._post_management_request(request_body)
+
+            # A composite where some of the steps failed comes back as a HTTP 500, but still with a result per step
+            responseJson = decodeResponse(response)
+            logger.log(TRACE, "Response json: {0}".format(responseJson))
+
+            if responseJson.get("rolled-back", False):
+                logger.debug("Composite request of {0} steps to {1} was rolled back: {2}".format(
+                    len(operations), self.wildflyManagementUrl, responseJson.get("failure-description")))
+            elif isinstance(responseJson.get("result"), dict):
+                step_results = responseJson["result"]
+            else:
+                logger.error("Unexpected response to a composite request of {0} steps to {1}: {2}".format(
+                    len(operations), self.wildflyManagementUrl, responseJson))
+
+        except Exception as exception:
+            logger.error("An error occurred when performing a composite request of {0} steps to {1}: {2}".format(
+                len(operations), self.wildflyManagementUrl, exception))
+
+        for index, operation in enumerate(operations, start=1):
+            step_json = None
+
+            if step_results is not None:
+                step_json = step_results.get("step-{0}".format(index))
+
+            if step_json is not None and step_json.get("outcome") == "success":
+                self._complete_operation(operation, True, step_json.get("result", step_json))
+            else:
+                if step_json is not None:
+                    logger.debug("Step {0} of composite request to {1} failed: {2}".format(
+                        index, self.wildflyManagementUrl, step_json.get("failure-description")))
+                self._complete_operation(operation, False, None)
+
+    def _complete_operation(self, operation, success, result):
+        # A callback that fails should not keep the rest of the operations from completing
+        try:
+            operation.complete(success, result)
+        except Exception as exception:
+            logger.error("An error occurred in the callback of a management operation to {0}: {1}".format(
+                self.wildflyManagementUrl, exception))
+
+    def deploymentStatusOperation(self):
+        return {
+            "operation": "read-attribute",
+            "address": ["deployment", self.wildflyDeployment],
+            "name": "status"
+        }
+
+    def ejb3StatisticsEnabledOperation(self):
+        return {
+            "operation": "read-attribute",
+            "address": ["subsystem", "ejb3"],
+            "name": "enable-statistics"
+        }
+
+    def ejb3SubsystemOperation(self, include_runtime=False, recursive=False):
+        return {
             "operation": "read-resource",
             "address": [
                 "deployment", self.wildflyDeployment, "subdeployment", self.wildflySubdeployment, "subsystem", "ejb3"
             ],
-            "json.pretty": 1
+            "include-runtime": include_runtime,
+            "recursive": recursive
+        }
+
+    def writeEjb3StatisticsEnabledOperation(self, enabled):
+        return {
+            "operation": "write-attribute",
+            "address": ["subsystem", "ejb3"],
+            "name": "enable-statistics",
+            "value": enabled
         }
 
-        request_success, response_json = self._perform_management_request(request_body)
+    def _bean_names_read(self, request_success, response_json):
+        if not request_success:
+            return
+
+        self._last_bean_name_update_time = time.time()
+
+        # The key is present, but null, if the subdeployment has no stateless beans
+        for bean_name in response_json.get("stateless-session-bean") or dict():
+            if bean_name not in self._bean_monitors:
+                self._bean_monitors[bean_name] = BeanMonitor(bean_name)
+
+    def _statistics_enabled_read(self, request_success, enabled):
+        if request_success and not enabled:
+            logger.info("The ejb3 subsystem of {0} does not have statistics enabled, attempting to enable it"
+                        .format(self.alias))
+            request_success, result = self._perform_management_request(self.writeEjb3StatisticsEnabledOperation(True))
+            enabled = request_success
 
-        if request_success:
-            bean_names = response_json["stateless-session-bean"].keys()
+        self._statistics_enabled = bool(request_success and enabled)
+
+    def disableStatistics(self):
+        logger.info("Disabling the statistics logging for the ejb3 subsystem of {0}".format(self.alias))
+        request_success, result = self._perform_management_request(self.writeEjb3StatisticsEnabledOperation(False))
+        self._statistics_enabled = False
+
+        return request_success
+
+    def _sample_bean(self, bean_name, bean_json, sample_time):
+        if bean_name not in self._bean_monitors:
+            self._bean_monitors[bean_name] = BeanMonitor(bean_name)
+
+        self._bean_monitors[bean_name].updateStats(bean_json, sample_time)
+
+    def _stop_reporting_missing_beans(self, bean_names):
+        # Beans that have disappeared from the deployment should not be reported again with their old values
+        for bean_name, bean_monitor in self._bean_monitors.items():
+            if bean_name not in bean_names:
+                bean_monitor.reportToElasticsearch = False
+
+    def _sample_subsystem(self, response_json, sample_time):
+        bean_stats = response_json.get("stateless-session-bean") or dict()
+
+        for bean_name, bean_json in bean_stats.items():
+            self._sample_bean(bean_name, bean_json, sample_time)
+
+        self._stop_reporting_missing_beans(bean_stats)
+
+    def _stream_bean_statistics(self):
+        # The recursive read of the subsystem, with each bean sampled as soon as it is parsed off the response, so no
+        # more than a bean of the response is held in memory at a time. The outcome comes before the result
+        # in the response
+        bean_names = set()
+
+        try:
+            response = self._post_management_request(self.ejb3SubsystemOperation(True, True), stream=True)
+            sample_time = datetime.utcnow()
 
-            for key in bean_names:
-                if key not in self._bean_monitors.keys():
-                    self._bean_monitors[key] = BeanMonitor(key)
+            def sample_bean(bean_name, bean_json):
+                bean_names.add(bean_name)
+                self._sample_bean(bean_name, bean_json, sample_time)
 
+            reader = readStreamedObject(response, ("result", "stateless-session-bean"), sample_bean)
 
+        except Exception as exception:
+            if not bean_names:
+                logger.error("An error occurred when streaming the ejb3 subsystem statistics of {0}: {1}".format(
+                    self.alias, exception))
+                return False
+
+            # The outcome was a success, or there would be no beans. The beans sampled before the response broke off
+            # have moved on to this sample, and are reported with it rather than thrown away. The rest are not
+            # reported, and are sampled again in the next cycle
+            logger.error("The ejb3 subsystem statistics of {0} broke off after {1} beans, reporting those: {2}".format(
+                self.alias, len(bean_names), exception))
+            self._stop_reporting_missing_beans(bean_names)
+            return True
+
+        if reader.fields.get("outcome") != "success":
+            logger.debug("Reading the ejb3 subsystem of {0} failed: {1}".format(
+                self.alias, reader.fields.get("failure-description")))
+            return False
+
+        self._stop_reporting_missing_beans(bean_names)
+
+        return True
+
+    def _document_fields(self, bean_monitor):
+        return {
+            "bean-name": bean_monitor.name,
+            "sample-time": bean_monitor.formattedSampleTime,
+            "wildfly-host-url": self.wildflyHostUrl,
+            "wildfly-alias": self.alias,
+            "monitor-name": monitorName
+        }
+
+    def getDocuments(self, layout=None):
+        # The documents of the beans, and their methods, that changed on the last sample, laid out as configured
+        layout = layout or documentLayout
+
+        if layout == LAYOUT_CYCLE:
+            bean_documents = [buildBeanDocument(bean_monitor, {"bean-name": bean_monitor.name,
+                                                               "sample-time": bean_monitor.formattedSampleTime})
+                              for bean_monitor in self._bean_monitors.values() if bean_monitor.reportToElasticsearch]
+
+            if bean_documents:
+                yield buildCycleDocument(bean_documents, {
+                    "wildfly-host-url": self.wildflyHostUrl,
+                    "wildfly-alias": self.alias,
+                    "monitor-name": monitorName
+                })
+            return
+
+        for bean_monitor in self._bean_monitors.values():
+            if not bean_monitor.reportToElasticsearch:
+                continue
+
+            fields = self._document_fields(bean_monitor)
+
+            if layout == LAYOUT_BEAN:
+                yield buildBeanDocument(bean_monitor, fields)
+                continue
+
+            yield bean_monitor.buildDocument("bean-", fields)
+
+            for method_monitor in bean_monitor.methods.values():
+                if method_monitor.reportToElasticsearch:
+                    method_stats = method_monitor.buildDocument("method-", fields)
+                    method_stats["method-name"] = method_monitor.name
+
+                    yield method_stats
+
+    def collect(self, dispatcher):
+        cycle_start_time = time.time()
+        cycle_success = False
+        documents = 0
+
+        try:
+            # The reads of a cycle go to the target in one composite request. Whether the statistics are enabled is
+            # only read until they are, and the bean names every hour, in case of a deploy with new beans
+            status_operation = self.queueOperation(self.deploymentStatusOperation())
+
+            if not self._statistics_enabled:
+                self.queueOperation(self.ejb3StatisticsEnabledOperation(), self._statistics_enabled_read)
+
+            if (time.time() - self._last_bean_name_update_time) > 3600:
+                self.queueOperation(self.ejb3SubsystemOperation(), self._bean_names_read)
+
+            # A streamed read can not be a step of a composite, it is made on its own after it
+            subsystem_operation = None
+            if not streamResponses:
+                subsystem_operation = self.queueOperation(self.ejb3SubsystemOperation(True, True))
+
+            self.flushOperations()
+            # All beans share the sample time, they are read in the same instant
+            sample_time = datetime.utcnow()
+
+            if not self._statistics_enabled:
+                logger.warning("Unable to enable the ejb3 subsystem statistics of {0}, skipping".format(self.alias))
+                return False
+
+            if status_operation.success and status_operation.result != "OK":
+                logger.warning("The deployment {0} of {1} has the status {2}, skipping".format(
+                    self.wildflyDeployment, self.alias, status_operation.result))
+                return False
+
+            if subsystem_operation is None:
+                sampled = self._stream_bean_statistics()
+            elif subsystem_operation.success:
+                self._sample_subsystem(subsystem_operation.result, sample_time)
+                sampled = True
+            else:
+                sampled = False
+
+            if not sampled:
+                logger.warning("Unable to collect bean statistics from {0}".format(self.alias))
+                return False
+
+            if self._rollups is not None:
+                for bean_monitor in self._bean_monitors.values():
+                    self._rollups.observeBeanMonitor(bean_monitor)
+
+                self._rollups.closeDue()
+
+            # Without a dispatcher the monitors are only read where they are, by an exporter
+            if dispatcher is not None:
+                for jsondoc in self.getDocuments():
+                    dispatcher(jsondoc)
+                    documents += 1
+
+            cycle_success = True
+            return True
+
+        except Exception as exception:
+            logger.error("An error occurred when collecting statistics from {0}: {1}".format(self.alias, exception))
+            return False
+
+        finally:
+            with self._counter_lock:
+                self._cycle_counter += 1
+                self._document_counter += documents
+                self._last_cycle_duration = time.time() - cycle_start_time
+                self._last_cycle_end_time = time.monotonic()
+                if not cycle_success:
+                    self._error_counter += 1
+
+            self._cycle_duration_histogram.observe(self._last_cycle_duration)
+
+    def logStatistics(self):
+        uptime = time.time() - self._start_time
+
+        logger.info("Target stats: {0} ({1}) ran {2} cycles, {3} failed, last took {4:.3f} seconds. {5} wildfly "
+                    "requests, average {6:.3f} pr. second, {7} documents, average {8:.3f} pr. second"
+                    .format(self.alias, self.wildflyHostUrl, self._cycle_counter, self._error_counter,
+                            self._last_cycle_duration, self._request_counter, self._request_counter / uptime,
+                            self._document_counter, self._document_counter / uptime))
 
 
 # {
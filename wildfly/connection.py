@@ -0,0 +1,173 @@
+import os
+import time
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+
+from histogram import Histogram
+from jsoncodec import dumpb, JSON_HEADERS
+
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logPath = "connection"
+logger = logging.getLogger(monitorName + "." + logPath)
+
+# How many keep-alive connections to hold open against a single target
+connectionPoolSize = int(os.getenv("CONNECTION_POOL_SIZE", "4"))
+
+
+# The digest auth of a TargetSession, counting the 401 challenges it answers. The challenge is answered and the request
+# sent again from within the auth's own response hook, so the hooks of the session only ever see the final response.
+class CountingDigestAuth(HTTPDigestAuth):
+    def __init__(self, user, password, on_challenge):
+        super(CountingDigestAuth, self).__init__(user, password)
+        self._on_challenge = on_challenge
+
+    def handle_401(self, r, **kwargs):
+        response = super(CountingDigestAuth, self).handle_401(r, **kwargs)
+
+        # A new response means the challenge was answered and the request sent again
+        if response is not r:
+            self._on_challenge()
+
+        return response
+
+
+# A TargetSession is a keep-alive HTTP session towards a single target (a Wildfly management interface or an
+# Elasticsearch node). Connections, and with them the TLS session on https, are reused across requests. The digest
+# auth object is shared by all requests of the session, so after the first 401 challenge the nonce is reused with an
+# incremented nonce-count, and every following request authenticates without the extra round trip.
+class TargetSession(object):
+    def __init__(self, name, base_url, user=None, password=None, pool_size=connectionPoolSize):
+        self._name = name
+        self._base_url = base_url
+
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+
+        self._session = requests.Session()
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+        self._session.hooks["response"].append(self._count_response)
+
+        if user is not None:
+            self._session.auth = CountingDigestAuth(user, password, self._count_challenge)
+
+        self._lock = threading.Lock()
+        self._request_count = 0
+        self._challenge_count = 0
+        self._error_count = 0
+        # The time of each call, including any digest challenge answered on the way
+        self._latency_histogram = Histogram()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def baseUrl(self):
+        return self._base_url
+
+    @property
+    def requestCount(self):
+        return self._request_count
+
+    @property
+    def challengeCount(self):
+        return self._challenge_count
+
+    @property
+    def errorCount(self):
+        return self._error_count
+
+    @property
+    def latencyHistogram(self):
+        return self._latency_histogram
+
+    @property
+    def connectionsOpened(self):
+        opened = 0
+
+        for key in self._adapter.poolmanager.pools.keys():
+            opened += self._adapter.poolmanager.pools[key].num_connections
+
+        return opened
+
+    @property
+    def connectionsReused(self):
+        # Every digest challenge is a HTTP round trip of its own
+        return max(0, self._request_count + self._challenge_count - self.connectionsOpened)
+
+    def _count_response(self, response, *args, **kwargs):
+        # Called once pr. request, with the response to the request sent again when a digest challenge was answered
+        with self._lock:
+            self._request_count += 1
+
+    def _count_challenge(self):
+        with self._lock:
+            self._challenge_count += 1
+
+    def _request(self, method, url, **kwargs):
+        start_time = time.monotonic()
+
+        try:
+            return self._session.request(method, url, **kwargs)
+        except Exception:
+            with self._lock:
+                self._error_count += 1
+            raise
+        finally:
+            self._latency_histogram.observe(time.monotonic() - start_time)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("allow_redirects", True)
+        return self._request("GET", url, **kwargs)
+
+    def post(self, url, json=None, **kwargs):
+        # The body is serialised by the json codec rather than by requests
+        if json is not None:
+            kwargs["data"] = dumpb(json)
+            kwargs["headers"] = dict(JSON_HEADERS, **kwargs.get("headers", dict()))
+
+        return self._request("POST", url, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+    def logStatistics(self):
+        logger.info("Connection stats: {0} ({1}) made {2} requests and answered {3} digest challenges over {4} "
+                    "connections, {5} requests reused an open connection"
+                    .format(self.name, self.baseUrl, self.requestCount, self.challengeCount, self.connectionsOpened,
+                            self.connectionsReused))
+
+
+# The ConnectionPool hands out one TargetSession per target, so that every caller talking to the same target shares
+# the same connections and digest nonce.
+class ConnectionPool(object):
+    def __init__(self):
+        self._sessions = dict()
+
+    @property
+    def sessions(self):
+        return self._sessions
+
+    def getSession(self, name, base_url, user=None, password=None, pool_size=connectionPoolSize):
+        key = (base_url, user)
+
+        if key not in self._sessions:
+            logger.debug("Opening a session for {0} towards {1}".format(name, base_url))
+            self._sessions[key] = TargetSession(name, base_url, user, password, pool_size)
+
+        return self._sessions[key]
+
+    def logStatistics(self):
+        for session in self._sessions.values():
+            session.logStatistics()
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+
+
+defaultConnectionPool = ConnectionPool()
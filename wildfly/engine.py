@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import Wildfly
+
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logPath = "engine"
+logger = logging.getLogger(monitorName + "." + logPath)
+
+
+# Reads the targets to collect from a json file, on the form:
+#
+# {
+#     "targets": [
+#         {"host": "node1", "port": "9990", "deployment": "etel.ear", "subdeployment": "etel-ejb.jar", "alias": "node1"},
+#         ...
+#     ]
+# }
+#
+# Besides the keys above a target may set "protocol", "user" and "password", the credentials default to the given ones.
+def loadTargets(path, default_user, default_password, default_protocol="http"):
+    with open(path) as targets_file:
+        targets_json = json.load(targets_file)
+
+    targets = list()
+
+    for target_json in targets_json["targets"]:
+        targets.append(Wildfly(target_json["host"],
+                               str(target_json.get("port", "9990")),
+                               target_json["deployment"],
+                               target_json["subdeployment"],
+                               target_json.get("user", default_user),
+                               target_json.get("password", default_password),
+                               alias=target_json.get("alias", target_json["host"]),
+                               protocol=target_json.get("protocol", default_protocol)))
+
+    logger.info("Loaded {0} targets from {1}".format(len(targets), path))
+
+    return targets
+
+
+# The CollectionEngine collects statistics from many Wildfly targets in one process. A single scheduler thread starts a
+# collection cycle for each target every interval seconds, on a worker thread of its own. A target whose previous cycle
+# is still running is skipped until it is done, so a slow or dead node only ever delays itself.
+class CollectionEngine(object):
+    def __init__(self, targets, dispatcher, interval=5, max_workers=None):
+        self._targets = targets
+        self._dispatcher = dispatcher
+        self._interval = interval
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or max(1, len(targets)))
+        self._running = dict()
+        self._next_run_time = dict((target, 0) for target in targets)
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def targets(self):
+        return self._targets
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="collection-engine")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self):
+        logger.info("Collecting from {0} targets every {1} seconds".format(len(self._targets), self._interval))
+
+        while not self._stopped.is_set():
+            now = time.monotonic()
+
+            for target in self._targets:
+                future = self._running.get(target)
+
+                if future is not None and not future.done():
+                    continue
+
+                if now >= self._next_run_time[target]:
+                    self._next_run_time[target] = now + self._interval
+                    self._running[target] = self._executor.submit(target.collect, self._dispatcher)
+
+            next_run_time = min(self._next_run_time.values()) if self._targets else now + self._interval
+            self._stopped.wait(min(max(next_run_time - time.monotonic(), 0.1), self._interval))
+
+    def stop(self, timeout=30):
+        self._stopped.set()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+        self._executor.shutdown(wait=True)
+
+    def logStatistics(self):
+        for target in self._targets:
+            target.logStatistics()
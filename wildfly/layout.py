@@ -0,0 +1,130 @@
+import os
+import logging
+
+from .monitor import getStatKeys
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".layout")
+
+# Either "flat", a document for each bean and for each of its methods, "bean", one document for each bean with its
+# changed methods in the "methods" field, or "cycle", one document for each target and cycle with the changed beans in
+# the "beans" field, each with its changed methods
+LAYOUT_FLAT = "flat"
+LAYOUT_BEAN = "bean"
+LAYOUT_CYCLE = "cycle"
+LAYOUTS = (LAYOUT_FLAT, LAYOUT_BEAN, LAYOUT_CYCLE)
+
+documentLayout = os.getenv("DOCUMENT_LAYOUT", LAYOUT_FLAT)
+
+if documentLayout not in LAYOUTS:
+    logger.error("Unknown document layout {0}, using the {1} layout".format(documentLayout, LAYOUT_FLAT))
+    documentLayout = LAYOUT_FLAT
+
+
+def buildMethodEntries(beanMonitor):
+    # The changed methods of the bean, as nested in its document, without the fields repeated in the bean
+    entries = list()
+
+    for methodMonitor in beanMonitor.methods.values():
+        if methodMonitor.reportToElasticsearch:
+            entries.append(methodMonitor.buildDocument("method-", {"method-name": methodMonitor.name}))
+
+    return entries
+
+
+def buildBeanDocument(beanMonitor, fields):
+    # The bean, with its changed methods, in one document
+    beanDocument = beanMonitor.buildDocument("bean-", fields)
+    beanDocument["methods"] = buildMethodEntries(beanMonitor)
+
+    return beanDocument
+
+
+def buildCycleDocument(beanDocuments, fields):
+    # The beans of a cycle in one document, the beans keep their own sample time, the cycle has the latest of them
+    cycleDocument = {
+        "beans": beanDocuments,
+        "bean-count": len(beanDocuments),
+        "method-count": sum(len(beanDocument["methods"]) for beanDocument in beanDocuments)
+    }
+
+    if beanDocuments:
+        cycleDocument["sample-time"] = max(beanDocument["sample-time"] for beanDocument in beanDocuments)
+
+    cycleDocument.update(fields)
+
+    return cycleDocument
+
+
+# The sample times are either ISO 8601 strings or milliseconds since the epoch, see SAMPLE_TIME_FORMAT
+DATE_MAPPING = {"type": "date", "format": "strict_date_optional_time||epoch_millis"}
+# The raw json of a sample is only kept in the source of the document, it is never searched
+RAW_JSON_MAPPING = {"type": "text", "index": False}
+KEYWORD_MAPPING = {"type": "keyword"}
+# The raw json of a sample stored apart, see RAW_PAYLOAD_STORE, is referenced by the hash of its content
+RAW_HASH_MAPPING = KEYWORD_MAPPING
+
+# Fields without a mapping of their own, strings are keywords rather than analysed text with a keyword sub field
+DYNAMIC_TEMPLATES = [{"strings": {"match_mapping_type": "string", "mapping": KEYWORD_MAPPING}}]
+
+
+def getStatMappings(prefix):
+    # The counters and deltas are whole numbers, the rates are not, and do not need the precision of a double
+    mappings = dict()
+
+    for position, key in enumerate(getStatKeys(prefix)):
+        mappings[key] = {"type": "float" if position % 3 == 2 else "long"}
+
+    return mappings
+
+
+def getMapping(layout):
+    # The mapping of the document type of the layout, the fields added to every document are mapped for all layouts
+    properties = {
+        "sample-time": DATE_MAPPING,
+        "wildfly-host-url": KEYWORD_MAPPING,
+        "wildfly-alias": KEYWORD_MAPPING,
+        "monitor-name": KEYWORD_MAPPING,
+        "raw-json": RAW_JSON_MAPPING,
+        "raw-hash": RAW_HASH_MAPPING
+    }
+
+    beanProperties = getStatMappings("bean-")
+    beanProperties["bean-name"] = KEYWORD_MAPPING
+    beanProperties["sample-time"] = DATE_MAPPING
+
+    methodProperties = getStatMappings("method-")
+    methodProperties["method-name"] = KEYWORD_MAPPING
+    methodProperties["raw-json"] = RAW_JSON_MAPPING
+    methodProperties["raw-hash"] = RAW_HASH_MAPPING
+
+    if layout == LAYOUT_FLAT:
+        properties.update(beanProperties)
+        properties.update(methodProperties)
+    else:
+        # Nested, so a query on the name and stats of a method matches them within the same method
+        beanProperties["methods"] = {"type": "nested", "properties": methodProperties}
+        beanProperties["raw-json"] = RAW_JSON_MAPPING
+        beanProperties["raw-hash"] = RAW_HASH_MAPPING
+
+        if layout == LAYOUT_BEAN:
+            properties.update(beanProperties)
+        else:
+            properties["beans"] = {"type": "nested", "properties": beanProperties}
+            properties["bean-count"] = {"type": "integer"}
+            properties["method-count"] = {"type": "integer"}
+
+    return {"dynamic_templates": DYNAMIC_TEMPLATES, "properties": properties}
+
+
+def getRawPayloadMapping():
+    # The mapping of the raw payload documents, found by their hash
+    return {
+        "dynamic_templates": DYNAMIC_TEMPLATES,
+        "properties": {
+            "raw-hash": RAW_HASH_MAPPING,
+            "raw-json": RAW_JSON_MAPPING,
+            "sample-time": DATE_MAPPING,
+            "monitor-name": KEYWORD_MAPPING
+        }
+    }
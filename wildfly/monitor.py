@@ -1,11 +1,67 @@
 import os
-import json
 import logging
+from datetime import datetime, timedelta
+
+from .rawpayload import RawPayloads, STORES, STORE_INDEX
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
 
 reportRawJson = os.getenv("REPORT_RAW", False)
+# With REPORT_RAW set, RAW_PAYLOAD_STORE is "inline" for the raw json in every document, or "index" or "file" for the
+# raw json stored once for each distinct content, in the RAW_PAYLOAD_INDEX or as files in RAW_PAYLOAD_DIR, and
+# referenced by hash. The hashes of the latest RAW_PAYLOAD_CACHE_SIZE payloads are remembered as stored
+rawPayloadStore = os.getenv("RAW_PAYLOAD_STORE", STORE_INDEX)
+rawPayloadDirectory = os.getenv("RAW_PAYLOAD_DIR", "/var/lib/wildfly-monitor/raw")
+rawPayloadCacheSize = int(os.getenv("RAW_PAYLOAD_CACHE_SIZE", "10000"))
+
+# Either "iso", the sample times of the documents as ISO 8601 strings, or "epoch_millis", milliseconds since the epoch,
+# which elasticsearch stores without parsing
+sampleTimeFormat = os.getenv("SAMPLE_TIME_FORMAT", "iso")
+
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+# The counters of a monitor, each reported as is, since the last sample and pr. second
+STAT_NAMES = ("invocations", "execution-time", "wait-time")
+
+# The document keys of each prefix, made once instead of for every document
+statKeys = dict()
+
+if rawPayloadStore not in STORES:
+    logging.getLogger(monitorName + ".monitor").error(
+        "Unknown raw payload store {0}, using the {1} store".format(rawPayloadStore, STORE_INDEX))
+    rawPayloadStore = STORE_INDEX
+
+rawPayloads = RawPayloads(rawPayloadStore, rawPayloadDirectory, rawPayloadCacheSize, STAT_NAMES)
+
+
+def formatSampleTime(sampleTime):
+    if sampleTimeFormat == "epoch_millis":
+        return (sampleTime - EPOCH) // MILLISECOND
+
+    return sampleTime.isoformat("T", "milliseconds")
+
+
+def getStatKeys(prefix):
+    keys = statKeys.get(prefix)
+
+    if keys is None:
+        keys = tuple(prefix + statName + suffix
+                     for statName in STAT_NAMES for suffix in ("", "-since-last-sample", "-per-second"))
+        statKeys[prefix] = keys
 
+    return keys
 
+
+# A Monitor holds the counters of a bean or method from the last sample, and the deltas and rates calculated from the
+# sample before it. There is a monitor for every bean and method of a deployment, so the instances are slotted, and
+# updateStats() works on the slots directly rather than through the properties.
 class Monitor(object):
+    __slots__ = ("logger", "_name", "_executionTime", "_invocationCount", "_waitTime", "_lastSampleTime",
+                 "_invocationsSinceLastSample", "_executionTimeSinceLastSample", "_waitTimeSinceLastSample",
+                 "_invocationsPerSecond", "_executionTimePerSecond", "_waitTimePerSecond", "_reportToElasticsearch",
+                 "_lastResponse", "_rawReference", "_activityOnLastSample")
+
     def __init__(self, name, loggerName="wmon"):
         self.logger = logging.getLogger(loggerName + "." + name)
 
@@ -23,6 +79,9 @@ class Monitor(object):
         self._waitTimePerSecond = 0
         self._reportToElasticsearch = False
         self._lastResponse = ""
+        self._rawReference = None
+
+        self._activityOnLastSample = False
 
     @property
     def name(self):
@@ -128,81 +187,174 @@ class Monitor(object):
     def lastResponse(self, value):
         self._lastResponse = value
 
-    def updateStats(self, responseJson, sampleTime):
-        self._lastResponse = responseJson
-
-        executionTime = 0
-        invocationCount = 0
-        waitTime = 0
+    @property
+    def activityOnLastSample(self):
+        return self._activityOnLastSample
 
-        # TODO: Make helper method
-        if "execution-time" in responseJson:
-            executionTime = responseJson["execution-time"]
+    @activityOnLastSample.setter
+    def activityOnLastSample(self, value):
+        self._activityOnLastSample = value
 
-        if "invocations" in responseJson:
-            invocationCount = responseJson["invocations"]
+    def updateStats(self, responseJson, sampleTime):
+        # Only kept when reported, or the response of every bean and method stays in memory until the next sample
+        if reportRawJson:
+            self._lastResponse = responseJson
 
-        if "wait-time" in responseJson:
-            waitTime = responseJson["wait-time"]
+        executionTime = responseJson.get("execution-time", 0)
+        invocationCount = responseJson.get("invocations", 0)
+        waitTime = responseJson.get("wait-time", 0)
 
         # If we are in the first pass for this bean, do not calc the avareges and so on
-        if self.lastSampleTime == 0:
-            self.reportToElasticsearch = True
+        if self._lastSampleTime == 0:
+            self._reportToElasticsearch = True
+            self._activityOnLastSample = False
         else:
-            if (self.executionTime == executionTime) and (self.invocationCount == invocationCount) and (
-                    self.waitTime == waitTime):
-                # No change in bean data, do not report - consider controlling this with an ENV var
-                self.reportToElasticsearch = False
-            else:
-                self.reportToElasticsearch = True
-
-                deltaTimeMilliseconds = int((sampleTime - self.lastSampleTime).total_seconds() * 1000)
-                self.logger.debug("Bean {0}, deltaTime: {1} ms".format(self.name, deltaTimeMilliseconds))
-
-                self.logger.debug("Bean {0}, self.invocationCount: {1}".format(self.name, self.invocationCount))
-                self.logger.debug(
-                    "Bean {0}, responseJson[\"invocations\"]: {1}".format(self.name, responseJson["invocations"]))
-                self.invocationsSinceLastSample = invocationCount - self.invocationCount
-                self.logger.debug(
-                    "Bean {0}, invocationsSinceLastSample: {1}".format(self.name, self.invocationsSinceLastSample))
-
-                self.logger.debug("Bean {0}, self.executionTime: {1}".format(self.name, self.executionTime))
-                self.logger.debug(
-                    "Bean {0}, responseJson[\"execution-time\"]: {1}".format(self.name,
-                                                                             responseJson["execution-time"]))
-                self.executionTimeSinceLastSample = executionTime - self.executionTime
-                self.logger.debug(
-                    "Bean {0}, executionTimeSinceLastSample: {1}".format(self.name, self.executionTimeSinceLastSample))
-
-                if deltaTimeMilliseconds > 0:
-                    # Calculate delta in pr. minute (millisecs / 60 / 1000)
-                    self.invocationsPerSecond = self.invocationsSinceLastSample / (deltaTimeMilliseconds / 1000)
-                    self.logger.debug("Bean {0}, invocationsDelta: {1}".format(self.name, self.invocationsPerSecond))
-                    self.executionTimePerSecond = self.executionTimeSinceLastSample / (deltaTimeMilliseconds / 1000)
-                    self.logger.debug("Bean {0}, executionsDelta: {1}".format(self.name, self.executionTimePerSecond))
+            if (self._executionTime == executionTime) and (self._invocationCount == invocationCount) and (
+                    self._waitTime == waitTime):
+                # TODO: No change in bean data, do not report - consider controlling this with an ENV var
+
+                # Last data point was reported, this data point is identical - we will report this one aswell, with the
+                # zero activity that it has had. This is in order to drop the stats that are charted in Kibana to "0"
+                if self._activityOnLastSample:
+                    self._calculateStats(executionTime, invocationCount, waitTime, sampleTime)
+                    self._reportToElasticsearch = True
                 else:
-                    self.invocationsPerSecond = 0
-                    self.executionTimePerSecond = 0
+                    self._reportToElasticsearch = False
+
+                self._activityOnLastSample = False
+
+            elif (self._executionTime > executionTime) or (self._invocationCount > invocationCount) or (
+                    self._waitTime > waitTime):
+                # This is the scenario is when a wildfly instance restarts. The counters will go back down.
+                # We could mark a restart here!
+                self._reportToElasticsearch = True
+                self._activityOnLastSample = True
+                # Reset all stats
+                self._invocationsSinceLastSample = 0
+                self._invocationsPerSecond = 0
+                self._executionTimeSinceLastSample = 0
+                self._executionTimePerSecond = 0
+                self._waitTimeSinceLastSample = 0
+                self._waitTimePerSecond = 0
+            else:
+                self._reportToElasticsearch = True
+                self._activityOnLastSample = True
+                self._calculateStats(executionTime, invocationCount, waitTime, sampleTime)
 
-        self.executionTime = executionTime
-        self.invocationCount = invocationCount
-        self.waitTime = waitTime
-        self.lastSampleTime = sampleTime
+        self._executionTime = executionTime
+        self._invocationCount = invocationCount
+        self._waitTime = waitTime
+        self._lastSampleTime = sampleTime
+
+    def _calculateStats(self, executionTime, invocationCount, waitTime, sampleTime):
+
+        deltaTimeMilliseconds = int((sampleTime - self._lastSampleTime).total_seconds() * 1000)
+
+        self._invocationsSinceLastSample = invocationCount - self._invocationCount
+        self._executionTimeSinceLastSample = executionTime - self._executionTime
+        self._waitTimeSinceLastSample = waitTime - self._waitTime
+
+        if deltaTimeMilliseconds > 0:
+            deltaTimeSeconds = deltaTimeMilliseconds / 1000
+            self._invocationsPerSecond = self._invocationsSinceLastSample / deltaTimeSeconds
+            self._executionTimePerSecond = self._executionTimeSinceLastSample / deltaTimeSeconds
+            self._waitTimePerSecond = self._waitTimeSinceLastSample / deltaTimeSeconds
+        else:
+            self._invocationsPerSecond = 0
+            self._executionTimePerSecond = 0
+            self._waitTimePerSecond = 0
+
+        # The debug output is only composed when it will be logged, this runs for every bean and method every cycle
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Bean %s, deltaTime: %s ms", self._name, deltaTimeMilliseconds)
+            self.logger.debug("Bean %s, invocations: %s -> %s, invocationsSinceLastSample: %s, invocationsDelta: %s",
+                              self._name, self._invocationCount, invocationCount, self._invocationsSinceLastSample,
+                              self._invocationsPerSecond)
+            self.logger.debug("Bean %s, execution-time: %s -> %s, executionTimeSinceLastSample: %s, "
+                              "executionsDelta: %s", self._name, self._executionTime, executionTime,
+                              self._executionTimeSinceLastSample, self._executionTimePerSecond)
+            self.logger.debug("Bean %s, wait-time: %s -> %s, waitTimeSinceLastSample: %s, waitTimeDelta: %s",
+                              self._name, self._waitTime, waitTime, self._waitTimeSinceLastSample,
+                              self._waitTimePerSecond)
+
+    def buildDocument(self, prefix="", fields=None):
+        # Builds the elasticsearch document of the monitor, with the keys of the prefix made once, and the fields, such
+        # as the bean name and sample time, added to the same dict
+        keys = getStatKeys(prefix)
 
-    def getMonitorStats(self, prefix=""):
         jsondoc = {
-            prefix + "invocations": self._invocationCount,
-            prefix + "invocations-since-last-sample": self._invocationsSinceLastSample,
-            prefix + "invocations-per-second": self._invocationsPerSecond,
-            prefix + "execution-time": self._executionTime,
-            prefix + "execution-time-since-last-sample": self._executionTimeSinceLastSample,
-            prefix + "execution-time-per-second": self._executionTimePerSecond,
-            prefix + "wait-time": self._waitTime,
-            prefix + "wait-time-since-last-sample": self._waitTimeSinceLastSample,
-            prefix + "wait-time-per-second": self._waitTimePerSecond
+            keys[0]: self._invocationCount,
+            keys[1]: self._invocationsSinceLastSample,
+            keys[2]: self._invocationsPerSecond,
+            keys[3]: self._executionTime,
+            keys[4]: self._executionTimeSinceLastSample,
+            keys[5]: self._executionTimePerSecond,
+            keys[6]: self._waitTime,
+            keys[7]: self._waitTimeSinceLastSample,
+            keys[8]: self._waitTimePerSecond
         }
 
         if reportRawJson:
-            jsondoc["raw-json"] = json.dumps(self._lastResponse)
+            self._rawReference = rawPayloads.addTo(jsondoc, self._lastResponse, self._rawReference)
+
+        if fields:
+            jsondoc.update(fields)
 
         return jsondoc
+
+    def getMonitorStats(self, prefix=""):
+        return self.buildDocument(prefix)
+
+
+class MethodMonitor(Monitor):
+    __slots__ = ("_beanMonitor",)
+
+    def __init__(self, beanMonitor, methodName):
+        super(MethodMonitor, self).__init__(methodName)
+        self._beanMonitor = beanMonitor
+
+    @property
+    def beanMonitor(self):
+        return self._beanMonitor
+
+
+# BeanMonitor is the class that we will use for holding information about a bean
+# that we are monitoring.
+class BeanMonitor(Monitor):
+    __slots__ = ("_methods", "_formattedSampleTime", "_formattedSampleTimeOf")
+
+    def __init__(self, beanName):
+        super(BeanMonitor, self).__init__(beanName)
+        self._methods = dict()
+        self._formattedSampleTime = None
+        self._formattedSampleTimeOf = None
+
+    @property
+    def methods(self):
+        return self._methods
+
+    @property
+    def formattedSampleTime(self):
+        # The sample time as reported in the documents, formatted once for the bean and all of its methods
+        if self._formattedSampleTimeOf is not self._lastSampleTime:
+            self._formattedSampleTime = formatSampleTime(self._lastSampleTime)
+            self._formattedSampleTimeOf = self._lastSampleTime
+
+        return self._formattedSampleTime
+
+    def updateStats(self, responseJson, sampleTime):
+        super(BeanMonitor, self).updateStats(responseJson, sampleTime)
+
+        # No methods have been invoked for the bean in question, when "methods" is missing or null
+        methodStatsByName = responseJson.get("methods")
+
+        if methodStatsByName:
+            methods = self._methods
+
+            for methodName, methodStats in methodStatsByName.items():
+                methodMonitor = methods.get(methodName)
+
+                if methodMonitor is None:
+                    methodMonitor = methods[methodName] = MethodMonitor(self, methodName)
+
+                methodMonitor.updateStats(methodStats, sampleTime)
@@ -0,0 +1,39 @@
+# A ManagementOperation is a single DMR operation that has been queued on a Wildfly instance. Queued operations are
+# sent together in one composite request when the instance is flushed, after which the outcome of each operation is
+# available here, and handed to the callback if one was given.
+class ManagementOperation(object):
+    def __init__(self, request_body, callback=None):
+        self._request_body = request_body
+        self._callback = callback
+
+        self._completed = False
+        self._success = False
+        self._result = None
+
+    @property
+    def requestBody(self):
+        return self._request_body
+
+    @property
+    def step(self):
+        return self._request_body
+
+    @property
+    def completed(self):
+        return self._completed
+
+    @property
+    def success(self):
+        return self._success
+
+    @property
+    def result(self):
+        return self._result
+
+    def complete(self, success, result):
+        self._completed = True
+        self._success = success
+        self._result = result
+
+        if self._callback is not None:
+            self._callback(success, result)
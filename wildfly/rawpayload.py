@@ -0,0 +1,201 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from jsoncodec import dumps, dumpb
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".rawpayload")
+
+# The raw json of a sample is either kept "inline" in the raw-json field of its document, or stored once for each
+# distinct content, as a document of the raw payload "index" or as a file of the "file" store, and referenced by its
+# hash from the raw-hash field of the documents
+STORE_INLINE = "inline"
+STORE_INDEX = "index"
+STORE_FILE = "file"
+STORES = (STORE_INLINE, STORE_INDEX, STORE_FILE)
+
+
+def stripCounters(responseJson, counterNames):
+    # The counters change with every invocation and are in the document already, without them the raw json of a bean
+    # or method stays the same for as long as its configuration and methods do
+    if not isinstance(responseJson, dict):
+        return responseJson
+
+    payload = dict((key, value) for key, value in responseJson.items() if key not in counterNames)
+
+    methods = payload.get("methods")
+    if methods:
+        payload["methods"] = dict((methodName, stripCounters(methodStats, counterNames))
+                                  for methodName, methodStats in methods.items())
+
+    return payload
+
+
+def sameWithoutCounters(responseJson, lastJson, counterNames):
+    # Whether stripCounters() makes the same payload of both, compared in place rather than built and serialised. The
+    # methods not invoked since the last sample are equal as they are, and are compared as a whole first
+    if responseJson is lastJson or responseJson == lastJson:
+        return True
+
+    if not isinstance(responseJson, dict) or not isinstance(lastJson, dict) or len(responseJson) != len(lastJson):
+        return False
+
+    for key, value in responseJson.items():
+        if key not in lastJson:
+            return False
+
+        if key in counterNames:
+            continue
+
+        lastValue = lastJson[key]
+
+        if key == "methods" and isinstance(value, dict) and isinstance(lastValue, dict):
+            if value.keys() != lastValue.keys():
+                return False
+
+            for methodName, methodStats in value.items():
+                if not sameWithoutCounters(methodStats, lastValue[methodName], counterNames):
+                    return False
+
+        elif value != lastValue:
+            return False
+
+    return True
+
+
+# RawPayloads stores the raw json of the samples by the hash of its content. A hash seen recently, held in a cache of
+# the cacheSize latest hashes, costs nothing more than hashing, a new one is handed to the dispatcher as a document of
+# its own, or written to a file named by the hash, once. The documents of the samples only carry the hash. The
+# counters, counterNames, are left out of the stored payloads.
+#
+# addTo() returns a reference, the response and its hash, for the caller to hand back with the next response of the
+# same bean or method. A response that is the same as the last but for its counters, the usual case, takes the hash of
+# the reference without serialising and hashing it again.
+class RawPayloads(object):
+    def __init__(self, store=STORE_INDEX, directory=None, cacheSize=10000, counterNames=()):
+        if store not in STORES:
+            raise ValueError("Unknown raw payload store {0}".format(store))
+
+        self._store = store
+        self._directory = directory
+        self._cacheSize = cacheSize
+        self._counterNames = frozenset(counterNames)
+        self._dispatcher = None
+
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+
+        self._referenceCounter = 0
+        self._storedCounter = 0
+        self._errorCounter = 0
+
+        self._directoryCreated = False
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def referenceCounter(self):
+        return self._referenceCounter
+
+    @property
+    def storedCounter(self):
+        return self._storedCounter
+
+    @property
+    def errorCounter(self):
+        return self._errorCounter
+
+    def setDispatcher(self, dispatcher):
+        # Receives the document of each payload not stored before, for the index store
+        self._dispatcher = dispatcher
+
+    def addTo(self, jsondoc, responseJson, lastReference=None):
+        if self._store == STORE_INLINE:
+            jsondoc["raw-json"] = dumps(responseJson)
+            return None
+
+        rawHash = self.reference(responseJson, lastReference)
+        jsondoc["raw-hash"] = rawHash
+
+        return responseJson, rawHash
+
+    def _seenAgain(self, rawHash):
+        with self._lock:
+            if rawHash not in self._seen:
+                return False
+
+            self._referenceCounter += 1
+            self._seen.move_to_end(rawHash)
+            return True
+
+    def reference(self, responseJson, lastReference=None):
+        if lastReference is not None:
+            lastJson, lastHash = lastReference
+
+            # Unless the hash has left the cache since, or its payload could not be stored
+            if sameWithoutCounters(responseJson, lastJson, self._counterNames) and self._seenAgain(lastHash):
+                return lastHash
+
+        # Sorted, so the same content always has the same hash
+        rawJson = dumpb(stripCounters(responseJson, self._counterNames), sortKeys=True)
+        rawHash = hashlib.blake2b(rawJson, digest_size=16).hexdigest()
+
+        with self._lock:
+            self._referenceCounter += 1
+
+            if rawHash in self._seen:
+                self._seen.move_to_end(rawHash)
+                return rawHash
+
+            self._seen[rawHash] = True
+            if len(self._seen) > self._cacheSize:
+                self._seen.popitem(last=False)
+
+        self._storePayload(rawHash, rawJson)
+
+        return rawHash
+
+    def _storePayload(self, rawHash, rawJson):
+        try:
+            if self._store == STORE_FILE:
+                self._writeFile(rawHash, rawJson)
+            elif self._dispatcher is not None:
+                self._dispatcher({"raw-hash": rawHash, "raw-json": rawJson.decode("utf-8")})
+
+            self._storedCounter += 1
+
+        except Exception as exception:
+            self._errorCounter += 1
+            # Forgotten, so the payload is stored again the next time it is seen
+            with self._lock:
+                self._seen.pop(rawHash, None)
+            logger.error("An error occurred when storing the raw payload {0}: {1}".format(rawHash, exception))
+
+    def _writeFile(self, rawHash, rawJson):
+        # Made on first use, the directory is not needed unless payloads are stored in it
+        if not self._directoryCreated:
+            os.makedirs(self._directory, exist_ok=True)
+            self._directoryCreated = True
+
+        path = os.path.join(self._directory, rawHash + ".json")
+
+        # Stored by an earlier run, or by another reporter sharing the directory
+        if os.path.exists(path):
+            return
+
+        # Written aside and moved in place, so a reader never sees half a payload
+        partialPath = "{0}.{1}.partial".format(path, threading.get_ident())
+        with open(partialPath, "wb") as payloadFile:
+            payloadFile.write(rawJson)
+        os.replace(partialPath, path)
+
+    def logStatistics(self):
+        logger.info("Raw payload stats: {0} references to {1} payloads stored in the {2} store, {3} errors, {4} "
+                    "hashes cached".format(self._referenceCounter, self._storedCounter, self._store,
+                                           self._errorCounter, len(self._seen)))
+
@@ -0,0 +1,217 @@
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from .monitor import STAT_NAMES, formatSampleTime
+from .layout import DATE_MAPPING, KEYWORD_MAPPING, DYNAMIC_TEMPLATES
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".rollup")
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def getWindowStart(sampleTime, seconds):
+    # Windows are aligned to the epoch, so the windows of every reporter and target line up
+    return EPOCH + timedelta(seconds=int((sampleTime - EPOCH).total_seconds()) // seconds * seconds)
+
+
+# A RollupWindow sums up the samples of one bean or method within a window: the deltas of the counters, the seconds
+# they were taken over, and the lowest and highest rates of the samples.
+class RollupWindow(object):
+    __slots__ = ("samples", "seconds", "sums", "minRates", "maxRates")
+
+    def __init__(self):
+        self.samples = 0
+        self.seconds = 0.0
+        self.sums = [0] * len(STAT_NAMES)
+        self.minRates = [None] * len(STAT_NAMES)
+        self.maxRates = [None] * len(STAT_NAMES)
+
+    def add(self, seconds, deltas, rates):
+        self.samples += 1
+        self.seconds += seconds
+
+        for position, rate in enumerate(rates):
+            self.sums[position] += deltas[position]
+
+            if self.minRates[position] is None or rate < self.minRates[position]:
+                self.minRates[position] = rate
+            if self.maxRates[position] is None or rate > self.maxRates[position]:
+                self.maxRates[position] = rate
+
+    def buildDocument(self, prefix):
+        jsondoc = {"samples": self.samples}
+
+        for position, statName in enumerate(STAT_NAMES):
+            key = prefix + statName
+            jsondoc[key] = self.sums[position]
+            jsondoc[key + "-per-second-min"] = self.minRates[position]
+            jsondoc[key + "-per-second-max"] = self.maxRates[position]
+            # Over the time covered by the samples, rather than the mean of their rates
+            jsondoc[key + "-per-second-mean"] = self.sums[position] / self.seconds if self.seconds > 0 else 0
+
+        invocations = self.sums[0]
+        jsondoc[prefix + "execution-time-per-invocation"] = self.sums[1] / invocations if invocations > 0 else 0
+        jsondoc[prefix + "wait-time-per-invocation"] = self.sums[2] / invocations if invocations > 0 else 0
+
+        return jsondoc
+
+
+def getRollupMapping():
+    # The mapping of the rollup documents, of beans and of methods
+    properties = {
+        "samples": {"type": "integer"},
+        "sample-time": DATE_MAPPING,
+        "window-start": DATE_MAPPING,
+        "window-end": DATE_MAPPING,
+        "window-seconds": {"type": "integer"},
+        "window-complete": {"type": "boolean"},
+        "bean-name": KEYWORD_MAPPING,
+        "method-name": KEYWORD_MAPPING,
+        "wildfly-host-url": KEYWORD_MAPPING,
+        "wildfly-alias": KEYWORD_MAPPING,
+        "monitor-name": KEYWORD_MAPPING
+    }
+
+    for prefix in ("bean-", "method-"):
+        for statName in STAT_NAMES:
+            key = prefix + statName
+            properties[key] = {"type": "long"}
+
+            for suffix in ("-per-second-min", "-per-second-max", "-per-second-mean"):
+                properties[key + suffix] = {"type": "float"}
+
+        properties[prefix + "execution-time-per-invocation"] = {"type": "float"}
+        properties[prefix + "wait-time-per-invocation"] = {"type": "float"}
+
+    return {"dynamic_templates": DYNAMIC_TEMPLATES, "properties": properties}
+
+
+# MonitorRollups rolls the samples of the bean and method monitors up into windows of the given lengths in seconds,
+# such as a minute and a quarter of an hour. Every sample a monitor takes is added to the current window of each
+# length: the deltas and rates calculated by the monitor when it reported, or no activity when it did not. Once a
+# window has ended, closeDue() hands a document for every bean and method sampled in it to the dispatcher. The first
+# sample seen of a monitor only sets where the next one starts from.
+#
+# A sample arriving after its window was closed, such as one taken on a worker thread as the cycle ended, is added to
+# the next window rather than lost.
+class MonitorRollups(object):
+    def __init__(self, windows, dispatcher, fields=None):
+        self._windows = sorted(windows)
+        self._dispatcher = dispatcher
+        self._fields = fields or dict()
+
+        self._lock = threading.Lock()
+        # The sample time last seen of each bean and method
+        self._lastSampleTimes = dict()
+        # The rollups of each bean and method in the open windows, by window length and start
+        self._open = dict((seconds, dict()) for seconds in self._windows)
+        self._closedUntil = dict((seconds, EPOCH) for seconds in self._windows)
+
+        self._documentCounter = 0
+
+    @property
+    def windows(self):
+        return self._windows
+
+    @property
+    def documentCounter(self):
+        return self._documentCounter
+
+    def _observe(self, key, monitor):
+        sampleTime = monitor.lastSampleTime
+
+        if sampleTime == 0:
+            return
+
+        lastSampleTime = self._lastSampleTimes.get(key)
+        if lastSampleTime == sampleTime:
+            return
+
+        self._lastSampleTimes[key] = sampleTime
+
+        if lastSampleTime is None:
+            return
+
+        if monitor.reportToElasticsearch:
+            deltas = (monitor.invocationsSinceLastSample, monitor.executionTimeSinceLastSample,
+                      monitor.waitTimeSinceLastSample)
+            rates = (monitor.invocationsPerSecond, monitor.executionTimePerSecond, monitor.waitTimePerSecond)
+        else:
+            deltas = rates = (0, 0, 0)
+
+        seconds = (sampleTime - lastSampleTime).total_seconds()
+
+        for windowSeconds in self._windows:
+            windowStart = max(getWindowStart(sampleTime, windowSeconds), self._closedUntil[windowSeconds])
+            rollups = self._open[windowSeconds].get(windowStart)
+
+            if rollups is None:
+                rollups = self._open[windowSeconds][windowStart] = dict()
+
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollup = rollups[key] = RollupWindow()
+
+            rollup.add(seconds, deltas, rates)
+
+    def observeBeanMonitor(self, beanMonitor):
+        # Adds the samples the bean, and its methods, took since they were last observed
+        with self._lock:
+            self._observe((beanMonitor.name, None), beanMonitor)
+
+            for methodMonitor in beanMonitor.methods.values():
+                self._observe((beanMonitor.name, methodMonitor.name), methodMonitor)
+
+    def _closeWindow(self, windowSeconds, windowStart, rollups, complete):
+        windowEnd = windowStart + timedelta(seconds=windowSeconds)
+        windowFields = {
+            "sample-time": formatSampleTime(windowStart),
+            "window-start": formatSampleTime(windowStart),
+            "window-end": formatSampleTime(windowEnd),
+            "window-seconds": windowSeconds,
+            "window-complete": complete
+        }
+
+        for (beanName, methodName), rollup in rollups.items():
+            jsondoc = rollup.buildDocument("bean-" if methodName is None else "method-")
+            jsondoc["bean-name"] = beanName
+            if methodName is not None:
+                jsondoc["method-name"] = methodName
+            jsondoc.update(windowFields)
+            jsondoc.update(self._fields)
+
+            self._dispatcher(jsondoc)
+            self._documentCounter += 1
+
+    def _takeWindows(self, now):
+        closed = list()
+
+        with self._lock:
+            for windowSeconds in self._windows:
+                windows = self._open[windowSeconds]
+
+                for windowStart in sorted(windows):
+                    windowEnd = windowStart + timedelta(seconds=windowSeconds)
+
+                    if now is None or windowEnd <= now:
+                        closed.append((windowSeconds, windowStart, windows.pop(windowStart)))
+                        self._closedUntil[windowSeconds] = max(self._closedUntil[windowSeconds], windowEnd)
+
+        return closed
+
+    def closeDue(self, now=None):
+        # Dispatches the windows that ended by now, in sample time
+        closed = self._takeWindows(now or datetime.utcnow())
+
+        for windowSeconds, windowStart, rollups in closed:
+            self._closeWindow(windowSeconds, windowStart, rollups, True)
+
+        return len(closed)
+
+    def close(self):
+        # Dispatches the windows still open, as incomplete, on the way out
+        for windowSeconds, windowStart, rollups in self._takeWindows(None):
+            self._closeWindow(windowSeconds, windowStart, rollups, False)
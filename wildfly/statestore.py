@@ -0,0 +1,177 @@
+import os
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .monitor import reportRawJson, rawPayloads, getStatKeys, STAT_NAMES
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logPath = "statestore"
+logger = logging.getLogger(monitorName + "." + logPath)
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+# The ColumnarStateStore keeps the state that a Monitor keeps, for all beans and methods of a target, in NumPy arrays
+# with one row per bean or method. The rows are found through a (bean name, method name) to slot table, the method
+# name is None for the row of the bean itself.
+#
+# Samples are staged with addBeanSample() during a cycle, and computeCycle() then works out the deltas, per second
+# rates, counter resets and which rows to report for all of them in a handful of array operations. The outcome is the
+# same as calling Monitor.updateStats() on each of them: the first sample of a row is reported without rates, an
+# unchanged row is reported once with zero activity after it has been active, and a row whose counters went down, a
+# restarted server, is reported with everything zeroed.
+class ColumnarStateStore(object):
+    def __init__(self, capacity=1024):
+        self._slots = dict()
+        self._keys = list()
+        self._lastResponses = list()
+        self._rawReferences = list()
+
+        self._capacity = 0
+        self._counters = np.zeros((0, len(STAT_NAMES)), dtype=np.int64)
+        self._deltas = np.zeros((0, len(STAT_NAMES)), dtype=np.int64)
+        self._rates = np.zeros((0, len(STAT_NAMES)), dtype=np.float64)
+        self._sampleTimes = np.zeros(0, dtype=np.int64)
+        self._sampled = np.zeros(0, dtype=bool)
+        self._activity = np.zeros(0, dtype=bool)
+        self._report = np.zeros(0, dtype=bool)
+        self._grow(capacity)
+
+        self._stagedSlots = list()
+        self._stagedValues = list()
+        self._stagedTimes = list()
+
+    @property
+    def size(self):
+        return len(self._keys)
+
+    def _grow(self, capacity):
+        extra = capacity - self._capacity
+
+        self._counters = np.concatenate((self._counters, np.zeros((extra, len(STAT_NAMES)), dtype=np.int64)))
+        self._deltas = np.concatenate((self._deltas, np.zeros((extra, len(STAT_NAMES)), dtype=np.int64)))
+        self._rates = np.concatenate((self._rates, np.zeros((extra, len(STAT_NAMES)), dtype=np.float64)))
+        self._sampleTimes = np.concatenate((self._sampleTimes, np.zeros(extra, dtype=np.int64)))
+        self._sampled = np.concatenate((self._sampled, np.zeros(extra, dtype=bool)))
+        self._activity = np.concatenate((self._activity, np.zeros(extra, dtype=bool)))
+        self._report = np.concatenate((self._report, np.zeros(extra, dtype=bool)))
+
+        self._capacity = capacity
+
+    def slot(self, beanName, methodName=None):
+        key = (beanName, methodName)
+        slot = self._slots.get(key)
+
+        if slot is None:
+            slot = len(self._keys)
+
+            if slot >= self._capacity:
+                self._grow(self._capacity * 2)
+
+            self._slots[key] = slot
+            self._keys.append(key)
+            self._lastResponses.append(None)
+            self._rawReferences.append(None)
+
+        return slot
+
+    def addSample(self, beanName, methodName, responseJson, sampleTime):
+        slot = self.slot(beanName, methodName)
+
+        self._stagedSlots.append(slot)
+        self._stagedValues.append((responseJson.get("invocations", 0),
+                                   responseJson.get("execution-time", 0),
+                                   responseJson.get("wait-time", 0)))
+        self._stagedTimes.append((sampleTime - EPOCH) // MICROSECOND)
+        # Only kept when reported, or every response of the cycle stays in memory until the next
+        if reportRawJson:
+            self._lastResponses[slot] = responseJson
+
+    def addBeanSample(self, beanName, responseJson, sampleTime):
+        self.addSample(beanName, None, responseJson, sampleTime)
+
+        # "methods" is missing, or null, when no methods have been invoked on the bean
+        for methodName, methodStats in (responseJson.get("methods") or dict()).items():
+            self.addSample(beanName, methodName, methodStats, sampleTime)
+
+    def discardCycle(self):
+        # Drops the samples staged so far, of a cycle that failed, and reports nothing until the next cycle
+        self._report[:] = False
+        self._stagedSlots = list()
+        self._stagedValues = list()
+        self._stagedTimes = list()
+
+    def computeCycle(self):
+        self._report[:] = False
+
+        if len(self._stagedSlots) == 0:
+            return 0
+
+        slots = np.array(self._stagedSlots, dtype=np.intp)
+        values = np.array(self._stagedValues, dtype=np.int64).reshape(-1, len(STAT_NAMES))
+        times = np.array(self._stagedTimes, dtype=np.int64)
+
+        self._stagedSlots = list()
+        self._stagedValues = list()
+        self._stagedTimes = list()
+
+        previous = self._counters[slots]
+        deltas = values - previous
+
+        first = ~self._sampled[slots]
+        unchanged = ~first & np.all(deltas == 0, axis=1)
+        reset = ~first & ~unchanged & np.any(deltas < 0, axis=1)
+        changed = ~first & ~unchanged & ~reset
+        # The zero activity sample following an active one is reported, so charts drop back to 0
+        settled = unchanged & self._activity[slots]
+        calculate = changed | settled
+
+        # Rates are pr. second over the whole milliseconds between the two samples, as Monitor._calculateStats(), the
+        # sample times are kept in microseconds
+        deltaSeconds = ((times[calculate] - self._sampleTimes[slots[calculate]]) // 1000) / 1000
+        positive = deltaSeconds > 0
+        rates = np.zeros((len(deltaSeconds), len(STAT_NAMES)), dtype=np.float64)
+        rates[positive] = deltas[calculate][positive] / deltaSeconds[positive, np.newaxis]
+
+        self._deltas[slots[calculate]] = deltas[calculate]
+        self._rates[slots[calculate]] = rates
+        self._deltas[slots[reset]] = 0
+        self._rates[slots[reset]] = 0
+
+        self._report[slots] = first | reset | changed | settled
+        self._activity[slots] = reset | changed
+        self._counters[slots] = values
+        self._sampleTimes[slots] = times
+        self._sampled[slots] = True
+
+        return int(np.count_nonzero(self._report))
+
+    def reportedStats(self, beanPrefix="bean-", methodPrefix="method-"):
+        # Yields (bean name, method name, sample time, stats) for the rows to report, the stats carry the same fields
+        # as Monitor.getMonitorStats()
+        reported = np.flatnonzero(self._report[:len(self._keys)])
+
+        counters = self._counters[reported].tolist()
+        deltas = self._deltas[reported].tolist()
+        rates = self._rates[reported].tolist()
+        sampleTimes = self._sampleTimes[reported].tolist()
+
+        beanKeys = getStatKeys(beanPrefix)
+        methodKeys = getStatKeys(methodPrefix)
+
+        for row, slot in enumerate(reported.tolist()):
+            beanName, methodName = self._keys[slot]
+            keys = beanKeys if methodName is None else methodKeys
+
+            stats = dict(zip(keys, (counters[row][0], deltas[row][0], rates[row][0],
+                                    counters[row][1], deltas[row][1], rates[row][1],
+                                    counters[row][2], deltas[row][2], rates[row][2])))
+
+            if reportRawJson:
+                self._rawReferences[slot] = rawPayloads.addTo(stats, self._lastResponses[slot],
+                                                              self._rawReferences[slot])
+
+            yield beanName, methodName, EPOCH + sampleTimes[row] * MICROSECOND, stats
@@ -0,0 +1,188 @@
+import os
+import json
+import codecs
+import logging
+
+monitorName = os.getenv("MONITOR_NAME", "wildfly-monitor")
+logger = logging.getLogger(monitorName + ".stream")
+
+# With WILDFLY_STREAM_RESPONSES set, the recursive reads of the ejb3 subsystem are parsed as they come off the wire and
+# handed over a bean at a time, rather than read and parsed whole before the first bean is sampled (subsystem
+# collection mode only)
+streamResponses = os.getenv("WILDFLY_STREAM_RESPONSES", "False") in ("True", "1", "Yes")
+
+# The bytes read from a response at a time
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = " \t\n\r"
+
+
+class StreamError(ValueError):
+    pass
+
+
+# A StreamReader parses json from the chunks of a response body as they arrive, holding no more of the body than the
+# value being parsed. iterObject() walks down the keys of a path, and yields the entries of the object found there one
+# at a time, such as the beans of a recursive read of the ejb3 subsystem. Objects beside the path are passed over an
+# entry at a time, their other values are kept in fields, such as the outcome of a management operation.
+#
+# Values are parsed by the C scanner of the json module, which tells where a value ends. A value that is not complete
+# in the buffer is parsed again once the buffer has grown to twice its length, so a large value is not parsed over and
+# over for every chunk.
+class StreamReader(object):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._scanner = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self._ended = False
+
+        self.found = False
+        self.fields = dict()
+
+    def _fill(self, minLength):
+        # Reads chunks until at least minLength characters are left to parse, or the body has ended, and drops what
+        # has been parsed
+        parts = [self._buffer[self._position:]]
+        length = len(parts[0])
+
+        while length < minLength and not self._ended:
+            chunk = next(self._chunks, None)
+
+            if chunk is None:
+                self._ended = True
+                text = self._decoder.decode(b"", True)
+            else:
+                text = self._decoder.decode(chunk)
+
+            parts.append(text)
+            length += len(text)
+
+        self._buffer = "".join(parts)
+        self._position = 0
+
+    def peek(self):
+        # The next character that is not whitespace, without consuming it
+        while True:
+            buffer = self._buffer
+            position = self._position
+
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+
+            self._position = position
+
+            if position < len(buffer):
+                return buffer[position]
+
+            if self._ended:
+                raise StreamError("The response ended unexpectedly")
+
+            self._fill(1)
+
+    def next(self):
+        character = self.peek()
+        self._position += 1
+
+        return character
+
+    def expect(self, expected):
+        character = self.next()
+
+        if character != expected:
+            raise StreamError("Expected '{0}' in the response, but got '{1}'".format(expected, character))
+
+    def readValue(self):
+        self.peek()
+
+        while True:
+            try:
+                value, end = self._scanner.raw_decode(self._buffer, self._position)
+
+                # A number at the end of the buffer may go on in the next chunk
+                if end < len(self._buffer) or self._ended:
+                    self._position = end
+                    return value
+
+            except ValueError:
+                if self._ended:
+                    raise
+
+            self._fill(max(2 * (len(self._buffer) - self._position), CHUNK_SIZE))
+
+    def _endOfEntry(self):
+        # Whether the entry just read was the last of its object
+        separator = self.next()
+
+        if separator == "}":
+            return True
+        if separator != ",":
+            raise StreamError("Expected ',' or '}}' in the response, but got '{0}'".format(separator))
+
+        return False
+
+    def skipObject(self):
+        self.expect("{")
+
+        if self.peek() == "}":
+            self.next()
+            return
+
+        while True:
+            self.readValue()
+            self.expect(":")
+
+            if self.peek() == "{":
+                self.skipObject()
+            else:
+                self.readValue()
+
+            if self._endOfEntry():
+                return
+
+    def iterObject(self, path=()):
+        self.expect("{")
+
+        if not path:
+            self.found = True
+
+        if self.peek() == "}":
+            self.next()
+            return
+
+        while True:
+            key = self.readValue()
+            self.expect(":")
+
+            if not path:
+                yield key, self.readValue()
+            elif key == path[0]:
+                if self.peek() == "{":
+                    for entry in self.iterObject(path[1:]):
+                        yield entry
+                else:
+                    # The key is there, but null, when there is nothing at the path
+                    self.readValue()
+                    self.found = self.found or len(path) == 1
+            elif self.peek() == "{":
+                self.skipObject()
+            else:
+                self.fields[key] = self.readValue()
+
+            if self._endOfEntry():
+                return
+
+
+def readStreamedObject(response, path, consumer):
+    # Hands the entries of the object at the path of a streamed response to the consumer, and returns the reader once
+    # they are all read, with the fields passed over and whether the path was found. The response is closed either way
+    reader = StreamReader(response.iter_content(CHUNK_SIZE))
+
+    try:
+        for key, value in reader.iterObject(path):
+            consumer(key, value)
+    finally:
+        response.close()
+
+    return reader